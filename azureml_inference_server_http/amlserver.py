@@ -41,8 +41,15 @@ def print_server_settings():
         ENV_AZUREML_CONFIG_FILE: "Config File",
         ENV_WORKER_COUNT: "Worker Count",
         ENV_WORKER_TIMEOUT: "Worker Timeout (seconds)",
+        ENV_WORKER_THREADS: "Worker Threads",
+        ENV_WORKER_MAX_REQUESTS: "Worker Max Requests",
+        ENV_WORKER_MAX_REQUESTS_JITTER: "Worker Max Requests Jitter",
+        ENV_WORKER_MAX_MEMORY_MB: "Worker Max Memory (MB)",
+        ENV_EXECUTOR_COUNT: "Executor Count",
+        ENV_EXECUTOR_BUFFER_MB: "Executor Buffer (MB)",
         ENV_PORT: "Server Port",
         ENV_HEALTH_PORT: "Health Port",
+        ENV_GRPC_PORT: "gRPC Port",
         ENV_AML_APP_INSIGHTS_ENABLED: "Application Insights Enabled",
         ENV_AML_APP_INSIGHTS_KEY: "Application Insights Key",
         ENV_AZUREML_SERVER_VERSION: "Inferencing HTTP server version",
@@ -75,6 +82,9 @@ def print_routes():
     print("---------------")
     print(f"Liveness Probe: GET   127.0.0.1:{os.environ[ENV_HEALTH_PORT]}/")
     print(f"Score:          POST  127.0.0.1:{os.environ[ENV_PORT]}/score")
+    print(f"Infer (v2):     POST  127.0.0.1:{os.environ[ENV_PORT]}/v2/models/<SERVICE_NAME>/infer")
+    if ENV_GRPC_PORT in os.environ:
+        print(f"Score (gRPC):   Score 127.0.0.1:{os.environ[ENV_GRPC_PORT]}")
     print()
 
 
@@ -137,6 +147,8 @@ def merge_configuration(args):
     transport_protocol = "rest" if args.rest else "grpc"
     set_environment_variables(transport_protocol, ENV_BACKEND_TRANSPORT_PROTOCOL, default_val=False)
 
+    set_environment_variables(args.grpc_port, ENV_GRPC_PORT)
+
     set_environment_variables(args.model_dir, ENV_AZUREML_MODEL_DIR)
     set_environment_variables(args.worker_count, ENV_WORKER_COUNT, default_val=DEFAULT_WORKER_COUNT)
 
@@ -1,22 +1,77 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import logging
 import os
 import sys
 
 import gunicorn.app.wsgiapp
 
 from .constants import (
+    DEFAULT_EXECUTOR_BUFFER_MB,
+    DEFAULT_EXECUTOR_COUNT,
     DEFAULT_HEALTH_PORT,
     DEFAULT_HOST,
     DEFAULT_PORT,
     DEFAULT_WORKER_COUNT,
+    DEFAULT_WORKER_MAX_MEMORY_MB,
+    DEFAULT_WORKER_MAX_REQUESTS,
     DEFAULT_WORKER_PRELOAD,
+    DEFAULT_WORKER_THREADS,
     DEFAULT_WORKER_TIMEOUT_SECONDS,
+    ENV_EXECUTOR_BUFFER_MB,
+    ENV_EXECUTOR_COUNT,
+    ENV_WORKER_MAX_MEMORY_MB,
+    ENV_WORKER_MAX_REQUESTS,
     ENV_WORKER_PRELOAD,
+    ENV_WORKER_THREADS,
     ENV_WORKER_TIMEOUT,
 )
 
+logger = logging.getLogger("azmlinfsrv")
+
+
+def start_executors():
+    # The executors are started before gunicorn so that the workers it forks inherit the pool.
+    executor_count = int(os.environ.get(ENV_EXECUTOR_COUNT, DEFAULT_EXECUTOR_COUNT))
+    if executor_count <= 0:
+        return
+
+    from .server import executor_pool
+
+    buffer_size = int(os.environ.get(ENV_EXECUTOR_BUFFER_MB, DEFAULT_EXECUTOR_BUFFER_MB)) * 1024 * 1024
+    try:
+        executor_pool.start_pool(executor_count, buffer_size)
+    except executor_pool.ExecutorStartupError as ex:
+        logger.error(f"Failed to start the executors:\n{ex}")
+        sys.exit(3)
+
+
+def start_rate_limiter():
+    # The rate limiter is created before gunicorn so that the workers it forks share its table.
+    from .server import rate_limiter
+
+    rate_limiter.start_limiter()
+
+
+def start_shared_metrics(worker_count):
+    # The metrics table is created before gunicorn so that the workers it forks share it.
+    from .server import metrics
+
+    metrics.start_shared_metrics(worker_count)
+
+
+def start_health_monitor(host, health_port, worker_count):
+    # The health probes are answered by the gunicorn master, so that they do not queue behind scoring requests.
+    from .server import health_monitor
+
+    timeout_s = float(os.environ.get(ENV_WORKER_TIMEOUT, DEFAULT_WORKER_TIMEOUT_SECONDS))
+    try:
+        health_monitor.start_monitor(host, health_port, worker_count, timeout_s)
+    except OSError as ex:
+        logger.error(f"Failed to listen for health probes on port {health_port}: {ex}")
+        sys.exit(3)
+
 
 def run(host, port, worker_count, health_port=None):
     #
@@ -36,25 +91,37 @@ def run(host, port, worker_count, health_port=None):
         str(worker_count),
         "--timeout",
         os.environ.get(ENV_WORKER_TIMEOUT, DEFAULT_WORKER_TIMEOUT_SECONDS),
-        # Access log file setting required to capture log messages from
-        # gunicorn and user script
-        "--access-logfile",
-        "-",
+        # The access log is written by the app (see _after_request in server/routes.py), not by gunicorn.
         # Not sending error logs to /dev/null results in them being output
         # twice. Once by our log handler, once to the gunicorn log handler
         "--error-logfile",
         "/dev/null",
     ]
 
-    if health_port:
-        sys.argv.insert(1, "-b")
-        sys.argv.insert(2, f"{host}:{health_port}")
-
     if os.environ.get(ENV_WORKER_PRELOAD, DEFAULT_WORKER_PRELOAD).lower() == "true":
         sys.argv.append("--preload")
 
+    # More than one thread switches gunicorn to the threaded worker so a worker can serve concurrent requests. Note
+    # that scoring timeouts are only enforced on the main thread.
+    worker_threads = os.environ.get(ENV_WORKER_THREADS, DEFAULT_WORKER_THREADS)
+    if int(worker_threads) > 1:
+        sys.argv.extend(["--threads", worker_threads])
+
+    # Workers are recycled from within (see server/worker_recycler.py) rather than with gunicorn's --max-requests, so
+    # that only one worker is recycled at a time. Give a recycled worker as long as a request may take to drain.
+    max_requests = int(os.environ.get(ENV_WORKER_MAX_REQUESTS, DEFAULT_WORKER_MAX_REQUESTS))
+    max_memory_mb = int(os.environ.get(ENV_WORKER_MAX_MEMORY_MB, DEFAULT_WORKER_MAX_MEMORY_MB))
+    if max_requests > 0 or max_memory_mb > 0:
+        sys.argv.extend(["--graceful-timeout", os.environ.get(ENV_WORKER_TIMEOUT, DEFAULT_WORKER_TIMEOUT_SECONDS)])
+
     sys.argv.append("azureml_inference_server_http.server.entry:app")
 
+    start_executors()
+    start_rate_limiter()
+    start_shared_metrics(worker_count)
+    if health_port:
+        start_health_monitor(host, health_port, worker_count)
+
     gunicorn.app.wsgiapp.WSGIApplication("%(prog)s [OPTIONS] [APP_MODULE]").run()
 
 
@@ -3,6 +3,8 @@
 
 """AMLRequest class used by score.py that needs raw HTTP access"""
 
+from typing import Callable, Optional
+
 from flask import Request
 
 _rawHttpRequested = False
@@ -30,6 +32,31 @@ def rawhttp(func):
     return func
 
 
+# `cacheable` is an attribute to be applied on run() function in score.py to let clients and the caches in between
+# (CDNs, reverse proxies) reuse the responses to GET requests.
+#
+# Example score.py:
+#
+# from azureml_inference_server_http.api.aml_request import cacheable
+#
+# @cacheable(cache_control="public, max-age=300")
+# def run(data):
+#   ...
+#
+# The successful responses to GET /score get a strong `ETag` computed from their body and a `Cache-Control` header
+# (AML_CACHE_CONTROL when `cache_control` is not given), and requests whose `If-None-Match` matches are answered with
+# 304. run() is still invoked for those requests, so it must return the same output for the same query.
+def cacheable(func: Optional[Callable] = None, *, cache_control: Optional[str] = None):
+    """Attribute applied to run() function in score.py to mark the responses to GET requests cacheable"""
+
+    def decorate(func: Callable) -> Callable:
+        func._azureml_cacheable = True
+        func._azureml_cache_control = cache_control
+        return func
+
+    return decorate(func) if func is not None else decorate
+
+
 # Only exists to avoid score.py have dependency on Flask directly
 class AMLRequest(Request):
     """AMLRequest class used by score.py that needs raw HTTP access"""
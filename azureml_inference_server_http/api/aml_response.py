@@ -30,5 +30,8 @@ class AMLResponse(Response):
         # If the user run() want to response repeated headers, comma should be used as the seperator
         # https://www.w3.org/Protocols/rfc2616/rfc2616-sec4.html#sec4.2
         for header, value in response_headers.items():
+            if "," not in value:
+                self.headers.add_header(header, value.strip())
+                continue
             for v in value.split(","):
                 self.headers.add_header(header, v.strip())
@@ -54,6 +54,12 @@ def parse_arguments():
     parser.add_argument(
         "--health_port", required=False, type=validate_port, help="The health port of the server. Default is 5000."
     )
+    parser.add_argument(
+        "--grpc_port",
+        required=False,
+        type=validate_port,
+        help="The port of the gRPC scoring endpoint. The endpoint is disabled unless a port is given.",
+    )
     parser.add_argument(
         "--worker_count",
         required=False,
@@ -15,6 +15,13 @@ DEFAULT_WORKER_COUNT = 1
 DEFAULT_APPINSIGHTS_ENABLED = "false"
 DEFAULT_WORKER_TIMEOUT_SECONDS = "300"
 DEFAULT_WORKER_PRELOAD = "false"
+DEFAULT_WORKER_THREADS = "1"
+DEFAULT_WORKER_MAX_REQUESTS = "0"
+DEFAULT_WORKER_MAX_REQUESTS_JITTER = "0"
+DEFAULT_WORKER_MAX_MEMORY_MB = "0"
+DEFAULT_EXECUTOR_COUNT = "0"
+DEFAULT_EXECUTOR_BUFFER_MB = "64"
+DEFAULT_LOG_QUEUE_SIZE = "10000"
 
 
 # Environment Variables
@@ -27,8 +34,16 @@ ENV_AML_APP_INSIGHTS_KEY = "AML_APP_INSIGHTS_KEY"
 ENV_WORKER_COUNT = "WORKER_COUNT"
 ENV_WORKER_TIMEOUT = "WORKER_TIMEOUT"
 ENV_WORKER_PRELOAD = "WORKER_PRELOAD"
+ENV_WORKER_THREADS = "WORKER_THREADS"
+ENV_WORKER_MAX_REQUESTS = "WORKER_MAX_REQUESTS"
+ENV_WORKER_MAX_REQUESTS_JITTER = "WORKER_MAX_REQUESTS_JITTER"
+ENV_WORKER_MAX_MEMORY_MB = "WORKER_MAX_MEMORY_MB"
+ENV_EXECUTOR_COUNT = "EXECUTOR_COUNT"
+ENV_EXECUTOR_BUFFER_MB = "EXECUTOR_BUFFER_MB"
+ENV_LOG_QUEUE_SIZE = "AML_LOG_QUEUE_SIZE"
 ENV_PORT = "SERVER_PORT"
 ENV_HEALTH_PORT = "HEALTH_PORT"
+ENV_GRPC_PORT = "GRPC_PORT"
 ENV_BACKEND_TRANSPORT_PROTOCOL = "TRANSPORT_PROTOCOL"
 ENV_AZUREML_SERVER_VERSION = "HTTP_X_MS_SERVER_VERSION"
 ENV_AZUREML_SERVER_VERSION_ENABLED = "SERVER_VERSION_LOG_RESPONSE_ENABLED"
@@ -4,13 +4,30 @@
 import json
 import logging
 import logging.config
+import logging.handlers
 import os
+import queue
+import threading
 import time
+from typing import List
+import weakref
+
+from .constants import DEFAULT_LOG_QUEUE_SIZE, ENV_LOG_QUEUE_SIZE
+
+# Maximum number of records written to a stream at once by the log listener.
+LOG_BATCH_SIZE = 256
+
+# Queue handlers alive in this process, so that they can be reset after a fork.
+_queue_handlers: "weakref.WeakSet[LogQueueHandler]" = weakref.WeakSet()
 
 
 class RootAccessFilter(logging.Filter):
+    """Deprecated. It filtered the requests to / out of the Gunicorn access log, which is no longer written (the server
+    writes its own access log). Kept as a no-op so that logging configs referencing it still load.
+    """
+
     def filter(self, record: logging.LogRecord):
-        return "GET / HTTP/1.1" not in record.getMessage()
+        return True
 
 
 class AMLLogFormatter(logging.Formatter):
@@ -24,6 +41,142 @@ class AMLLogFormatter(logging.Formatter):
         self.converter = time.gmtime
 
 
+class _BatchingQueueListener(logging.handlers.QueueListener):
+    """Writes the records of a LogQueueHandler in batches: a stream is written to and flushed once per batch."""
+
+    def __init__(self, owner: "LogQueueHandler"):
+        super().__init__(owner.queue, *owner.targets, respect_handler_level=True)
+        self.owner = owner
+        self._batch: List[logging.LogRecord] = []
+        self._reported_dropped = 0
+
+    def handle(self, record: logging.LogRecord) -> None:
+        self._batch.append(self.prepare(record))
+        if len(self._batch) >= LOG_BATCH_SIZE or self.queue.empty():
+            self.flush()
+
+    def stop(self) -> None:
+        super().stop()
+        self.flush()
+
+    def flush(self) -> None:
+        batch, self._batch = self._batch, []
+        dropped = self.owner.dropped - self._reported_dropped
+        if dropped:
+            message = f"Dropped {dropped} log records because the log queue was full"
+            batch.append(
+                logging.makeLogRecord(
+                    {"name": "azmlinfsrv", "levelno": logging.WARNING, "levelname": "WARNING", "msg": message}
+                )
+            )
+            self._reported_dropped += dropped
+
+        for handler in self.handlers:
+            records = [record for record in batch if record.levelno >= handler.level]
+            if not records:
+                continue
+            # Subclasses of StreamHandler may write records in their own way, so only plain streams are batched.
+            if type(handler) is logging.StreamHandler:
+                _write_batch(handler, records)
+            else:
+                for record in records:
+                    handler.handle(record)
+
+
+def _write_batch(handler: logging.StreamHandler, records: List[logging.LogRecord]) -> None:
+    lines = []
+    for record in records:
+        if handler.filter(record):
+            try:
+                lines.append(handler.format(record) + handler.terminator)
+            except Exception:
+                handler.handleError(record)
+
+    handler.acquire()
+    try:
+        handler.stream.write("".join(lines))
+        handler.stream.flush()
+    except Exception:
+        handler.handleError(records[-1])
+    finally:
+        handler.release()
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Hands records over to a listener thread that writes them to ``targets``, so that the thread logging a record
+    never waits on a slow stream.
+
+    The queue holds at most ``maxsize`` records. When it is full, records are dropped and counted, and the listener
+    logs how many were dropped once it catches up. The listener is started on the first record logged in each process,
+    as threads do not survive a fork.
+    """
+
+    def __init__(self, targets: List[logging.Handler], maxsize: int):
+        super().__init__(queue.Queue(maxsize))
+        self.targets = targets
+        self.maxsize = maxsize
+        # Number of records dropped because the queue was full
+        self.dropped = 0
+        self._reset()
+        _queue_handlers.add(self)
+
+    def _reset(self) -> None:
+        self._start_lock = threading.Lock()
+        self._listener = None
+        self._listener_pid = None
+
+    def _after_fork(self) -> None:
+        # The queue and its locks may have been in use by another thread when the process forked.
+        self.queue = queue.Queue(self.maxsize)
+        self._reset()
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self._listener_pid != os.getpid():
+            self._start_listener()
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start_listener(self) -> None:
+        with self._start_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener = _BatchingQueueListener(self)
+            self._listener.start()
+            self._listener_pid = os.getpid()
+
+    def flush(self) -> None:
+        """Wait until the queued records are written."""
+        if self._listener_pid == os.getpid():
+            self.queue.join()
+
+    def close(self) -> None:
+        # Write out the queued records, e.g. when the logging config is reloaded or the process exits.
+        if self._listener and self._listener_pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._listener_pid = None
+        super().close()
+
+
+def _reset_queue_handlers() -> None:
+    for handler in list(_queue_handlers):
+        handler._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_queue_handlers)
+
+
+def enable_log_queue(logger: logging.Logger, maxsize: int) -> None:
+    """Move the handlers of ``logger`` behind a LogQueueHandler."""
+    if maxsize <= 0 or not logger.handlers:
+        return
+    logger.handlers = [LogQueueHandler(logger.handlers, maxsize)]
+
+
 def load_logging_config(root_dir: str, silent: bool = False) -> bool:
     # Handle `None`, empty strings, and non-existent directories
     if root_dir and os.path.isdir(root_dir):
@@ -34,6 +187,9 @@ def load_logging_config(root_dir: str, silent: bool = False) -> bool:
                 logging_config = json.load(f)
 
             logging.config.dictConfig(logging_config)
+            enable_log_queue(
+                logging.getLogger("azmlinfsrv"), int(os.environ.get(ENV_LOG_QUEUE_SIZE, DEFAULT_LOG_QUEUE_SIZE))
+            )
             if not silent:
                 logging.getLogger("azmlinfsrv").info(f"Loaded logging config from {config_path}")
             return True
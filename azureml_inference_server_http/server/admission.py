@@ -0,0 +1,278 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import collections
+import contextlib
+import threading
+import time
+from typing import Callable, Deque, Dict, Iterator, Optional
+
+from .config import PriorityClass
+
+# Header through which clients tag a request with its priority class
+PRIORITY_HEADER = "x-ms-priority"
+
+# Time in seconds after which clients are asked to retry a request that was shed.
+RETRY_AFTER_S = 1
+
+# Tenant under which the metrics of the tenants without a configured weight are counted
+OTHER_TENANTS = "other"
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed, because the admission queue is full or because it waited too long."""
+
+
+class _Waiter:
+    __slots__ = ["priority_class", "tenant", "enqueued_at", "event", "granted", "shed"]
+
+    def __init__(self, priority_class: str, tenant: str):
+        self.priority_class = priority_class
+        self.tenant = tenant
+        self.enqueued_at = time.perf_counter()
+        self.event = threading.Event()
+        self.granted = False
+        self.shed = False
+
+
+class TenantStats:
+    """Admission metrics of a tenant."""
+
+    __slots__ = ["queued", "admitted", "shed", "wait_s"]
+
+    def __init__(self):
+        # Number of requests waiting to be admitted
+        self.queued = 0
+        # Number of requests admitted and shed so far
+        self.admitted = 0
+        self.shed = 0
+        # Total time the admitted and shed requests waited, in seconds
+        self.wait_s = 0.0
+
+    def copy(self) -> "TenantStats":
+        stats = TenantStats()
+        for field in self.__slots__:
+            setattr(stats, field, getattr(self, field))
+        return stats
+
+
+class _Level:
+    """The requests waiting at one priority level, in one queue per tenant. The tenants are served by deficit round
+    robin: each turn, a tenant may have as many requests admitted as its quantum, and what it could not use carries
+    over to its next turn.
+    """
+
+    def __init__(self, quantum: Callable[[str], float]):
+        self.quantum = quantum
+        self.queues: Dict[str, Deque[_Waiter]] = {}
+        # The tenants with waiting requests, in the order they are served
+        self.order: Deque[str] = collections.deque()
+        self.deficits: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def push(self, waiter: _Waiter) -> None:
+        queue = self.queues.get(waiter.tenant)
+        if queue is None:
+            queue = self.queues[waiter.tenant] = collections.deque()
+            self.order.append(waiter.tenant)
+            self.deficits[waiter.tenant] = self.quantum(waiter.tenant)
+        queue.append(waiter)
+
+    def pop(self, eligible: Callable[[_Waiter], bool]) -> Optional[_Waiter]:
+        """Remove and return the next request to admit, skipping the tenants whose next request is not eligible."""
+        # The quanta are at least 1, so a tenant with an eligible request is served within two passes over the tenants.
+        for _ in range(2 * len(self.order)):
+            tenant = self.order[0]
+            waiter = self.queues[tenant][0]
+            if not eligible(waiter):
+                self.order.rotate(-1)
+            elif self.deficits[tenant] >= 1:
+                self.deficits[tenant] -= 1
+                self.remove(waiter)
+                return waiter
+            else:
+                # The tenant has used up its turn. Its next turn comes after the other tenants.
+                self.deficits[tenant] += self.quantum(tenant)
+                self.order.rotate(-1)
+        return None
+
+    def remove(self, waiter: _Waiter) -> None:
+        queue = self.queues[waiter.tenant]
+        queue.remove(waiter)
+        if not queue:
+            del self.queues[waiter.tenant]
+            del self.deficits[waiter.tenant]
+            self.order.remove(waiter.tenant)
+
+    def newest_of_longest(self) -> _Waiter:
+        """Return the request that arrived last from the tenant with the longest queue relative to its quantum."""
+        tenant = max(self.order, key=lambda name: len(self.queues[name]) / self.quantum(name))
+        return self.queues[tenant][-1]
+
+
+class AdmissionController:
+    """Limits the number of requests a worker scores at a time to ``concurrency``. The other requests wait in a queue,
+    where requests of classes with a lower ``priority`` value are admitted first. The requests of a class never take
+    more than its ``share`` of ``concurrency``.
+
+    Within a priority level, every tenant has its own queue, and the queues are served by deficit round robin in
+    proportion to ``tenant_weights`` (``default_tenant_weight`` for the tenants without a weight), so that the burst of
+    a tenant cannot take all the slots. The requests of a tenant are admitted in the order they arrived.
+
+    When more than ``queue_size`` requests are waiting, a request of the lowest priority level is shed: the one that
+    arrived last from the tenant with the longest queue.
+
+    ``on_change`` is called with the number of requests being scored and the metrics of the tenants whenever they
+    change, with the lock of the controller held.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        queue_size: int,
+        classes: Dict[str, PriorityClass],
+        default_class: str,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        default_tenant_weight: float = 1.0,
+        on_change: Optional[Callable[[int, Dict[str, TenantStats]], None]] = None,
+    ):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.classes = classes
+        self.default_class = default_class
+        # Class names are matched case-insensitively.
+        self._names = {name.lower(): name for name in classes}
+
+        # Every class may take at least one slot, whatever its share.
+        self._limits = {name: max(1, int(c.share * concurrency)) for name, c in classes.items()}
+        self._running = dict.fromkeys(classes, 0)
+        self._active = 0
+
+        # The quantum of a tenant is its weight divided by the smallest weight, so that it is at least 1.
+        self.tenant_weights = tenant_weights or {}
+        min_weight = min([default_tenant_weight, *self.tenant_weights.values()])
+        self._quanta = {tenant: weight / min_weight for tenant, weight in self.tenant_weights.items()}
+        self._default_quantum = default_tenant_weight / min_weight
+
+        self._levels = {c.priority: _Level(self._quantum) for c in classes.values()}
+        self._queued = 0
+        self._stats: Dict[str, TenantStats] = collections.defaultdict(TenantStats)
+        self._on_change = on_change
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> int:
+        """Number of requests being scored."""
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        """Number of requests waiting to be admitted."""
+        return self._queued
+
+    def get_class(self, name: Optional[str]) -> str:
+        """Return the priority class called ``name``, or the default class if there is none."""
+        return self._names.get((name or "").strip().lower(), self.default_class)
+
+    def stats(self) -> Dict[str, TenantStats]:
+        """Return the admission metrics of the tenants. The tenants without a configured weight are counted together
+        under ``OTHER_TENANTS``, so that the number of metrics does not depend on the clients.
+        """
+        with self._lock:
+            return {tenant: stats.copy() for tenant, stats in self._stats.items()}
+
+    @contextlib.contextmanager
+    def admit(self, priority_class: str, timeout_s: float, tenant: str = "") -> Iterator[None]:
+        """Wait until a request of ``priority_class`` from ``tenant`` may be scored, for up to ``timeout_s`` seconds.
+        Raises AdmissionRejected if the request is shed.
+        """
+        self._acquire(priority_class, tenant, timeout_s)
+        try:
+            yield
+        finally:
+            self._release(priority_class)
+
+    def _quantum(self, tenant: str) -> float:
+        return self._quanta.get(tenant, self._default_quantum)
+
+    def _stats_of(self, tenant: str) -> TenantStats:
+        return self._stats[tenant if tenant in self.tenant_weights else OTHER_TENANTS]
+
+    @contextlib.contextmanager
+    def _updating(self) -> Iterator[None]:
+        # Holds the lock while the state of the controller changes, and then passes its metrics to on_change.
+        with self._lock:
+            try:
+                yield
+            finally:
+                if self._on_change:
+                    self._on_change(self._active, self._stats)
+
+    def _acquire(self, priority_class: str, tenant: str, timeout_s: float) -> None:
+        waiter = _Waiter(priority_class, tenant)
+        with self._updating():
+            self._levels[self.classes[priority_class].priority].push(waiter)
+            self._queued += 1
+            self._stats_of(tenant).queued += 1
+            self._dispatch()
+            if waiter.granted:
+                return
+            if self._queued > self.queue_size:
+                lowest = max(priority for priority, level in self._levels.items() if level)
+                self._shed(self._levels[lowest].newest_of_longest())
+            if waiter.shed:
+                raise AdmissionRejected("The admission queue is full.")
+
+        waiter.event.wait(timeout_s)
+
+        with self._updating():
+            if waiter.granted:
+                return
+            if not waiter.shed:
+                self._shed(waiter)
+                raise AdmissionRejected(f"The request waited more than {timeout_s:g} s to be admitted.")
+        raise AdmissionRejected("The request was shed to make room in the admission queue.")
+
+    def _release(self, priority_class: str) -> None:
+        with self._updating():
+            self._running[priority_class] -= 1
+            self._active -= 1
+            self._dispatch()
+
+    def _dequeue(self, waiter: _Waiter) -> TenantStats:
+        # Called with the lock when the waiter leaves its queue. Returns the metrics of its tenant.
+        self._levels[self.classes[waiter.priority_class].priority].remove(waiter)
+        return self._count_dequeued(waiter)
+
+    def _count_dequeued(self, waiter: _Waiter) -> TenantStats:
+        self._queued -= 1
+        stats = self._stats_of(waiter.tenant)
+        stats.queued -= 1
+        stats.wait_s += time.perf_counter() - waiter.enqueued_at
+        return stats
+
+    def _shed(self, waiter: _Waiter) -> None:
+        # Called with the lock.
+        self._dequeue(waiter).shed += 1
+        waiter.shed = True
+        waiter.event.set()
+
+    def _has_slot(self, waiter: _Waiter) -> bool:
+        return self._running[waiter.priority_class] < self._limits[waiter.priority_class]
+
+    def _dispatch(self) -> None:
+        # Admit waiting requests while there are free slots, from the lowest priority value up, skipping the requests
+        # whose class has used up its share. Called with the lock.
+        for priority in sorted(self._levels):
+            level = self._levels[priority]
+            while self._active < self.concurrency and level:
+                waiter = level.pop(self._has_slot)
+                if waiter is None:
+                    break
+                self._count_dequeued(waiter).admitted += 1
+                self._running[waiter.priority_class] += 1
+                self._active += 1
+                waiter.granted = True
+                waiter.event.set()
@@ -6,16 +6,45 @@ import logging
 import logging.config
 import os
 import sys
+import threading
 import traceback
+from typing import Any, Callable, Dict, Optional
 
-from flask import Blueprint
+from flask import Blueprint, Response
 
+from . import executor_pool, grpc_transport, health_monitor
+from .admission import AdmissionController
 from .appinsights_client import AppInsightsClient
-from .config import config
+from .async_operations import AsyncOperations
+from .config import config, ConfigFileWatcher
+from .input_parsers import RawRequestInput
+from .load_tracker import LoadTracker
+from .memory_tracker import MemoryTracker
+from .metrics import get_shared_metrics, SharedMetrics
+from .model_watcher import ModelWatcher
+from .rate_limiter import get_limiter, RateLimiter, start_limiter
 from .swagger import Swagger
 from .user_script import UserScript, UserScriptError
-from .utils import walk_path
-from ..constants import SERVER_ROOT
+from .utils import exception_key, install_alarm_handler, LogThrottle, SharedLock, walk_path
+from .warmup import warm_up
+from .worker_recycler import WorkerRecycler
+from ..constants import (
+    DEFAULT_EXECUTOR_COUNT,
+    DEFAULT_HOST,
+    DEFAULT_WORKER_MAX_MEMORY_MB,
+    DEFAULT_WORKER_MAX_REQUESTS,
+    DEFAULT_WORKER_MAX_REQUESTS_JITTER,
+    DEFAULT_WORKER_PRELOAD,
+    DEFAULT_WORKER_THREADS,
+    ENV_AZUREML_SERVER_VERSION,
+    ENV_EXECUTOR_COUNT,
+    ENV_WORKER_MAX_MEMORY_MB,
+    ENV_WORKER_MAX_REQUESTS,
+    ENV_WORKER_MAX_REQUESTS_JITTER,
+    ENV_WORKER_PRELOAD,
+    ENV_WORKER_THREADS,
+    SERVER_ROOT,
+)
 from ..print_log_hook import set_print_logger_redirect
 
 # check if flask_cors is available
@@ -38,13 +67,47 @@ if config.source_dir:
 logger = logging.getLogger("azmlinfsrv")
 
 
+def _is_preloaded() -> bool:
+    return os.environ.get(ENV_WORKER_PRELOAD, DEFAULT_WORKER_PRELOAD).lower() == "true"
+
+
+def _run_in_workers(fn: Callable[[], None]) -> None:
+    # Call fn in each process forked from this one, which is the gunicorn master when the app is preloaded. Processes
+    # forked by the workers themselves (such as the scoring processes) are skipped.
+    master_pid = os.getpid()
+    os.register_at_fork(after_in_child=lambda: os.getppid() == master_pid and fn())
+
+
+def _longest_scoring_timeout_s() -> float:
+    # Requests of a priority class with its own timeout may run longer than SCORING_TIMEOUT_MS.
+    timeouts = [c.timeout_ms for c in config.priority_classes.values() if c.timeout_ms]
+    return max([config.scoring_timeout, *timeouts]) / 1000
+
+
 class AMLInferenceBlueprint(Blueprint):
+    admission: Optional[AdmissionController] = None
     appinsights_client: AppInsightsClient
+    async_operations: Optional[AsyncOperations] = None
+    config_watcher: Optional[ConfigFileWatcher] = None
+    load_tracker: Optional[LoadTracker] = None
+    model_watcher: Optional[ModelWatcher] = None
+    rate_limiter: Optional[RateLimiter] = None
+    shared_metrics: Optional[SharedMetrics] = None
+    # Requests in progress in the worker, when it reports to the health monitor
+    request_progress: Optional[health_monitor.RequestProgress] = None
+    # Value of the x-ms-server-version header of the responses
+    server_version: str = ""
+    worker_recycler: Optional[WorkerRecycler] = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.user_script = UserScript(config.entry_script)
+        # Held in shared mode while scoring, and exclusively while a new model version is loaded. See ModelWatcher.
+        self.model_lock = SharedLock()
+        self.log_throttle = LogThrottle(config.log_throttle_window, self._report_suppressed)
+        self._cors_after_request: Optional[Callable[[Response], Response]] = None
+        self.after_request(self._apply_cors)
 
     def _init_logger(self):
         try:
@@ -65,20 +128,16 @@ class AMLInferenceBlueprint(Blueprint):
             )
             sys.exit(3)
 
-    def send_exception_to_app_insights(self, request_id="NoRequestId", client_request_id=""):
-        if self.appinsights_client is not None:
-            self.appinsights_client.send_exception_log(sys.exc_info(), request_id, client_request_id)
-
-    def setup(self):
-        # initiliaze logger and app insights
-        self._init_logger()
-        self._init_appinsights()
-
-        # Enable CORS if the environemnt variable is set
+    def _init_cors(self):
+        self._cors_after_request = None
         if config.cors_origins:
             if flask_cors:
                 originsList = [origin.strip() for origin in config.cors_origins.split(",")]
-                flask_cors.CORS(self, methods=["GET", "POST"], origins=originsList)
+                # flask_cors bakes the origins into the after_request hook it registers. Build that hook on a scratch
+                # blueprint so that it can be swapped out when the origins are reloaded.
+                scratch = Blueprint("cors", __name__)
+                flask_cors.CORS(scratch, methods=["GET", "POST"], origins=originsList)
+                self._cors_after_request = scratch.after_request_funcs[None][0]
                 logger.info(f"Enabling CORS for the following origins: {', '.join(originsList)}")
             # if flask_cors package is not available and environ variable is set then log appropriate message
             else:
@@ -87,6 +146,313 @@ class AMLInferenceBlueprint(Blueprint):
                     " resolved by adding flask-cors to your pip dependencies."
                 )
 
+    def _apply_cors(self, response: Response) -> Response:
+        if self._cors_after_request:
+            return self._cors_after_request(response)
+        return response
+
+    def _init_config_watcher(self):
+        if self.config_watcher:
+            self.config_watcher.stop()
+            self.config_watcher = None
+
+        if config.config_reload_interval:
+            self.config_watcher = ConfigFileWatcher(config.config_reload_interval, self._on_config_reload)
+            if _is_preloaded():
+                # Threads do not survive a fork. With preloading, watch the config file from each worker instead.
+                _run_in_workers(self.config_watcher.start)
+            else:
+                self.config_watcher.start()
+            logger.info(f"Watching the config file for changes every {config.config_reload_interval} seconds")
+
+    def _on_config_reload(self, changed: Dict[str, Any]):
+        if "log_level" in changed:
+            logging.getLogger("azmlinfsrv").setLevel(config.log_level)
+        if "cors_origins" in changed:
+            self._init_cors()
+
+    def _init_model_watcher(self):
+        if self.model_watcher:
+            self.model_watcher.stop()
+            self.model_watcher = None
+
+        if config.model_watch_interval and self.user_script.executor_pool:
+            logger.warning("Model hot-swap is not supported with executors. New model versions will not be loaded.")
+        elif config.model_watch_interval:
+            self.model_watcher = ModelWatcher(
+                config.model_watch_interval, self.user_script, self._swap_user_script, self.model_lock
+            )
+            if _is_preloaded():
+                _run_in_workers(self.model_watcher.start)
+            else:
+                self.model_watcher.start()
+            logger.info(f"Watching for new model versions every {config.model_watch_interval} seconds")
+
+    def _swap_user_script(self, user_script: UserScript):
+        # Requests read `self.user_script` once per call, so rebinding it switches traffic atomically. Requests already
+        # running against the previous script finish on it.
+        swagger = Swagger(config.app_root, SERVER_ROOT, user_script)
+        if self.user_script.memory_tracker:
+            user_script.memory_tracker = self.user_script.memory_tracker
+            user_script.memory_tracker.take_baseline()
+        previous_runner = self.user_script.isolated_runner
+        if previous_runner:
+            user_script.start_isolated_runner()
+        self.user_script, self.swagger = user_script, swagger
+        if previous_runner:
+            # Let the request in progress on the previous scoring process complete.
+            threading.Thread(target=previous_runner.close, daemon=True).start()
+        self.appinsights_client._model_ids = self.appinsights_client._get_model_ids()
+
+    def _init_grpc_server(self):
+        if not config.grpc_port:
+            return
+
+        if not grpc_transport.grpc:
+            logger.error(
+                "The gRPC endpoint cannot be started because the grpcio package is not installed. The issue can be"
+                " resolved by installing azureml-inference-server-http[grpc]."
+            )
+            return
+
+        if _is_preloaded():
+            # gRPC does not survive a fork. With preloading the app is set up in the gunicorn master, so start the
+            # server in each worker instead.
+            _run_in_workers(self._start_grpc_server)
+        else:
+            self._start_grpc_server()
+
+    def _start_grpc_server(self):
+        self.grpc_server, port = grpc_transport.serve(self, DEFAULT_HOST, config.grpc_port)
+        logger.info(f"gRPC scoring endpoint listening on port {port}")
+        if not (self.user_script.executor_pool or config.isolated_scoring_enabled):
+            logger.warning(
+                "gRPC calls run in threads of the worker, where the scoring timeout and the call deadline are not"
+                " enforced, alongside the requests to the HTTP endpoints. Enable isolated scoring or executors to"
+                " enforce them."
+            )
+
+    def _init_executor_pool(self) -> bool:
+        # Returns whether run() is dispatched to the executors, in which case the user script was initialized and
+        # warmed up by the executor supervisor and the worker only parses requests.
+        pool = executor_pool.get_pool()
+        if pool is None:
+            if int(os.environ.get(ENV_EXECUTOR_COUNT, DEFAULT_EXECUTOR_COUNT)) > 0:
+                logger.warning("Executors are only supported with gunicorn on Linux. run() will run in the worker.")
+            return False
+
+        self.user_script.executor_pool = pool
+        logger.info(f"Dispatching run() to {pool.count} executors")
+        return True
+
+    def _init_isolated_runner(self):
+        if not config.isolated_scoring_enabled:
+            return
+
+        if self.user_script.executor_pool:
+            logger.info("run() already runs in executors, isolated scoring is not needed.")
+            return
+
+        if not hasattr(os, "fork"):
+            logger.error("Isolated scoring is not supported on this platform. run() will run in the worker.")
+            return
+
+        if _is_preloaded():
+            _run_in_workers(self.user_script.start_isolated_runner)
+        else:
+            self.user_script.start_isolated_runner()
+
+    def _init_single_flight(self):
+        # Identical requests are only concurrent with WORKER_THREADS greater than 1, in which case run() is called from
+        # threads other than the main thread, where the scoring timeout is not enforced.
+        if config.single_flight_enabled and not (self.user_script.executor_pool or config.isolated_scoring_enabled):
+            logger.warning(
+                "Coalesced requests run in threads of the worker, where the scoring timeout is not enforced. Enable"
+                " isolated scoring or executors to enforce it."
+            )
+
+    def _init_memory_tracker(self):
+        if not config.memory_tracking_enabled:
+            return
+
+        if self.user_script.executor_pool:
+            logger.warning("Memory tracking does not cover the executors and is disabled.")
+            return
+
+        tracker = MemoryTracker(config.memory_tracking_window, config.memory_leak_threshold_mb)
+        tracker.start()
+        self.user_script.memory_tracker = tracker
+        logger.info(
+            f"Memory tracking is enabled. Memory growth over {tracker.window} requests above"
+            f" {config.memory_leak_threshold_mb} MB will be reported."
+        )
+
+    def _init_worker_recycler(self):
+        max_requests = int(os.environ.get(ENV_WORKER_MAX_REQUESTS, DEFAULT_WORKER_MAX_REQUESTS))
+        max_requests_jitter = int(os.environ.get(ENV_WORKER_MAX_REQUESTS_JITTER, DEFAULT_WORKER_MAX_REQUESTS_JITTER))
+        max_memory_mb = int(os.environ.get(ENV_WORKER_MAX_MEMORY_MB, DEFAULT_WORKER_MAX_MEMORY_MB))
+        if max_requests <= 0 and max_memory_mb <= 0:
+            return
+
+        self.worker_recycler = WorkerRecycler(max_requests, max_requests_jitter, max_memory_mb)
+        if _is_preloaded():
+            # With preloading, a worker is ready as soon as it is forked from the gunicorn master.
+            _run_in_workers(self.worker_recycler.on_ready)
+        else:
+            self.worker_recycler.on_ready()
+
+    def _init_admission(self):
+        self.admission = None
+        self.shared_metrics = None
+        if not config.max_concurrent_requests:
+            return
+
+        # Under gunicorn the workers share their metrics through a table created in the master. Otherwise the metrics
+        # of the single process are served.
+        self.shared_metrics = get_shared_metrics()
+        self.admission = AdmissionController(
+            config.max_concurrent_requests,
+            config.admission_queue_size,
+            config.priority_classes,
+            config.default_priority_class,
+            config.tenant_weights,
+            config.default_tenant_weight,
+            self.shared_metrics.publish if self.shared_metrics else None,
+        )
+        logger.info(
+            f"Admission control is enabled. Each worker scores up to {config.max_concurrent_requests} requests at a"
+            f" time, with priority classes {', '.join(config.priority_classes)}."
+        )
+        # A single-threaded worker receives one request at a time, so requests never wait to be admitted.
+        if int(os.environ.get(ENV_WORKER_THREADS, DEFAULT_WORKER_THREADS)) <= 1:
+            logger.warning(
+                f"{ENV_WORKER_THREADS} is 1, so requests never wait in the admission queue of a worker: priority"
+                " classes only apply their scoring timeouts. Set it to more than 1 for requests to be queued by"
+                " priority."
+            )
+
+    def _init_load_tracker(self):
+        self.load_tracker = None
+        if not (config.readiness_high_watermark or config.load_headers_enabled):
+            return
+
+        # A worker scores as many requests at a time as it has threads, unless admission control limits it further.
+        capacity = config.max_concurrent_requests or int(os.environ.get(ENV_WORKER_THREADS, DEFAULT_WORKER_THREADS))
+        self.load_tracker = LoadTracker(
+            capacity, config.readiness_high_watermark, config.readiness_low_watermark, self.admission
+        )
+        if config.readiness_high_watermark:
+            logger.info(
+                f"A worker is not ready while {config.readiness_high_watermark} scoring requests are pending, until"
+                f" {self.load_tracker.low_watermark} are left."
+            )
+
+    def _init_rate_limiter(self):
+        if not config.rate_limit_per_second:
+            self.rate_limiter = None
+            return
+
+        # Under gunicorn the rate limiter is created in the master, so that the workers share it. Otherwise there is a
+        # single process to limit.
+        self.rate_limiter = get_limiter() or start_limiter()
+        logger.info(
+            f"Rate limiting is enabled. Clients identified by the {config.rate_limit_header} header may send"
+            f" {config.rate_limit_per_second} requests per second, in bursts of up to {self.rate_limiter.burst:g}."
+        )
+
+    def _init_async_operations(self):
+        self.async_operations = None
+        if not config.async_scoring_enabled:
+            return
+
+        if isinstance(self.user_script.input_parser, RawRequestInput):
+            logger.warning("run() is decorated with @rawhttp, so requests are always answered synchronously.")
+        elif not (self.user_script.executor_pool or config.isolated_scoring_enabled):
+            logger.warning(
+                "Background scoring jobs run in a thread of the worker, where the scoring timeout is not enforced."
+                " Enable isolated scoring or executors to enforce it."
+            )
+
+        # The threads running the jobs are started with the first job, so this is safe to do before the workers fork.
+        try:
+            self.async_operations = AsyncOperations(
+                config.async_spool_dir, config.async_result_ttl, config.async_workers, config.async_max_pending
+            )
+        except OSError:
+            logger.error(f"The spool directory of asynchronous scoring cannot be used: {traceback.format_exc()}")
+            sys.exit(3)
+        logger.info(f"Asynchronous scoring is enabled. Results are kept in {self.async_operations.spool_dir}")
+
+    def _init_health_monitor(self):
+        # The health monitor is started by the gunicorn master when health probes have their own port. The worker
+        # reports to it once it is set up.
+        monitor = health_monitor.get_monitor()
+        if monitor is None:
+            return
+
+        # A worker whose requests stall, for instance in a run() that hangs, stops being live. A request may take as
+        # long as its scoring timeout, which can be reloaded, before it is expected to make progress.
+        self.request_progress = health_monitor.RequestProgress(_longest_scoring_timeout_s)
+
+        def register():
+            monitor.register(
+                lambda: self.load_tracker is not None and self.load_tracker.saturated, self.request_progress
+            )
+
+        if _is_preloaded():
+            _run_in_workers(register)
+        else:
+            register()
+
+    def _init_lean_mode(self):
+        if not config.lean_mode:
+            return
+
+        # Keep the handler of the scoring timeout installed, so that each request only arms and disarms the timer.
+        # When the app is preloaded, the workers inherit the handler from the gunicorn master.
+        install_alarm_handler()
+        logger.info("Lean mode is enabled.")
+
+    def send_exception_to_app_insights(self, request_id="NoRequestId", client_request_id=""):
+        if self.appinsights_client is not None:
+            self.appinsights_client.send_exception_log(sys.exc_info(), request_id, client_request_id)
+
+    def log_exception(self, request_id="NoRequestId", client_request_id=""):
+        """Log the exception being handled and send it to App Insights. With ``AML_LOG_THROTTLE_WINDOW_SECONDS`` set,
+        identical exceptions are logged and sent once per window, so that requests failing in a storm do not all pay
+        for formatting and exporting the same traceback. The occurrences suppressed in a window are reported when it
+        expires.
+        """
+        ex = sys.exc_info()[1]
+        # Name the exception raised by the user script rather than its wrapper.
+        name = type(getattr(ex, "user_ex", None) or ex).__qualname__
+        suppressed = self.log_throttle.admit(exception_key(ex), f"The exception {name}")
+        if suppressed is None:
+            return
+
+        self.send_exception_to_app_insights(request_id, client_request_id)
+        message = "Encountered Exception: {0}".format(traceback.format_exc())
+        if suppressed:
+            message += f"The same exception occurred {suppressed} more times since it was last logged."
+        logger.error(message)
+
+    def _report_suppressed(self, description: str, count: int):
+        message = (
+            f"{description} occurred {count} more times in the last {self.log_throttle.window_s} seconds without being"
+            " logged."
+        )
+        logger.warning(message)
+        if self.appinsights_client is not None:
+            self.appinsights_client.send_suppressed_log(message, count)
+
+    def setup(self):
+        # initiliaze logger and app insights
+        self._init_logger()
+        self._init_appinsights()
+
+        # Enable CORS if the environemnt variable is set
+        self._init_cors()
+
         try:
             self.user_script.load_script(config.app_root)
         except UserScriptError:
@@ -105,27 +471,35 @@ class AMLInferenceBlueprint(Blueprint):
                 logger.error(traceback.format_exc())
             sys.exit(3)
 
-        try:
-            self.user_script.invoke_init()
-        except UserScriptError:
-            logger.error("User's init function failed")
-            logger.error("Encountered Exception {0}".format(traceback.format_exc()))
-            self.appinsights_client.send_exception_log(sys.exc_info())
+        if not self._init_executor_pool():
+            try:
+                self.user_script.invoke_init()
+            except UserScriptError:
+                logger.error("User's init function failed")
+                logger.error("Encountered Exception {0}".format(traceback.format_exc()))
+                self.appinsights_client.send_exception_log(sys.exc_info())
 
-            aml_model_dir = config.azureml_model_dir
-            if aml_model_dir and os.path.exists(aml_model_dir):
-                logger.info("Model Directory Contents:")
+                aml_model_dir = config.azureml_model_dir
+                if aml_model_dir and os.path.exists(aml_model_dir):
+                    logger.info("Model Directory Contents:")
 
-                tree = walk_path(aml_model_dir)
-                for line in itertools.islice(tree, FILE_TREE_LOG_LINE_LIMIT):
-                    logger.info(line)
+                    tree = walk_path(aml_model_dir)
+                    for line in itertools.islice(tree, FILE_TREE_LOG_LINE_LIMIT):
+                        logger.info(line)
 
-                if next(tree, None):
-                    logger.info(f"Output Truncated. First {FILE_TREE_LOG_LINE_LIMIT} lines shown.")
+                    if next(tree, None):
+                        logger.info(f"Output Truncated. First {FILE_TREE_LOG_LINE_LIMIT} lines shown.")
 
-            self.appinsights_client.wait_for_upload()
+                self.appinsights_client.wait_for_upload()
 
-            sys.exit(3)
+                sys.exit(3)
+
+            # Pay the lazy initialization costs of the model runtime before the worker accepts traffic. Warm-up is best
+            # effort: a failing payload is logged but does not stop the worker.
+            try:
+                warm_up(self.user_script)
+            except Exception:
+                logger.error("Warm-up request failed: {0}".format(traceback.format_exc()))
 
         # init debug middlewares deprecated
         if "AML_DBG_MODEL_INFO" in os.environ or "AML_DBG_RESOURCE_INFO" in os.environ:
@@ -136,6 +510,24 @@ class AMLInferenceBlueprint(Blueprint):
         # generate the swagger
         self.swagger = Swagger(config.app_root, SERVER_ROOT, self.user_script)
 
+        # Fork the scoring processes before starting the threads below.
+        self._init_isolated_runner()
+        self._init_single_flight()
+        self._init_config_watcher()
+        self._init_model_watcher()
+        self._init_grpc_server()
+        self._init_worker_recycler()
+        self._init_memory_tracker()
+        self._init_admission()
+        self._init_load_tracker()
+        self._init_rate_limiter()
+        self._init_async_operations()
+        self._init_lean_mode()
+        self._init_health_monitor()
+
+        # The server version is set before the workers start, so it is read once rather than for every response.
+        self.server_version = os.environ.get(ENV_AZUREML_SERVER_VERSION, "")
+
         logger.info(f"Scoring timeout is set to {config.scoring_timeout}")
         logger.info(f"Worker with pid {os.getpid()} ready for serving traffic")
 
@@ -195,6 +195,22 @@ class AppInsightsClient(object):
         except Exception as ex:
             self.log_app_insights_exception(ex)
 
+    def send_suppressed_log(self, message, count):
+        # Reports the identical exceptions that were not sent in a throttling window, with their count.
+        try:
+            if not self.enabled:
+                return
+            properties = {
+                "custom_dimensions": {
+                    "Container Id": self._container_id,
+                    "Suppressed Count": count,
+                }
+            }
+
+            logger.warning(message, extra=properties)
+        except Exception as ex:
+            self.log_app_insights_exception(ex)
+
     def _calc_duration(self, duration):
         local_duration = duration or 0
         duration_parts = []
@@ -0,0 +1,61 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Reading and writing of request and response bodies in the Apache Arrow IPC streaming format. See
+https://arrow.apache.org/docs/format/Columnar.html#ipc-streaming-format for the specification.
+"""
+
+from typing import Any, Optional
+
+import flask
+
+# check if pyarrow and pandas are available
+try:
+    import pyarrow as pa
+except ModuleNotFoundError:
+    pa = None
+
+try:
+    import pandas as pd
+except ModuleNotFoundError:
+    pd = None
+
+ARROW_STREAM_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def read_table(body: bytes) -> "pa.Table":
+    """Read a body in the Arrow IPC streaming format. The columns of the table point into ``body`` without copying."""
+    if pa is None:
+        raise ModuleNotFoundError("pyarrow is not installed.")
+    with pa.ipc.open_stream(pa.py_buffer(body)) as reader:
+        return reader.read_all()
+
+
+def accepts_arrow(request: flask.Request) -> bool:
+    """Return whether the client prefers Arrow over JSON, according to its ``Accept`` header."""
+    if pa is None or not request.accept_mimetypes:
+        return False
+    best_match = request.accept_mimetypes.best_match(["application/json", ARROW_STREAM_CONTENT_TYPE])
+    return best_match == ARROW_STREAM_CONTENT_TYPE
+
+
+def to_table(value: Any) -> Optional["pa.Table"]:
+    """Return ``value`` as an Arrow table if it is tabular (an Arrow table or record batch, or a DataFrame)."""
+    if pa is None:
+        return None
+    if isinstance(value, pa.Table):
+        return value
+    if isinstance(value, pa.RecordBatch):
+        return pa.Table.from_batches([value])
+    if pd is not None and isinstance(value, pd.DataFrame):
+        # A default RangeIndex is dropped. Any other index is sent as columns, as pandas does when writing Parquet.
+        return pa.Table.from_pandas(value)
+    return None
+
+
+def write_table(table: "pa.Table") -> bytes:
+    """Write ``table`` in the Arrow IPC streaming format."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,238 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import re
+import stat
+import tempfile
+import threading
+import time
+import traceback
+from typing import Callable, NamedTuple, Optional
+import uuid
+
+from .utils import is_alive
+
+logger = logging.getLogger("azmlinfsrv.async_operations")
+
+_OPERATION_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# How often expired operations are removed from the spool directory, in seconds.
+SWEEP_INTERVAL_S = 60
+
+# Time in seconds after which clients are asked to poll a running operation again.
+OPERATION_RETRY_AFTER_S = 1
+
+RUNNING = "Running"
+SUCCEEDED = "Succeeded"
+FAILED = "Failed"
+
+
+class OperationResult(NamedTuple):
+    status_code: int
+    content_type: Optional[str]
+    body: bytes
+
+
+class OperationsFull(Exception):
+    """Raised when a job is submitted while the worker already has as many pending jobs as it accepts."""
+
+
+class Operation(NamedTuple):
+    id: str
+    status: str
+    # The response of the operation, once it is no longer running
+    result: Optional[OperationResult] = None
+
+
+class AsyncOperations:
+    """Runs scoring jobs in the background of a worker and keeps their results on disk until they are fetched or until
+    they expire after ``ttl_s`` seconds. Up to ``max_workers`` jobs run at a time, and up to ``max_pending`` more wait
+    for a thread; jobs submitted beyond that are refused.
+
+    The state of an operation is kept in ``spool_dir``, which all the workers of the server share, so that it can be
+    polled from any worker. Each operation has a status file, holding the status and the pid of the worker running it,
+    and a body file once it has completed. A running operation whose worker has exited is reported as failed.
+    """
+
+    def __init__(self, spool_dir: Optional[str], ttl_s: float, max_workers: int, max_pending: int = 0):
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        else:
+            spool_dir = os.path.join(tempfile.gettempdir(), "azmlinfsrv-operations")
+            _make_private_dir(spool_dir)
+        self.spool_dir = spool_dir
+        self.ttl_s = ttl_s
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Number of jobs that were submitted and have not completed, running or waiting for a thread. It has its own
+        # lock, which close() does not hold while it waits for the jobs.
+        self._jobs = 0
+        self._jobs_lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def submit(self, job: Callable[[], OperationResult]) -> str:
+        """Run ``job`` in the background and return the id of its operation. Raises OperationsFull when the worker
+        has no room for another job.
+        """
+        with self._jobs_lock:
+            if self._jobs >= self.max_workers + self.max_pending:
+                raise OperationsFull(f"{self._jobs} jobs are already running or waiting to run.")
+            self._jobs += 1
+
+        operation_id = uuid.uuid4().hex
+        try:
+            self._write_status(operation_id, RUNNING)
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="azmlinfsrv-operation")
+                self._executor.submit(self._run, operation_id, job)
+        except BaseException:
+            with self._jobs_lock:
+                self._jobs -= 1
+            raise
+
+        self._maybe_sweep()
+        return operation_id
+
+    def get(self, operation_id: str) -> Optional[Operation]:
+        """Return the operation, or None if it does not exist or has expired. The result of a completed operation is
+        removed from the spool directory once it has been returned.
+        """
+        self._maybe_sweep()
+        if not _OPERATION_ID.match(operation_id):
+            return None
+
+        status_path = self._path(operation_id, "status")
+        try:
+            with open(status_path, "r", encoding="utf-8") as fp:
+                status = json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+        if status["status"] == RUNNING:
+            if os.name != "nt" and not is_alive(status["pid"]):
+                message = "The worker running the operation exited before the operation completed."
+                self._remove(operation_id, "status")
+                return Operation(operation_id, FAILED, error_result(500, message))
+            return Operation(operation_id, RUNNING)
+
+        try:
+            with open(self._path(operation_id, "body"), "rb") as fp:
+                body = fp.read()
+            # Another request may have fetched the result in the meantime.
+            os.remove(status_path)
+        except OSError:
+            return None
+        self._remove(operation_id, "body")
+
+        result = OperationResult(status["status_code"], status["content_type"], body)
+        return Operation(operation_id, status["status"], result)
+
+    def close(self) -> None:
+        """Wait for the running operations to complete."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _run(self, operation_id: str, job: Callable[[], OperationResult]) -> None:
+        try:
+            result = job()
+        except Exception:
+            logger.error(f"Operation {operation_id} failed: {traceback.format_exc()}")
+            result = error_result(500, "An unexpected internal error occurred. Check the logs for more info.")
+        finally:
+            # The job gives up its place before its result can be fetched, so that clients can submit another one.
+            with self._jobs_lock:
+                self._jobs -= 1
+
+        try:
+            status = SUCCEEDED if result.status_code < 400 else FAILED
+            self._write_file(operation_id, "body", result.body)
+            self._write_status(operation_id, status, result.status_code, result.content_type)
+        except OSError:
+            logger.error(f"Failed to spool the result of operation {operation_id}: {traceback.format_exc()}")
+
+    def _path(self, operation_id: str, kind: str) -> str:
+        return os.path.join(self.spool_dir, f"{operation_id}.{kind}")
+
+    def _write_status(
+        self, operation_id: str, status: str, status_code: Optional[int] = None, content_type: Optional[str] = None
+    ) -> None:
+        entry = {"status": status, "pid": os.getpid(), "status_code": status_code, "content_type": content_type}
+        self._write_file(operation_id, "status", json.dumps(entry).encode("utf-8"))
+
+    def _write_file(self, operation_id: str, kind: str, data: bytes) -> None:
+        # Write to a temporary file and rename it, so that readers never see a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.spool_dir, prefix=f".{operation_id}.")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            os.replace(tmp_path, self._path(operation_id, kind))
+        except BaseException:
+            self._remove_path(tmp_path)
+            raise
+
+    def _remove(self, operation_id: str, kind: str) -> None:
+        self._remove_path(self._path(operation_id, kind))
+
+    def _remove_path(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _maybe_sweep(self) -> None:
+        now = time.time()
+        if now - self._last_sweep < min(SWEEP_INTERVAL_S, self.ttl_s):
+            return
+        self._last_sweep = now
+
+        # Remove the results that were not fetched in time. The status file of a running operation is not modified
+        # until it completes, so it is only removed once its worker has exited.
+        try:
+            names = os.listdir(self.spool_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.spool_dir, name)
+            try:
+                if now - os.path.getmtime(path) < self.ttl_s:
+                    continue
+                if name.endswith(".status") and not name.startswith("."):
+                    with open(path, "r", encoding="utf-8") as fp:
+                        status = json.load(fp)
+                    if status["status"] == RUNNING and os.name != "nt" and is_alive(status["pid"]):
+                        continue
+            except (OSError, ValueError, KeyError):
+                pass
+            self._remove_path(path)
+
+
+def _make_private_dir(path: str) -> None:
+    # The default spool directory has a fixed name in the shared temp directory, where another user could have created
+    # it to read or replace the results. It is created for the current user only, and refused if someone else owns it.
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    if os.name == "nt":
+        return
+
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(
+            f"{path} must be a directory that belongs to the user of the server and is not accessible to other users."
+        )
+
+
+def error_result(status_code: int, message: str) -> OperationResult:
+    """Return the result of an operation that failed with ``message``, formatted like the error responses of /score."""
+    return OperationResult(status_code, "application/json", json.dumps({"message": message}).encode("utf-8"))
@@ -0,0 +1,73 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Compact binary encodings of the JSON data model that ``/score`` accepts and returns besides JSON: MessagePack
+(https://msgpack.org) and CBOR (RFC 8949).
+"""
+
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+import flask
+
+# check if msgpack and cbor2 are available
+try:
+    import msgpack
+except ModuleNotFoundError:
+    msgpack = None
+
+try:
+    import cbor2
+except ModuleNotFoundError:
+    cbor2 = None
+
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+CBOR_CONTENT_TYPE = "application/cbor"
+
+
+class Codec(NamedTuple):
+    name: str
+    content_type: str
+    # The package that implements the codec. The codec is unavailable when it is not installed.
+    package: str
+    # Raises ValueError when the body is not valid.
+    loads: Callable[[bytes], Any]
+    dumps: Callable[[Any], bytes]
+
+    @property
+    def available(self) -> bool:
+        return {"msgpack": msgpack, "cbor2": cbor2}[self.package] is not None
+
+
+def _cbor_loads(body: bytes) -> Any:
+    # Decoding errors are ValueErrors for every codec.
+    try:
+        return cbor2.loads(body)
+    except cbor2.CBORDecodeError as ex:
+        raise ValueError(str(ex)) from ex
+
+
+CODECS: Dict[str, Codec] = {
+    MSGPACK_CONTENT_TYPE: Codec(
+        "MessagePack",
+        MSGPACK_CONTENT_TYPE,
+        "msgpack",
+        lambda body: msgpack.unpackb(body),
+        lambda value: msgpack.packb(value),
+    ),
+    CBOR_CONTENT_TYPE: Codec(
+        "CBOR",
+        CBOR_CONTENT_TYPE,
+        "cbor2",
+        _cbor_loads,
+        lambda value: cbor2.dumps(value),
+    ),
+}
+
+
+def negotiate(request: flask.Request) -> Optional[Codec]:
+    """Return the codec the client prefers over JSON for the response, according to its ``Accept`` header."""
+    if not request.accept_mimetypes:
+        return None
+    content_types = [content_type for content_type, codec in CODECS.items() if codec.available]
+    best_match = request.accept_mimetypes.best_match(["application/json", *content_types])
+    return CODECS.get(best_match)
@@ -0,0 +1,221 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Decoding of the inputs of run() parameters declared with inference-schema's ``NumpyParameterType`` and
+``PandasParameterType``.
+
+inference-schema converts those inputs from the Python lists and dicts that ``json.loads()`` returns. For pandas, that
+means serializing the input to JSON again and parsing it with ``pandas.read_json()``, one row at a time. The decoders
+here build the ndarray or the DataFrame from the parsed JSON one column at a time instead, and accept arrays and Arrow
+tables from binary bodies, while enforcing the column types and the shape in the same way. inference-schema passes
+ndarrays and DataFrames to run() as-is.
+"""
+
+import io
+from typing import Any, Callable, Dict, Optional
+
+from .arrow_ipc import pa
+
+# check if numpy and pandas are available
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+try:
+    import pandas as pd
+except ModuleNotFoundError:
+    pd = None
+
+# Content type of a body that holds a single array in the NumPy ``.npy`` format.
+NPY_CONTENT_TYPE = "application/x-npy"
+
+Decoder = Callable[[Any], Any]
+
+
+def get_parameter_types(run: Callable) -> Dict[str, Any]:
+    """Return the inference-schema parameter types of the parameters of ``run``, by name.
+
+    inference-schema has no public attribute for the parameter types (its schema registry only holds their swagger), so
+    they are read from the closures of the @input_schema wrappers around ``run``. Their settings are then read from
+    their public attributes.
+    """
+    parameter_types = {}
+    func = run
+    while func is not None:
+        wrapper = getattr(func, "_self_wrapper", None)
+        closure = getattr(wrapper, "__closure__", None)
+        if closure:
+            cells = dict(zip(wrapper.__code__.co_freevars, (cell.cell_contents for cell in closure)))
+            if "param_name" in cells and "param_type" in cells and cells.get("convert_to_provided_type", True):
+                parameter_types.setdefault(cells["param_name"], cells["param_type"])
+        func = getattr(func, "__wrapped__", None)
+    return parameter_types
+
+
+def get_decoders(run: Callable) -> Dict[str, Decoder]:
+    """Return the decoders for the parameters of ``run`` that have a NumPy or a pandas parameter type."""
+    decoders = {}
+    for name, parameter_type in get_parameter_types(run).items():
+        decoder = _get_decoder(parameter_type)
+        if decoder:
+            decoders[name] = decoder
+    return decoders
+
+
+def load_npy(body: bytes) -> "np.ndarray":
+    """Read a body in the ``.npy`` format. Object arrays are refused because they are pickled."""
+    if np is None:
+        raise ValueError("numpy is not installed.")
+    return np.load(io.BytesIO(body), allow_pickle=False)
+
+
+def _get_decoder(parameter_type: Any) -> Optional[Decoder]:
+    sample = getattr(parameter_type, "sample_input", None)
+    if np is not None and isinstance(sample, np.ndarray):
+        return _NumpyDecoder(parameter_type)
+    if pd is not None and isinstance(sample, pd.DataFrame):
+        return _PandasDecoder(parameter_type)
+    return None
+
+
+def _is_numeric(dtype: Any) -> bool:
+    return isinstance(dtype, np.dtype) and dtype.kind in "biuf"
+
+
+class _NumpyDecoder:
+    """Build an ndarray from a JSON array, or check an ndarray, like ``NumpyParameterType.deserialize_input()``."""
+
+    __slots__ = ["dtype", "shape", "enforce_column_type", "enforce_shape"]
+
+    def __init__(self, parameter_type: Any):
+        self.dtype = parameter_type.sample_input.dtype
+        self.shape = parameter_type.sample_input.shape
+        self.enforce_column_type = parameter_type.enforce_column_type
+        self.enforce_shape = parameter_type.enforce_shape
+
+    def __call__(self, value: Any) -> Any:
+        if isinstance(value, np.ndarray):
+            # Binary inputs keep the dtype the client sent. Casting could truncate strings or lose precision.
+            array = value
+        elif isinstance(value, list) and (not self.enforce_column_type or _is_numeric(self.dtype)):
+            # Records, dates and durations need inference-schema's conversion of each item.
+            array = np.array(value, dtype=self.dtype if self.enforce_column_type else None)
+        else:
+            return value
+
+        if self.enforce_shape:
+            if array.ndim != len(self.shape):
+                raise ValueError(
+                    f"Invalid input array: an array with {len(self.shape)} dimensions is expected; "
+                    f"input has {array.ndim} [shape {array.shape}]"
+                )
+            for dim in range(1, array.ndim):
+                if array.shape[dim] != self.shape[dim]:
+                    raise ValueError(
+                        f"Invalid input array: array has size {array.shape[dim]} on dimension #{dim}, "
+                        f"while expected value is {self.shape[dim]}"
+                    )
+
+        return array
+
+
+class _PandasDecoder:
+    """Build a DataFrame from a JSON object in the ``split`` or the ``columns`` orient, an Arrow table or an ndarray,
+    like ``PandasParameterType.deserialize_input()``.
+    """
+
+    __slots__ = ["sample", "orient", "enforce_column_type", "enforce_shape", "apply_column_names"]
+
+    def __init__(self, parameter_type: Any):
+        self.sample = parameter_type.sample_input
+        self.orient = parameter_type.orient
+        self.enforce_column_type = parameter_type.enforce_column_type
+        self.enforce_shape = parameter_type.enforce_shape
+        # Deprecated by inference-schema, and missing from its older versions.
+        self.apply_column_names = getattr(parameter_type, "apply_column_names", False)
+
+    def __call__(self, value: Any) -> Any:
+        if isinstance(value, pd.DataFrame):
+            return value
+
+        if pa is not None and isinstance(value, pa.Table):
+            # Each column without nulls becomes a read-only view of the Arrow buffer, without copying. This is
+            # documented: run() has to copy the arrays it modifies in place. The names and types of the sample are
+            # applied below, like for JSON inputs.
+            data_frame = value.to_pandas(split_blocks=True)
+        elif np is not None and isinstance(value, np.ndarray):
+            data_frame = self._from_array(value)
+        elif isinstance(value, dict) and self.orient in _ORIENTS:
+            data_frame = _ORIENTS[self.orient](self, value)
+        else:
+            data_frame = None
+
+        if data_frame is None:
+            # Leave it to inference-schema.
+            return value
+
+        if self.apply_column_names:
+            # The columns of the input are renamed after those of the sample, in order.
+            data_frame.columns = self.sample.columns.copy()
+
+        if self.enforce_column_type:
+            dtypes = self.sample.dtypes.to_dict()
+            converted_types = {column: dtypes.get(column, object) for column in data_frame.columns}
+            for column, dtype in converted_types.items():
+                if str(dtype).startswith("timedelta"):
+                    data_frame[column] = pd.to_timedelta(data_frame[column])
+            data_frame = data_frame.astype(dtype=converted_types)
+
+        if self.enforce_shape and data_frame.shape[1] != self.sample.shape[1]:
+            raise ValueError(
+                f"Invalid input data frame: data frame has size {data_frame.shape[1]} on dimension #1, "
+                f"while expected value is {self.sample.shape[1]}"
+            )
+
+        return data_frame
+
+    def _from_split(self, value: Dict[str, Any]) -> Optional["pd.DataFrame"]:
+        columns, data = value.get("columns"), value.get("data")
+        if not isinstance(columns, list) or not isinstance(data, list):
+            return None
+        return pd.DataFrame(data, columns=columns, index=value.get("index"))
+
+    def _from_columns(self, value: Dict[str, Any]) -> Optional["pd.DataFrame"]:
+        if not value or not all(isinstance(values, dict) for values in value.values()):
+            return None
+
+        keys = next(iter(value.values())).keys()
+        if any(values.keys() != keys for values in value.values()):
+            # Columns with different indices are aligned by pandas.read_json().
+            return None
+
+        dtypes = self.sample.dtypes.to_dict()
+        columns = {}
+        for column, values in value.items():
+            dtype = dtypes.get(column)
+            if self.enforce_column_type and _is_numeric(dtype):
+                columns[column] = np.fromiter(values.values(), dtype=dtype, count=len(values))
+            else:
+                columns[column] = list(values.values())
+
+        # pandas.read_json() converts the index labels, which are always strings in JSON, to numbers.
+        index = list(keys)
+        try:
+            index = [int(label) for label in index]
+        except ValueError:
+            pass
+        return pd.DataFrame(columns, index=index)
+
+    def _from_array(self, array: "np.ndarray") -> Optional["pd.DataFrame"]:
+        if array.dtype.names:
+            return pd.DataFrame(array)
+        if array.ndim == 2 and array.shape[1] == len(self.sample.columns):
+            return pd.DataFrame(array, columns=self.sample.columns)
+        return None
+
+
+_ORIENTS = {
+    "split": _PandasDecoder._from_split,
+    "columns": _PandasDecoder._from_columns,
+}
@@ -7,8 +7,9 @@ import json
 import logging
 import os
 import sys
+import threading
 import traceback
-from typing import Any, Dict, Optional, Tuple, Type
+from typing import Any, Callable, Dict, Literal, Optional, Tuple, Type
 
 
 import pydantic
@@ -38,8 +39,60 @@ alias_mapping = {
     "AZUREML_MODEL_DIR": "azureml_model_dir",
     "HOSTNAME": "hostname",
     "AZUREML_DEBUG_PORT": "debug_port",
+    "AML_CONFIG_RELOAD_INTERVAL_SECONDS": "config_reload_interval",
+    "AML_MODEL_WATCH_INTERVAL_SECONDS": "model_watch_interval",
+    "AML_MODEL_VERSION_FILE": "model_version_file",
+    "AML_MODEL_LOAD_TIMEOUT_SECONDS": "model_load_timeout",
+    "AML_MODEL_WARMUP_FILE": "model_warmup_file",
+    "AML_WARMUP_FROM_SCHEMA": "warmup_from_schema",
+    "AML_SINGLE_FLIGHT_ENABLED": "single_flight_enabled",
+    "GRPC_PORT": "grpc_port",
+    "AML_MEMORY_TRACKING_ENABLED": "memory_tracking_enabled",
+    "AML_MEMORY_TRACKING_WINDOW": "memory_tracking_window",
+    "AML_MEMORY_LEAK_THRESHOLD_MB": "memory_leak_threshold_mb",
+    "AML_ISOLATED_SCORING_ENABLED": "isolated_scoring_enabled",
+    "AML_LOG_THROTTLE_WINDOW_SECONDS": "log_throttle_window",
+    "AML_ACCESS_LOG_FORMAT": "access_log_format",
+    "AML_ACCESS_LOG_SAMPLE_RATE": "access_log_sample_rate",
+    "AML_ACCESS_LOG_SLOW_REQUEST_MS": "access_log_slow_request_ms",
+    "AML_BULK_CHUNK_SIZE": "bulk_chunk_size",
+    "AML_ASYNC_SCORING_ENABLED": "async_scoring_enabled",
+    "AML_ASYNC_WORKERS": "async_workers",
+    "AML_ASYNC_MAX_PENDING": "async_max_pending",
+    "AML_ASYNC_RESULT_TTL_SECONDS": "async_result_ttl",
+    "AML_ASYNC_SPOOL_DIR": "async_spool_dir",
+    "AML_MAX_CONCURRENT_REQUESTS": "max_concurrent_requests",
+    "AML_ADMISSION_QUEUE_SIZE": "admission_queue_size",
+    "AML_PRIORITY_CLASSES": "priority_classes",
+    "AML_DEFAULT_PRIORITY_CLASS": "default_priority_class",
+    "AML_TENANT_HEADER": "tenant_header",
+    "AML_TENANT_WEIGHTS": "tenant_weights",
+    "AML_DEFAULT_TENANT_WEIGHT": "default_tenant_weight",
+    "AML_RATE_LIMIT_PER_SECOND": "rate_limit_per_second",
+    "AML_RATE_LIMIT_BURST": "rate_limit_burst",
+    "AML_RATE_LIMIT_HEADER": "rate_limit_header",
+    "AML_RATE_LIMIT_KEY_LENGTH": "rate_limit_key_length",
+    "AML_RATE_LIMIT_TABLE_SIZE": "rate_limit_table_size",
+    "AML_CACHE_CONTROL": "cache_control",
+    "AML_LEAN_MODE": "lean_mode",
+    "AML_READINESS_HIGH_WATERMARK": "readiness_high_watermark",
+    "AML_READINESS_LOW_WATERMARK": "readiness_low_watermark",
+    "AML_LOAD_HEADERS_ENABLED": "load_headers_enabled",
 }
 
+# Settings that are safe to change while the server is running. Everything else is only read when a worker starts.
+RELOADABLE_FIELDS = (
+    "scoring_timeout",
+    "log_level",
+    "cors_origins",
+    "app_insights_log_response_enabled",
+    "access_log_format",
+    "access_log_sample_rate",
+    "access_log_slow_request_ms",
+    "bulk_chunk_size",
+    "cache_control",
+)
+
 
 def get_config_file() -> str | None:
     # Absolute path to the configuration file
@@ -71,12 +124,18 @@ def _is_valid_config_file(config_file) -> bool:
 
 
 class JsonConfigSettingsSource(PydanticBaseSettingsSource):
-    def get_field_value(self, field: FieldInfo, field_name: str) -> Tuple[Any, str, bool]:
-        config_file = get_config_file()
+    def __init__(self, settings_cls: Type[BaseSettings], config_file: str):
+        super().__init__(settings_cls)
+
+        # Parse the file once up front instead of once per field.
         with open(config_file, encoding=self.config.get("env_file_encoding")) as fp:
-            file_content_json = json.load(fp)
-            field_value = file_content_json.get(field.alias)
-            return field_value, field_name, False
+            self.file_content_json: Dict[str, Any] = json.load(fp)
+
+    def get_field_value(self, field: FieldInfo, field_name: str) -> Tuple[Any, str, bool]:
+        # Fields without an alias are looked up by the key documented in `alias_mapping`.
+        key = field.alias or _config_file_keys.get(field_name)
+        field_value = self.file_content_json.get(key) if key else None
+        return field_value, field_name, False
 
     def prepare_field_value(self, field_name: str, field: FieldInfo, value: Any, value_is_complex: bool) -> Any:
         return value
@@ -93,6 +152,24 @@ class JsonConfigSettingsSource(PydanticBaseSettingsSource):
         return d
 
 
+_config_file_keys = {field_name: key for key, field_name in alias_mapping.items()}
+
+
+class PriorityClass(pydantic.BaseModel):
+    # Requests of the classes with the lowest value are admitted first, and those with the highest value are shed first
+    priority: int = 0
+
+    # Fraction of the concurrent requests of a worker that the requests of the class may take
+    share: float = pydantic.Field(default=1.0, gt=0, le=1)
+
+    # Scoring timeout of the requests of the class, in milliseconds. Defaults to SCORING_TIMEOUT_MS.
+    timeout_ms: Optional[int] = pydantic.Field(default=None, gt=0)
+
+
+def _default_priority_classes() -> Dict[str, PriorityClass]:
+    return {"interactive": PriorityClass(priority=0), "batch": PriorityClass(priority=1)}
+
+
 class AMLInferenceServerConfig(BaseSettings):
     # Root directory for the app
     app_root: str = pydantic.Field(default=DEFAULT_APP_ROOT)
@@ -144,6 +221,150 @@ class AMLInferenceServerConfig(BaseSettings):
     # Start the inference server in DEBUGGING mode
     debug_port: Optional[int] = pydantic.Field(default=None, alias="AZUREML_DEBUG_PORT")
 
+    # How often (in seconds) each worker checks the config file for changes to the reloadable settings. Disabled when
+    # not set.
+    config_reload_interval: Optional[float] = pydantic.Field(default=None, alias="AML_CONFIG_RELOAD_INTERVAL_SECONDS")
+
+    # How often (in seconds) each worker checks for a new model version to hot-swap. Disabled when not set.
+    model_watch_interval: Optional[float] = pydantic.Field(default=None, alias="AML_MODEL_WATCH_INTERVAL_SECONDS")
+
+    # File containing the path of the model directory to serve. Watched instead of AZUREML_MODEL_DIR when set.
+    model_version_file: Optional[str] = pydantic.Field(default=None, alias="AML_MODEL_VERSION_FILE")
+
+    # Time (in seconds) allowed to import, initialize and warm up a new model version before it is given up on
+    model_load_timeout: float = pydantic.Field(default=600, alias="AML_MODEL_LOAD_TIMEOUT_SECONDS")
+
+    # JSON request body sent to run() before a worker (or a hot-swapped model) starts serving traffic. Defaults to
+    # warmup.json in the app root.
+    model_warmup_file: Optional[str] = pydantic.Field(default=None, alias="AML_MODEL_WARMUP_FILE")
+
+    # Whether to also warm up run() with the input example generated by inference-schema
+    warmup_from_schema: bool = pydantic.Field(default=False, alias="AML_WARMUP_FROM_SCHEMA")
+
+    # Whether concurrent requests with identical inputs share a single run() call
+    single_flight_enabled: bool = pydantic.Field(default=False, alias="AML_SINGLE_FLIGHT_ENABLED")
+
+    # Port of the gRPC scoring endpoint. Disabled when not set.
+    grpc_port: Optional[int] = pydantic.Field(default=None, alias="GRPC_PORT")
+
+    # Measure the memory used by each request with tracemalloc and log the top allocation sites when memory keeps
+    # growing over a window of requests.
+    memory_tracking_enabled: bool = pydantic.Field(default=False, alias="AML_MEMORY_TRACKING_ENABLED")
+
+    # Number of requests over which memory growth is evaluated.
+    memory_tracking_window: int = pydantic.Field(default=100, alias="AML_MEMORY_TRACKING_WINDOW")
+
+    # Growth of the traced memory over the window, in MB, above which a leak is suspected.
+    memory_leak_threshold_mb: float = pydantic.Field(default=10.0, alias="AML_MEMORY_LEAK_THRESHOLD_MB")
+
+    # Run run() in a scoring process forked after init() so that timeouts are enforced by killing it.
+    isolated_scoring_enabled: bool = pydantic.Field(default=False, alias="AML_ISOLATED_SCORING_ENABLED")
+
+    # Window in seconds during which identical exceptions and warnings raised by requests are logged (and sent to App
+    # Insights) once. All are logged when not set, so that the exception of every failed request can be looked up by
+    # its request id.
+    log_throttle_window: Optional[float] = pydantic.Field(default=None, alias="AML_LOG_THROTTLE_WINDOW_SECONDS")
+
+    # Format of the access log lines: a line of text or a JSON object.
+    access_log_format: Literal["text", "json"] = pydantic.Field(default="text", alias="AML_ACCESS_LOG_FORMAT")
+
+    # Fraction of the successful requests written to the access log. Failed and slow requests are always written.
+    access_log_sample_rate: float = pydantic.Field(default=1.0, ge=0.0, le=1.0, alias="AML_ACCESS_LOG_SAMPLE_RATE")
+
+    # Duration in milliseconds above which a request is always written to the access log.
+    access_log_slow_request_ms: Optional[float] = pydantic.Field(default=None, alias="AML_ACCESS_LOG_SLOW_REQUEST_MS")
+
+    # Number of records of a /score/bulk request that are scored together, and whose results are written together.
+    bulk_chunk_size: int = pydantic.Field(default=100, gt=0, alias="AML_BULK_CHUNK_SIZE")
+
+    # Whether /score requests with a "Prefer: respond-async" header are scored in the background
+    async_scoring_enabled: bool = pydantic.Field(default=False, alias="AML_ASYNC_SCORING_ENABLED")
+
+    # Number of background scoring jobs each worker runs at a time
+    async_workers: int = pydantic.Field(default=1, gt=0, alias="AML_ASYNC_WORKERS")
+
+    # Number of background scoring jobs each worker keeps waiting for a thread. Further jobs are answered with 503.
+    async_max_pending: int = pydantic.Field(default=100, ge=0, alias="AML_ASYNC_MAX_PENDING")
+
+    # Time in seconds for which the result of a background scoring job is kept until it is fetched
+    async_result_ttl: int = pydantic.Field(default=3600, gt=0, alias="AML_ASYNC_RESULT_TTL_SECONDS")
+
+    # Directory where the results of background scoring jobs are kept. Defaults to a directory in the temp directory
+    # that only the user of the server can access.
+    async_spool_dir: Optional[str] = pydantic.Field(default=None, alias="AML_ASYNC_SPOOL_DIR")
+
+    # Number of /score requests each worker scores at a time. The others wait in the admission queue of the worker.
+    # Admission control is disabled when not set.
+    max_concurrent_requests: Optional[int] = pydantic.Field(default=None, gt=0, alias="AML_MAX_CONCURRENT_REQUESTS")
+
+    # Number of requests that may wait in the admission queue of a worker before requests are shed
+    admission_queue_size: int = pydantic.Field(default=100, ge=0, alias="AML_ADMISSION_QUEUE_SIZE")
+
+    # Priority classes that requests are tagged with through the x-ms-priority header, by name
+    priority_classes: Dict[str, PriorityClass] = pydantic.Field(
+        default_factory=_default_priority_classes, alias="AML_PRIORITY_CLASSES"
+    )
+
+    # Priority class of the requests without a x-ms-priority header, or with an unknown class
+    default_priority_class: str = pydantic.Field(default="interactive", alias="AML_DEFAULT_PRIORITY_CLASS")
+
+    # Header that identifies the tenant of a request. The requests of different tenants wait in separate queues that
+    # are served in turn. All requests belong to the same tenant when not set.
+    tenant_header: Optional[str] = pydantic.Field(default=None, alias="AML_TENANT_HEADER")
+
+    # Relative share of the admitted requests that each tenant gets when tenants compete, by tenant
+    tenant_weights: Dict[str, pydantic.PositiveFloat] = pydantic.Field(
+        default_factory=dict, alias="AML_TENANT_WEIGHTS"
+    )
+
+    # Weight of the tenants that are not in AML_TENANT_WEIGHTS
+    default_tenant_weight: float = pydantic.Field(default=1.0, gt=0, alias="AML_DEFAULT_TENANT_WEIGHT")
+
+    # Number of scoring requests per second each client may send to the server. Rate limiting is disabled when not set.
+    rate_limit_per_second: Optional[float] = pydantic.Field(default=None, gt=0, alias="AML_RATE_LIMIT_PER_SECOND")
+
+    # Number of requests a client may send at once after being idle. Defaults to AML_RATE_LIMIT_PER_SECOND.
+    rate_limit_burst: Optional[int] = pydantic.Field(default=None, gt=0, alias="AML_RATE_LIMIT_BURST")
+
+    # Header that identifies the client of a request
+    rate_limit_header: str = pydantic.Field(default="Authorization", alias="AML_RATE_LIMIT_HEADER")
+
+    # Number of leading characters of the header that identify the client. The whole header is used when not set.
+    rate_limit_key_length: Optional[int] = pydantic.Field(default=None, gt=0, alias="AML_RATE_LIMIT_KEY_LENGTH")
+
+    # Number of clients whose request rate is tracked at a time
+    rate_limit_table_size: int = pydantic.Field(default=4096, gt=0, alias="AML_RATE_LIMIT_TABLE_SIZE")
+
+    # Cache-Control header of the responses to GET requests when run() is decorated with @cacheable
+    cache_control: str = pydantic.Field(default="max-age=60", alias="AML_CACHE_CONTROL")
+
+    # Whether to skip the per-request work that only serves debugging, to lower the overhead of each request
+    lean_mode: bool = pydantic.Field(default=False, alias="AML_LEAN_MODE")
+
+    # Number of pending scoring requests at which a worker reports that it is not ready. Disabled when not set.
+    readiness_high_watermark: Optional[int] = pydantic.Field(default=None, gt=0, alias="AML_READINESS_HIGH_WATERMARK")
+
+    # Number of pending scoring requests at which a saturated worker is ready again. Defaults to half of
+    # AML_READINESS_HIGH_WATERMARK.
+    readiness_low_watermark: Optional[int] = pydantic.Field(default=None, ge=0, alias="AML_READINESS_LOW_WATERMARK")
+
+    # Whether to report the utilization and queue depth of the worker in the headers of the responses
+    load_headers_enabled: bool = pydantic.Field(default=False, alias="AML_LOAD_HEADERS_ENABLED")
+
+    @pydantic.field_validator("default_priority_class")
+    def check_default_priority_class(cls, value: str, info: pydantic.ValidationInfo):
+        priority_classes = info.data.get("priority_classes")
+        if priority_classes is not None and value not in priority_classes:
+            raise ValueError(f"{value} is not one of the classes of AML_PRIORITY_CLASSES")
+        return value
+
+    @pydantic.field_validator("readiness_low_watermark")
+    def check_readiness_low_watermark(cls, value: Optional[int], info: pydantic.ValidationInfo):
+        high_watermark = info.data.get("readiness_high_watermark")
+        if value is not None and high_watermark is not None and value >= high_watermark:
+            raise ValueError("must be lower than AML_READINESS_HIGH_WATERMARK")
+        return value
+
     # Check if extra keys are there in the config file
     @pydantic.model_validator(mode="before")
     def check_extra_keys(cls, values: Dict[str, Any]):
@@ -174,8 +395,9 @@ class AMLInferenceServerConfig(BaseSettings):
         file_secret_settings: PydanticBaseSettingsSource,
     ) -> Tuple[PydanticBaseSettingsSource, ...]:
         # Check if config_file is present
-        if get_config_file():
-            return init_settings, env_settings, JsonConfigSettingsSource(settings_cls)
+        config_file = get_config_file()
+        if config_file:
+            return init_settings, env_settings, JsonConfigSettingsSource(settings_cls, config_file)
         else:
             return init_settings, env_settings
 
@@ -198,6 +420,71 @@ def log_config_errors(ex):
         )
 
 
+def reload_config() -> Dict[str, Any]:
+    """Re-read the configuration and apply the values of ``RELOADABLE_FIELDS`` to the global config in place, so that
+    modules holding a reference to it see the new values. Returns the fields that changed. The current values are kept
+    if the new configuration is invalid.
+    """
+    try:
+        new_config = AMLInferenceServerConfig()
+    except pydantic.ValidationError as ex:
+        log_config_errors(ex)
+        logger.error("Config reload failed. Keeping the current settings.")
+        return {}
+
+    changed = {}
+    for field_name in RELOADABLE_FIELDS:
+        value = getattr(new_config, field_name)
+        if value != getattr(config, field_name):
+            setattr(config, field_name, value)
+            changed[field_name] = value
+
+    if changed:
+        logger.info(f"Reloaded settings from the config file: {changed}")
+    return changed
+
+
+class ConfigFileWatcher:
+    """Polls the config file from a daemon thread and calls ``reload_config()`` when its modification time changes.
+    ``on_reload`` is invoked with the changed fields so the caller can apply settings that are not read per request.
+    """
+
+    def __init__(self, interval_s: float, on_reload: Callable[[Dict[str, Any]], None]):
+        self.interval_s = interval_s
+        self.on_reload = on_reload
+        self._stopped = threading.Event()
+        self._last_mtime = self._get_mtime()
+        self._thread = threading.Thread(target=self._watch, name="azmlinfsrv-config-watcher", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def check(self) -> None:
+        mtime = self._get_mtime()
+        if mtime == self._last_mtime:
+            return
+
+        self._last_mtime = mtime
+        changed = reload_config()
+        if changed:
+            self.on_reload(changed)
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval_s):
+            try:
+                self.check()
+            except Exception:
+                logger.error("Error while reloading the config file: {0}".format(traceback.format_exc()))
+
+    @staticmethod
+    def _get_mtime() -> Optional[int]:
+        config_file = get_config_file()
+        return os.stat(config_file).st_mtime_ns if config_file else None
+
+
 try:
     config = AMLInferenceServerConfig()
     # Try to load from app root, if unsuccessful and entry script is set, try
@@ -0,0 +1,474 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+from multiprocessing.connection import Connection, Pipe
+from multiprocessing.shared_memory import SharedMemory
+import os
+import pickle
+import select
+import signal
+import struct
+import sys
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Type
+
+from .isolated_runner import RemoteTraceback, ScoringProcessError
+from .utils import is_alive
+
+logger = logging.getLogger("azmlinfsrv.executor_pool")
+
+# Executors are identified by a single byte on the pipe of free executors.
+MAX_EXECUTOR_COUNT = 255
+
+# Layout of the header at the start of the shared memory segment of an executor. All fields are 8 bytes and aligned.
+_REQUEST_SEQ = 0
+_RESPONSE_SEQ = 8
+_OWNER_PID = 16
+_EXECUTOR_PID = 24
+_HEADER_SIZE = 64
+
+_FIELD = struct.Struct("<q")
+_LENGTH = struct.Struct("<Q")
+
+# Seconds between two checks of the processes that the executors depend on.
+_POLL_INTERVAL_SECONDS = 1.0
+
+# The pool inherited from the gunicorn master. See start_pool().
+_pool: Optional["ExecutorPool"] = None
+
+
+class ExecutorStartupError(Exception):
+    """The user script could not be loaded or initialized in the executor supervisor."""
+
+
+class ExecutorUnavailable(Exception):
+    """No executor became free before the scoring timeout."""
+
+
+class BufferOverflowError(ValueError):
+    """The input or the output of run() does not fit in the buffer of the executor."""
+
+    payload = "payload"
+
+    def __init__(self, size: int, buffer_size: int):
+        self.size = size
+        self.buffer_size = buffer_size
+        super().__init__(
+            f"The {self.payload} of {size} bytes does not fit in the executor buffer of {buffer_size} bytes. The"
+            " buffer size can be raised with EXECUTOR_BUFFER_MB."
+        )
+
+    def __reduce__(self):
+        # Sent back from the executors when the output does not fit.
+        return type(self), (self.size, self.buffer_size)
+
+
+class PayloadTooLargeError(BufferOverflowError):
+    """The input of run() does not fit in the buffer of the executor. The request is answered with 413."""
+
+    payload = "input of run()"
+
+
+class OutputTooLargeError(BufferOverflowError):
+    """The output of run() does not fit in the buffer of the executor. The request is not at fault, so it is answered
+    with 500.
+    """
+
+    payload = "output of run()"
+
+
+def _dump(obj: Any, buf: memoryview, error: Type[BufferOverflowError]) -> None:
+    # Only the object graph is pickled. Large buffers, such as NumPy arrays, are copied to shared memory out-of-band.
+    buffers: List[pickle.PickleBuffer] = []
+    meta = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    chunks = [memoryview(meta)] + [buffer.raw() for buffer in buffers]
+
+    size = _LENGTH.size * (len(chunks) + 1) + sum(chunk.nbytes for chunk in chunks)
+    if size > len(buf):
+        raise error(size, len(buf))
+
+    _LENGTH.pack_into(buf, 0, len(chunks))
+    offset = _LENGTH.size
+    for chunk in chunks:
+        _LENGTH.pack_into(buf, offset, chunk.nbytes)
+        offset += _LENGTH.size
+        end = offset + chunk.nbytes
+        buf[offset:end] = chunk.cast("B")
+        offset = end
+
+
+def _load(buf: memoryview) -> Any:
+    # The buffers are copied out of shared memory, which is overwritten by the next call.
+    (count,) = _LENGTH.unpack_from(buf, 0)
+    offset = _LENGTH.size
+    chunks = []
+    for _ in range(count):
+        (length,) = _LENGTH.unpack_from(buf, offset)
+        offset += _LENGTH.size
+        end = offset + length
+        chunks.append(bytearray(buf[offset:end]))
+        offset = end
+
+    meta, *buffers = chunks
+    return pickle.loads(meta, buffers=buffers)
+
+
+class _Slot:
+    """The channel to one executor: a shared memory segment holding a header, the request and the response, and two
+    pipes that only carry wake-ups. An executor serves one request at a time, so each direction needs a single buffer.
+    """
+
+    def __init__(self, index: int, buffer_size: int):
+        self.index = index
+        self._shm = SharedMemory(create=True, size=_HEADER_SIZE + 2 * buffer_size)
+        # Every process using the segment is forked from this one and inherits the mapping, so it does not need a name.
+        # Unlinking it right away leaves nothing behind in /dev/shm when the server is killed.
+        self._shm.unlink()
+        self._response_start = _HEADER_SIZE + buffer_size
+
+        self.request_r, self.request_w = os.pipe()
+        self.response_r, self.response_w = os.pipe()
+        os.set_blocking(self.response_r, False)
+
+    def get(self, field: int) -> int:
+        return _FIELD.unpack_from(self._shm.buf, field)[0]
+
+    def set(self, field: int, value: int) -> None:
+        _FIELD.pack_into(self._shm.buf, field, value)
+
+    # The buffers are views that must be released after use, or the segment cannot be closed.
+    def request_buffer(self) -> memoryview:
+        end = self._response_start
+        return self._shm.buf[_HEADER_SIZE:end]
+
+    def response_buffer(self) -> memoryview:
+        start = self._response_start
+        return self._shm.buf[start:]
+
+    def close(self) -> None:
+        for fd in (self.request_r, self.request_w, self.response_r, self.response_w):
+            os.close(fd)
+        self._shm.close()
+
+
+def _executor_main(slot: _Slot, run: Callable[..., Any]) -> None:
+    supervisor_pid = os.getppid()
+    while True:
+        ready, _, _ = select.select([slot.request_r], [], [], _POLL_INTERVAL_SECONDS)
+        if not ready:
+            if os.getppid() != supervisor_pid:
+                return
+            continue
+
+        os.read(slot.request_r, 64)
+        seq = slot.get(_REQUEST_SEQ)
+        if seq == abs(slot.get(_RESPONSE_SEQ)):
+            # A wake-up for a request that was already answered, or abandoned when the previous executor exited.
+            continue
+
+        try:
+            with slot.request_buffer() as buf:
+                kwargs = _load(buf)
+            result = (True, run(**kwargs))
+        except BaseException as ex:
+            tb = traceback.format_exc()
+            result = (False, ex if isinstance(ex, Exception) else RuntimeError(repr(ex)), tb)
+
+        with slot.response_buffer() as buf:
+            try:
+                _dump(result, buf, OutputTooLargeError)
+            except OutputTooLargeError as ex:
+                _dump((False, ex, "".join(traceback.format_exception_only(type(ex), ex))), buf, OutputTooLargeError)
+            except Exception as ex:
+                error = TypeError(f"The result of run() cannot be sent back to the worker: {ex!r}")
+                _dump(
+                    (False, error, "".join(traceback.format_exception_only(type(error), error))),
+                    buf,
+                    OutputTooLargeError,
+                )
+
+        slot.set(_RESPONSE_SEQ, seq)
+        os.write(slot.response_w, b"\0")
+
+
+class _Supervisor:
+    """Runs in the process that initialized the user script. Forks the executors from it, replaces those that exit,
+    and hands executors back to the pool once they are replaced.
+    """
+
+    def __init__(self, pool: "ExecutorPool", run: Callable[..., Any]):
+        self.pool = pool
+        self.run = run
+        self.pids: Dict[int, _Slot] = {}
+
+    def start_executor(self, slot: _Slot) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            try:
+                _executor_main(slot, self.run)
+            finally:
+                os._exit(0)
+
+        self.pids[pid] = slot
+        slot.set(_EXECUTOR_PID, pid)
+
+    def replace_executor(self, slot: _Slot) -> None:
+        # The request in progress, if any, is abandoned. A negative sequence number tells the worker waiting for it
+        # that the executor exited.
+        slot.set(_RESPONSE_SEQ, -slot.get(_REQUEST_SEQ))
+        os.write(slot.response_w, b"\0")
+
+        self.start_executor(slot)
+        # An executor that exited while idle is still on the pipe of free executors.
+        if slot.get(_OWNER_PID):
+            self.pool._release(slot)
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            slot = self.pids.pop(pid, None)
+            if slot is not None:
+                logger.warning(f"Executor {pid} exited with status {status}. Starting a new executor.")
+                self.replace_executor(slot)
+
+    def kill_orphaned(self) -> None:
+        # An executor whose owner is gone would never be handed back to the pool.
+        for pid, slot in self.pids.items():
+            owner = slot.get(_OWNER_PID)
+            if owner and not is_alive(owner):
+                logger.warning(f"Worker {owner} exited while executor {pid} was serving it. Replacing the executor.")
+                _kill(pid, signal.SIGKILL)
+
+    def main(self, control: Connection) -> None:
+        wakeup_r, wakeup_w = os.pipe()
+        os.set_blocking(wakeup_r, False)
+        os.set_blocking(wakeup_w, False)
+        signal.set_wakeup_fd(wakeup_w)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+        for slot in self.pool._slots:
+            self.start_executor(slot)
+            self.pool._release(slot)
+        control.send(None)
+
+        parent_pid = os.getppid()
+        try:
+            while os.getppid() == parent_pid:
+                ready, _, _ = select.select([control, wakeup_r], [], [], _POLL_INTERVAL_SECONDS)
+                if control in ready:
+                    # The pool was closed.
+                    return
+                if wakeup_r in ready:
+                    os.read(wakeup_r, 64)
+                self.reap()
+                self.kill_orphaned()
+        finally:
+            for pid in self.pids:
+                _kill(pid, signal.SIGTERM)
+
+
+def _kill(pid: int, signum: int) -> None:
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
+
+
+def _supervisor_main(pool: "ExecutorPool", control: Connection, load: Callable[[], Callable[..., Any]]) -> None:
+    # Interrupting the server from a terminal signals the whole process group. Leave it to the gunicorn master, the
+    # supervisor exits with it.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        run = load()
+    except BaseException:
+        control.send(traceback.format_exc())
+        return
+
+    _Supervisor(pool, run).main(control)
+
+
+class ExecutorPool:
+    """A fixed pool of executor processes that call ``run()`` on behalf of the workers.
+
+    When created, the pool forks a supervisor process, which calls ``load()`` to load and initialize the user script
+    and forks ``count`` executors from it. Workers forked after the pool was created share it: a worker claims a free
+    executor, writes the input of ``run()`` to the shared memory of the executor and waits for the output to be written
+    back. Only the object graph is pickled. NumPy arrays and other out-of-band buffers are copied straight to shared
+    memory, and the pipes between the processes only carry wake-ups.
+
+    Payloads are limited to ``buffer_size`` bytes in each direction. A call that exceeds its timeout kills its
+    executor, which the supervisor replaces without calling ``init()`` again.
+    """
+
+    def __init__(self, load: Callable[[], Callable[..., Any]], count: int, buffer_size: int):
+        if not 0 < count <= MAX_EXECUTOR_COUNT:
+            raise ValueError(f"The number of executors must be between 1 and {MAX_EXECUTOR_COUNT}, got {count}")
+
+        self.count = count
+        self.buffer_size = buffer_size
+        self._slots = [_Slot(index, buffer_size) for index in range(count)]
+        self._free_r, self._free_w = os.pipe()
+        os.set_blocking(self._free_r, False)
+
+        control, child_control = Pipe()
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            try:
+                _supervisor_main(self, child_control, load)
+            finally:
+                os._exit(0)
+
+        child_control.close()
+        self._control = control
+        self._supervisor_pid = pid
+        try:
+            error = control.recv()
+        except EOFError:
+            error = "The executor supervisor exited during startup."
+        if error is not None:
+            self.close()
+            raise ExecutorStartupError(error)
+        logger.info(f"Started {count} executors supervised by process {pid}")
+
+    def run(self, kwargs: Dict[str, Any], timeout_ms: float) -> Any:
+        """Call run() with ``kwargs`` in a free executor. Raises ExecutorUnavailable if no executor became free, and
+        TimeoutError after killing the executor if the call did not complete, within ``timeout_ms``. Raises
+        PayloadTooLargeError if ``kwargs``, or OutputTooLargeError if the output of run(), does not fit in the buffer
+        of the executor.
+        """
+        deadline = time.monotonic() + timeout_ms / 1000
+        slot = self._claim(deadline)
+        seq = slot.get(_REQUEST_SEQ) + 1
+        try:
+            with slot.request_buffer() as buf:
+                _dump(kwargs, buf, PayloadTooLargeError)
+        except BaseException:
+            self._release(slot)
+            raise
+
+        pid = slot.get(_EXECUTOR_PID)
+        slot.set(_REQUEST_SEQ, seq)
+        os.write(slot.request_w, b"\0")
+
+        # From here on, an executor that exits or is killed is handed back to the pool by the supervisor.
+        response_seq = self._wait(slot, seq, deadline)
+        if response_seq is None:
+            logger.error(f"Killing the executor {pid} after a timeout of {timeout_ms} ms")
+            _kill(pid, signal.SIGKILL)
+            raise TimeoutError
+        if response_seq < 0:
+            raise ScoringProcessError(f"The executor {pid} exited unexpectedly.")
+
+        try:
+            with slot.response_buffer() as buf:
+                result = _load(buf)
+        finally:
+            self._release(slot)
+
+        if result[0]:
+            return result[1]
+
+        _, ex, tb = result
+        ex.__cause__ = RemoteTraceback(tb)
+        raise ex
+
+    def close(self) -> None:
+        """Stop the supervisor and the executors. Calls in progress are abandoned."""
+        self._control.close()
+        try:
+            os.waitpid(self._supervisor_pid, 0)
+        except ChildProcessError:
+            pass
+
+        for slot in self._slots:
+            slot.close()
+        os.close(self._free_r)
+        os.close(self._free_w)
+
+    def _claim(self, deadline: float) -> _Slot:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ExecutorUnavailable
+            ready, _, _ = select.select([self._free_r], [], [], remaining)
+            if not ready:
+                continue
+            try:
+                index = os.read(self._free_r, 1)
+            except BlockingIOError:
+                # Another worker got it first.
+                continue
+
+            slot = self._slots[index[0]]
+            slot.set(_OWNER_PID, os.getpid())
+            return slot
+
+    def _release(self, slot: _Slot) -> None:
+        slot.set(_OWNER_PID, 0)
+        os.write(self._free_w, bytes([slot.index]))
+
+    def _wait(self, slot: _Slot, seq: int, deadline: float) -> Optional[int]:
+        # Returns the response sequence number, or None on timeout.
+        while True:
+            response_seq = slot.get(_RESPONSE_SEQ)
+            if abs(response_seq) == seq:
+                return response_seq
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            select.select([slot.response_r], [], [], remaining)
+            try:
+                os.read(slot.response_r, 64)
+            except BlockingIOError:
+                pass
+
+
+def load_user_script() -> Callable[..., Any]:
+    """Load, initialize and warm up the user script in the executor supervisor. Returns the run() to call."""
+    # Imported here because the user script module uses this one.
+    from .config import config
+    from .input_parsers import RawRequestInput
+    from .user_script import UserScript, UserScriptError
+    from .warmup import warm_up
+    from ..print_log_hook import set_print_logger_redirect
+
+    set_print_logger_redirect()
+    sys.path.append(config.app_root)
+    if config.source_dir:
+        sys.path.append(os.path.join(config.app_root, config.source_dir))
+
+    user_script = UserScript(config.entry_script)
+    user_script.load_script(config.app_root)
+    if isinstance(user_script.input_parser, RawRequestInput):
+        raise UserScriptError("run() is decorated with @rawhttp, so it cannot run in an executor.")
+    user_script.invoke_init()
+
+    try:
+        warm_up(user_script)
+    except Exception:
+        logger.error("Warm-up request failed: {0}".format(traceback.format_exc()))
+
+    return user_script._wrapped_user_run
+
+
+def start_pool(count: int, buffer_size: int) -> "ExecutorPool":
+    """Start the executors that the gunicorn workers forked from this process will dispatch run() to."""
+    global _pool
+    _pool = ExecutorPool(load_user_script, count, buffer_size)
+    return _pool
+
+
+def get_pool() -> Optional["ExecutorPool"]:
+    return _pool
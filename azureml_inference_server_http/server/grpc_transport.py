@@ -0,0 +1,159 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from concurrent import futures
+import logging
+import os
+from typing import Any, Dict, Iterator, Optional, Tuple
+import uuid
+
+import flask
+from werkzeug.test import EnvironBuilder
+
+from .config import config
+from .executor_pool import OutputTooLargeError, PayloadTooLargeError
+from .input_parsers import BadInput, TENSORS_ENVIRON_KEY, UnsupportedInput
+from .user_script import UserScriptException, UserScriptKilled, UserScriptTimeout
+from ..api.aml_response import AMLResponse
+from ..constants import DEFAULT_WORKER_THREADS, ENV_WORKER_THREADS
+
+# check if grpc is available
+try:
+    import grpc
+    import numpy as np
+except ModuleNotFoundError:
+    grpc = None
+
+logger = logging.getLogger("azmlinfsrv.grpc")
+
+# Resolved against sys.path, which contains the server directory.
+PROTO_PATH = os.path.join("protos", "inference.proto")
+
+# Metadata keys that are copied to the response, like the HTTP headers of the same name.
+_ECHOED_HEADERS = ("x-request-id", "x-ms-request-id", "x-ms-client-request-id", "traceid")
+
+
+class InferenceServicer:
+    """Serves ``UserScript.invoke_run()`` over gRPC. Each message is handled like a POST to /score, with its body,
+    content type and headers, and the response mirrors what /score would have returned. Call metadata is treated as
+    request headers and the call deadline caps the scoring timeout.
+
+    Calls are handled by the threads of the gRPC server, where the scoring timeout can only be enforced by running
+    ``run()`` in a scoring process or an executor.
+    """
+
+    def __init__(self, blueprint, protos):
+        self.blueprint = blueprint
+        self.protos = protos
+
+    def Score(self, request, context):
+        metadata = dict(context.invocation_metadata())
+        response = self._score(request, metadata, context.time_remaining())
+        context.send_initial_metadata(tuple((k, v) for k, v in response.headers.items() if k in _ECHOED_HEADERS))
+        return response
+
+    def ScoreStream(self, request_iterator, context) -> Iterator[Any]:
+        metadata = dict(context.invocation_metadata())
+        for request in request_iterator:
+            yield self._score(request, metadata, context.time_remaining())
+
+    def _score(self, request, metadata: Dict[str, Any], time_remaining: Optional[float]):
+        # Binary metadata ("-bin" keys) can't be represented as HTTP headers.
+        headers = {k: v for k, v in metadata.items() if isinstance(v, str)}
+        headers.update(request.headers)
+        headers.setdefault("x-request-id", str(uuid.uuid4()))
+
+        timeout_ms = config.scoring_timeout
+        if time_remaining is not None:
+            timeout_ms = min(timeout_ms, int(time_remaining * 1000))
+
+        builder = EnvironBuilder(
+            method="POST",
+            path="/score",
+            data=request.body,
+            content_type=request.content_type or "application/json",
+            headers=headers,
+        )
+        environ = builder.get_environ()
+        try:
+            if request.tensors:
+                environ[TENSORS_ENVIRON_KEY] = {name: _to_array(tensor) for name, tensor in request.tensors.items()}
+        except BadInput as ex:
+            output, timed_result = _error_response(400, ex.args[0]), None
+        else:
+            output, timed_result = self._invoke_run(flask.Request(environ), timeout_ms)
+
+        if isinstance(output, np.ndarray):
+            response = self.protos.ScoreResponse(status_code=200, tensor=self._to_tensor(output))
+        else:
+            if not isinstance(output, flask.Response):
+                output = AMLResponse(output, 200, json_str=True)
+            response = self.protos.ScoreResponse(
+                status_code=output.status_code, body=output.get_data(), content_type=output.content_type or ""
+            )
+            for header, value in output.headers.items():
+                response.headers[header.lower()] = str(value)
+
+        for header in _ECHOED_HEADERS:
+            if header in headers:
+                response.headers[header] = headers[header]
+        if timed_result is not None:
+            response.headers["x-ms-run-fn-exec-ms"] = f"{timed_result.elapsed_ms:.3f}"
+        return response
+
+    def _invoke_run(self, request: flask.Request, timeout_ms: int) -> Tuple[Any, Any]:
+        try:
+            with self.blueprint.model_lock.shared():
+                timed_result = self.blueprint.user_script.invoke_run(
+                    request, timeout_ms=timeout_ms, coalesce=config.single_flight_enabled
+                )
+        except BadInput as ex:
+            return _error_response(400, ex.args[0]), None
+        except UnsupportedInput as ex:
+            return _error_response(415, ex.args[0]), None
+        except PayloadTooLargeError as ex:
+            return _error_response(413, ex.args[0]), None
+        except OutputTooLargeError as ex:
+            logger.error(ex.args[0])
+            return _error_response(500, ex.args[0]), None
+        except UserScriptTimeout as ex:
+            self.blueprint.log_exception(request.headers["x-request-id"])
+            status_code = 504 if isinstance(ex, UserScriptKilled) else 500
+            message = f"Scoring timeout after {ex.timeout_ms} ms"
+            return _error_response(status_code, message, run_function_failed=True), None
+        except UserScriptException:
+            self.blueprint.log_exception(request.headers["x-request-id"])
+            message = "An unexpected error occurred in scoring script. Check the logs for more info."
+            return _error_response(500, message, run_function_failed=True), None
+
+        return timed_result.output, timed_result
+
+    def _to_tensor(self, array: "np.ndarray"):
+        array = np.ascontiguousarray(array)
+        return self.protos.Tensor(dtype=array.dtype.str, shape=array.shape, data=array.tobytes())
+
+
+def _to_array(tensor) -> "np.ndarray":
+    # Zero-copy view over the message bytes, hence read-only.
+    try:
+        return np.frombuffer(tensor.data, dtype=np.dtype(tensor.dtype)).reshape(tuple(tensor.shape))
+    except (TypeError, ValueError) as ex:
+        raise BadInput(f"Invalid tensor: {ex}") from None
+
+
+def _error_response(status_code: int, message: str, run_function_failed: bool = False) -> AMLResponse:
+    return AMLResponse({"message": message}, status_code, json_str=True, run_function_failed=run_function_failed)
+
+
+def serve(blueprint, host: str, port: int) -> Tuple["grpc.Server", int]:
+    """Start a gRPC server for ``blueprint`` and return it along with the port it is bound to. The port is opened with
+    SO_REUSEPORT so every gunicorn worker can listen on it and the kernel spreads the connections across them.
+    """
+    protos, services = grpc.protos_and_services(PROTO_PATH)
+
+    max_workers = int(os.environ.get(ENV_WORKER_THREADS, DEFAULT_WORKER_THREADS))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), options=[("grpc.so_reuseport", 1)])
+    services.add_InferenceServerServicer_to_server(InferenceServicer(blueprint, protos), server)
+    bound_port = server.add_insecure_port(f"{host}:{port}")
+    server.start()
+    return server, bound_port
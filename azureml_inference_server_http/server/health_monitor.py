@@ -0,0 +1,195 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+import os
+import struct
+import threading
+import time
+from typing import Callable, Iterator, Optional, Tuple
+
+from .utils import is_alive
+
+logger = logging.getLogger("azmlinfsrv.health_monitor")
+
+# An entry of the table holds the pid of a worker that is ready (0 when the entry is free), the time of its last
+# heartbeat and whether it is saturated.
+_ENTRY = struct.Struct("<qdq")
+
+# Seconds between two heartbeats of a worker
+HEARTBEAT_INTERVAL_S = 1.0
+
+# Paths answered by the health listener
+HEALTH_PATHS = ("/", "/v2/health/live", "/v2/health/ready")
+
+# The health monitor inherited from the gunicorn master. See start_monitor().
+_monitor: Optional["HealthMonitor"] = None
+
+
+class HealthMonitor:
+    """Answers the health probes from the gunicorn master, so that the probes do not wait behind scoring requests in
+    busy workers.
+
+    Workers register in a table in shared memory once they are ready to serve, and a thread of each worker then
+    records a heartbeat every ``HEARTBEAT_INTERVAL_S`` seconds. The heartbeats keep coming while the worker is busy
+    scoring, since they only need the GIL for a moment. They would also keep coming while run() hangs without holding
+    the GIL, so a worker whose requests have not made progress for ``timeout_s`` seconds past their scoring timeout
+    stops sending them. The server
+    is live while at least one registered worker is alive and has sent a heartbeat in the last ``timeout_s`` seconds,
+    and ready while one of those is not saturated.
+    """
+
+    def __init__(self, table_size: int, timeout_s: float):
+        self.table_size = table_size
+        self.timeout_s = timeout_s
+        self.server: Optional[ThreadingHTTPServer] = None
+
+        self._shm = SharedMemory(create=True, size=_ENTRY.size * table_size)
+        # Every process using the table is forked from this one and inherits the mapping, so it does not need a name.
+        self._shm.unlink()
+        # Only taken by the workers, to claim an entry. The master reads the table without it, so that it never holds
+        # the lock while forking a worker.
+        self._lock = multiprocessing.Lock()
+        self._offset: Optional[int] = None
+
+    def register(
+        self, is_saturated: Optional[Callable[[], bool]] = None, progress: Optional["RequestProgress"] = None
+    ) -> bool:
+        """Register the current process as a ready worker and start its heartbeats, which report whether the worker is
+        saturated according to ``is_saturated``. The heartbeats stop while the requests counted by ``progress`` are
+        stalled. Returns False if the table is full.
+        """
+        pid = os.getpid()
+        with self._lock:
+            for index in range(self.table_size):
+                offset = index * _ENTRY.size
+                entry_pid, _, _ = _ENTRY.unpack_from(self._shm.buf, offset)
+                # The entries of the workers that have exited are reused.
+                if entry_pid == 0 or entry_pid == pid or not is_alive(entry_pid):
+                    _ENTRY.pack_into(self._shm.buf, offset, pid, time.monotonic(), 0)
+                    break
+            else:
+                logger.warning(f"Worker {pid} cannot be registered with the health monitor, its table is full.")
+                return False
+
+        self._offset = offset
+        args = (pid, offset, is_saturated or (lambda: False), progress)
+        threading.Thread(target=self._beat, args=args, daemon=True).start()
+        return True
+
+    def _beat(
+        self, pid: int, offset: int, is_saturated: Callable[[], bool], progress: Optional["RequestProgress"]
+    ) -> None:
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL_S)
+            if self._offset != offset:
+                return
+            if progress and progress.stalled(self.timeout_s):
+                continue
+            _ENTRY.pack_into(self._shm.buf, offset, pid, time.monotonic(), int(is_saturated()))
+
+    def live_workers(self) -> int:
+        """Return the number of registered workers that are alive and sent a recent heartbeat."""
+        return sum(1 for _ in self._live_entries())
+
+    def ready_workers(self) -> int:
+        """Return the number of live workers that are not saturated."""
+        return sum(1 for saturated in self._live_entries() if not saturated)
+
+    def _live_entries(self) -> Iterator[bool]:
+        # Yields whether each live worker is saturated.
+        deadline = time.monotonic() - self.timeout_s
+        for index in range(self.table_size):
+            pid, heartbeat, saturated = _ENTRY.unpack_from(self._shm.buf, index * _ENTRY.size)
+            if pid and heartbeat >= deadline and is_alive(pid):
+                yield bool(saturated)
+
+    def serve(self, host: str, port: int) -> Tuple[str, int]:
+        """Answer the health probes on ``host``:``port`` from a thread of the current process. Returns the address the
+        listener is bound to.
+        """
+        monitor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path not in HEALTH_PATHS:
+                    self._respond(404, b"Not Found")
+                # Saturated workers are live but not ready, so that they are not restarted.
+                elif monitor.ready_workers() if path == "/v2/health/ready" else monitor.live_workers():
+                    self._respond(200, b"Healthy" if path == "/" else b"")
+                else:
+                    self._respond(503, b"Unhealthy" if path == "/" else b"")
+
+            def _respond(self, status_code: int, body: bytes) -> None:
+                self.send_response(status_code)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Probes are not logged, like on the scoring port.
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="health-monitor", daemon=True).start()
+        return self.server.server_address[:2]
+
+    def close(self) -> None:
+        self._offset = None
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        self._shm.close()
+
+
+class RequestProgress:
+    """Counts the requests a worker is serving, and when they last made progress, to tell whether they are stalled.
+    Requests make progress when they complete, and bulk requests also each time they score a record. A request may run
+    for ``budget_s()`` seconds, its scoring timeout, before the worker is expected to make progress.
+    """
+
+    def __init__(self, budget_s: Optional[Callable[[], float]] = None):
+        self.active = 0
+        self.budget_s = budget_s or (lambda: 0.0)
+        self._last_progress = time.monotonic()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.active == 0:
+                self._last_progress = time.monotonic()
+            self.active += 1
+
+    def advance(self) -> None:
+        with self._lock:
+            self._last_progress = time.monotonic()
+
+    def finish(self) -> None:
+        with self._lock:
+            self.active -= 1
+            self._last_progress = time.monotonic()
+
+    def stalled(self, timeout_s: float) -> bool:
+        """Return whether requests are being served but none has made progress in the ``timeout_s`` seconds after
+        their budget.
+        """
+        return self.active > 0 and time.monotonic() - self._last_progress > self.budget_s() + timeout_s
+
+
+def start_monitor(host: str, port: int, worker_count: int, timeout_s: float) -> HealthMonitor:
+    """Answer the health probes on ``host``:``port`` from this process, for the workers that will be forked from it."""
+    global _monitor
+    # Recycled workers stay registered until they exit, alongside their replacements.
+    _monitor = HealthMonitor(2 * worker_count, timeout_s)
+    _monitor.serve(host, port)
+    return _monitor
+
+
+def get_monitor() -> Optional[HealthMonitor]:
+    return _monitor
@@ -3,12 +3,20 @@
 
 import inspect
 import json
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 import flask
 
+from .arrow_ipc import ARROW_STREAM_CONTENT_TYPE, read_table
+from .body_codecs import Codec, CODECS
+from .columnar_input import Decoder, load_npy, NPY_CONTENT_TYPE
 from .exceptions import AzmlAssertionError, AzmlinfsrvError
 
+# Transports with a binary tensor encoding (such as gRPC) decode the tensors themselves and put them in the WSGI
+# environment under this key, as a dict of run() parameter name to NumPy array. They are passed to run() as-is instead
+# of going through JSON.
+TENSORS_ENVIRON_KEY = "azureml_inference_server_http.tensors"
+
 
 class InputError(AzmlinfsrvError):
     pass
@@ -35,6 +43,40 @@ def _parse_input(input_string: str) -> Any:
         return input_string
 
 
+def _load_npy(body: bytes) -> Any:
+    try:
+        return load_npy(body)
+    except ValueError as ex:
+        raise BadInput(f"POST body could not be decoded as a .npy array: {ex}") from None
+
+
+def _load_arrow(body: bytes) -> Any:
+    try:
+        return read_table(body)
+    except ModuleNotFoundError:
+        raise UnsupportedInput(f"{ARROW_STREAM_CONTENT_TYPE} inputs require pyarrow to be installed.") from None
+    except ValueError as ex:
+        raise BadInput(f"POST body could not be decoded as an Arrow IPC stream: {ex}") from None
+
+
+def _decode(codec: Codec, body: bytes) -> Any:
+    if not codec.available:
+        raise UnsupportedInput(f"{codec.content_type} inputs require {codec.package} to be installed.")
+    if not body:
+        raise BadInput(f"POST body is empty. Expecting a {codec.name} dictionary.")
+    try:
+        return codec.loads(body)
+    except ValueError as ex:
+        raise BadInput(f"POST body could not be decoded as {codec.name}: {ex}") from None
+
+
+# Content types of the bodies that hold a single binary value, which is passed to the first parameter of run().
+_BINARY_LOADERS = {
+    NPY_CONTENT_TYPE: _load_npy,
+    ARROW_STREAM_CONTENT_TYPE: _load_arrow,
+}
+
+
 class InputParserBase:
     __slots__ = []
 
@@ -56,6 +98,12 @@ class InputParserBase:
             f"{self.__class__} does not provide an implementation for {self._parse_post_input.__name__}."
         )
 
+    def parse_record(self, record: bytes) -> Dict[str, Any]:  # pragma: no cover
+        """Parse a record of a bulk request, which takes the place of the body of a POST request."""
+        raise AzmlAssertionError(
+            f"{self.__class__} does not provide an implementation for {self.parse_record.__name__}."
+        )
+
     def _parse_get_parameters(self, request: flask.Request) -> Dict[str, Any]:
         """Parse url parameters as if they are inputs from the request body. This function will attempt to parse all
         input values as JSON values. If a parameter shows up multiple times in the parameters, it will be parsed as a
@@ -113,8 +161,14 @@ class JsonStringInput(InputParserBase):
         return {self.parameter_name: json.dumps(self._parse_get_parameters(request))}
 
     def _parse_post_input(self, request: flask.Request) -> str:
+        if request.environ.get(TENSORS_ENVIRON_KEY):
+            raise UnsupportedInput("Tensor inputs are only supported when run() is decorated with @input_schema.")
+
+        return self.parse_record(request.data)
+
+    def parse_record(self, record: bytes) -> Dict[str, Any]:
         try:
-            return {self.parameter_name: str(request.data, "utf-8")}
+            return {self.parameter_name: str(record, "utf-8")}
         except UnicodeDecodeError as ex:
             raise BadInput(f"Input cannot be decoded as UTF-8: {ex}") from None
 
@@ -122,35 +176,66 @@ class JsonStringInput(InputParserBase):
 class ObjectInput(InputParserBase):
     """Parse the body of the request as a JSON and pass the value in the value found in ``parameter_name`` to user's
     run() function. An error is raised if ``parameter_name`` is not found in the body JSON. This is used when the
-    user's run function is decorated with @input_schema.
+    user's run function is decorated with @input_schema. MessagePack and CBOR bodies are parsed in the same way.
+
+    The values of the parameters in ``decoders`` are converted by their decoder, which turns columnar JSON and arrays
+    into the ndarrays and DataFrames that run() expects. A body in the NumPy ``.npy`` format or in the Arrow IPC
+    streaming format is passed to the first parameter.
     """
 
-    __slots__ = ["parameters"]
+    __slots__ = ["parameters", "decoders"]
 
-    def __init__(self, parameters: List[inspect.Parameter]):
-        self.parameters = parameters
+    def __init__(self, parameters: List[inspect.Parameter], decoders: Optional[Dict[str, Decoder]] = None):
+        self.parameters = list(parameters)
+        self.decoders = decoders or {}
 
     def _parse_get_input(self, request: flask.Request) -> Any:
         parsed_body = self._parse_get_parameters(request)
         return self._extract_parameters(parsed_body)
 
     def _parse_post_input(self, request: flask.Request) -> Any:
-        if not request.is_json:
+        tensors = request.environ.get(TENSORS_ENVIRON_KEY)
+        if tensors and not request.content_length:
+            # All the inputs came in as tensors.
+            return self._extract_parameters(tensors)
+
+        loader = _BINARY_LOADERS.get(request.mimetype)
+        if loader:
+            return self._extract_parameters({self.parameters[0].name: loader(request.get_data())})
+
+        codec = CODECS.get(request.mimetype)
+        if codec:
+            parsed_body = _decode(codec, request.get_data())
+        elif request.is_json:
+            body = request.get_data()
+            try:
+                parsed_body = json.loads(body)
+            except json.JSONDecodeError as ex:
+                if body:
+                    raise BadInput(f"POST body could not be decoded as JSON: {ex}") from None
+                else:
+                    raise BadInput("POST body is empty. Expecting a JSON dictionary.") from None
+        else:
             raise UnsupportedInput("Expects Content-Type to be application/json")
 
-        body = request.get_data()
+        if not isinstance(parsed_body, dict):
+            raise BadInput(f"POST body should be a {codec.name if codec else 'JSON'} dictionary.")
+
+        if tensors:
+            parsed_body.update(tensors)
+
+        return self._extract_parameters(parsed_body)
+
+    def parse_record(self, record: bytes) -> Dict[str, Any]:
         try:
-            json_body = json.loads(body)
+            parsed_record = json.loads(record)
         except json.JSONDecodeError as ex:
-            if body:
-                raise BadInput(f"POST body could not be decoded as JSON: {ex}") from None
-            else:
-                raise BadInput("POST body is empty. Expecting a JSON dictionary.") from None
+            raise BadInput(f"Record could not be decoded as JSON: {ex}") from None
 
-        if not isinstance(json_body, dict):
-            raise BadInput("POST body should be a JSON dictionary.")
+        if not isinstance(parsed_record, dict):
+            raise BadInput("Record should be a JSON dictionary.")
 
-        return self._extract_parameters(json_body)
+        return self._extract_parameters(parsed_record)
 
     def _extract_parameters(self, body: Dict) -> Dict[str, Any]:
         parameters: Dict[str, Any] = {}
@@ -159,6 +244,13 @@ class ObjectInput(InputParserBase):
             if input_value is inspect.Parameter.empty:
                 raise BadInput(f"A value is not provided for the {parameter.name!r} parameter.")
 
+            decoder = self.decoders.get(parameter.name)
+            if decoder and input_value is not parameter.default:
+                try:
+                    input_value = decoder(input_value)
+                except (TypeError, ValueError) as ex:
+                    raise BadInput(f"Invalid value for the {parameter.name!r} parameter: {ex}") from None
+
             parameters[parameter.name] = input_value
 
         return parameters
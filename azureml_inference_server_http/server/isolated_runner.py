@@ -0,0 +1,190 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+from multiprocessing.connection import Connection, Pipe
+from multiprocessing.reduction import recv_handle, send_handle
+import os
+import signal
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("azmlinfsrv.isolated_runner")
+
+# Signals that gunicorn handles in the worker. The scoring processes must not inherit the handlers of the worker.
+_RESET_SIGNALS = ("SIGTERM", "SIGINT", "SIGQUIT", "SIGHUP", "SIGUSR1", "SIGUSR2", "SIGWINCH", "SIGALRM", "SIGCHLD")
+
+
+class ScoringProcessError(Exception):
+    """The scoring process exited while running run()."""
+
+
+class RemoteTraceback(Exception):
+    """Carries the formatted traceback of an exception raised in the scoring process."""
+
+    def __init__(self, tb: str):
+        super().__init__(tb)
+        self.tb = tb
+
+    def __str__(self) -> str:
+        return self.tb
+
+
+def _reset_signals() -> None:
+    for name in _RESET_SIGNALS:
+        signum = getattr(signal, name, None)
+        if signum is not None:
+            signal.signal(signum, signal.SIG_DFL)
+
+
+def _scoring_main(conn: Connection, run: Callable[..., Any]) -> None:
+    # Serve run() calls until the worker closes the connection.
+    while True:
+        try:
+            kwargs = conn.recv()
+        except (EOFError, OSError):
+            return
+
+        try:
+            result = (True, run(**kwargs))
+        except BaseException as ex:
+            tb = traceback.format_exc()
+            # SystemExit and the like must not stop the worker when they are raised again there.
+            result = (False, ex if isinstance(ex, Exception) else RuntimeError(repr(ex)), tb)
+
+        try:
+            conn.send(result)
+        except Exception as ex:
+            # The output or the exception could not be pickled.
+            error = TypeError(f"The result of run() cannot be sent back to the worker: {ex!r}")
+            conn.send((False, error, "".join(traceback.format_exception_only(type(error), error))))
+
+
+def _template_main(conn: Connection, run: Callable[..., Any]) -> None:
+    # Fork a scoring process for each file descriptor the worker sends, and reply with its pid. The scoring processes
+    # are children of the template, so let the kernel reap them.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        try:
+            fd = recv_handle(conn)
+        except (EOFError, OSError):
+            return
+
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            conn.close()
+            try:
+                _scoring_main(Connection(fd), run)
+            finally:
+                os._exit(0)
+
+        os.close(fd)
+        conn.send(pid)
+
+
+class IsolatedRunner:
+    """Runs ``run()`` in a scoring process so that a call that exceeds its timeout can be killed, even when it is stuck
+    in native code that ``SIGALRM`` cannot interrupt.
+
+    When created, the runner forks a template process from the worker, which holds the initialized user script. Scoring
+    processes are forked from the template, so a killed scoring process is replaced without calling ``init()`` again.
+    Calls are serialized: a worker has one scoring process at a time. Inputs and outputs are pickled.
+    """
+
+    def __init__(self, run: Callable[..., Any]):
+        self._lock = threading.Lock()
+        self._scoring: Optional[Tuple[Connection, int]] = None
+
+        template_conn, child_conn = Pipe()
+        pid = os.fork()
+        if pid == 0:
+            _reset_signals()
+            template_conn.close()
+            try:
+                _template_main(child_conn, run)
+            finally:
+                os._exit(0)
+
+        child_conn.close()
+        self._template_conn = template_conn
+        self._template_pid = pid
+        self._start_scoring_process()
+        logger.info(f"Started the template of the scoring processes with pid {pid}")
+
+    def run(self, kwargs: Dict[str, Any], timeout_ms: float) -> Any:
+        """Call run() with ``kwargs`` in the scoring process. Raises TimeoutError after killing the scoring process if
+        it did not complete within ``timeout_ms``, or without calling run() if the calls ahead of this one did not
+        leave the scoring process free in time.
+        """
+        deadline = time.monotonic() + timeout_ms / 1000
+        if not self._lock.acquire(timeout=timeout_ms / 1000):
+            raise TimeoutError
+
+        try:
+            if self._scoring is None:
+                self._start_scoring_process()
+            conn, pid = self._scoring
+
+            try:
+                conn.send(kwargs)
+                completed = conn.poll(max(0, deadline - time.monotonic()))
+                result = conn.recv() if completed else None
+            except (EOFError, OSError):
+                self._restart_scoring_process()
+                raise ScoringProcessError(f"The scoring process {pid} exited unexpectedly.") from None
+
+            if not completed:
+                logger.error(f"Killing the scoring process {pid} after a timeout of {timeout_ms} ms")
+                self._restart_scoring_process()
+                raise TimeoutError
+        finally:
+            self._lock.release()
+
+        if result[0]:
+            return result[1]
+
+        _, ex, tb = result
+        ex.__cause__ = RemoteTraceback(tb)
+        raise ex
+
+    def close(self) -> None:
+        """Stop the scoring and the template processes, after the call in progress completes."""
+        with self._lock:
+            self._kill_scoring_process()
+            self._template_conn.close()
+            try:
+                os.waitpid(self._template_pid, 0)
+            except ChildProcessError:
+                pass
+
+    def _start_scoring_process(self) -> None:
+        conn, child_conn = Pipe()
+        try:
+            send_handle(self._template_conn, child_conn.fileno(), self._template_pid)
+            pid = self._template_conn.recv()
+        finally:
+            child_conn.close()
+        self._scoring = (conn, pid)
+
+    def _kill_scoring_process(self) -> None:
+        if self._scoring is None:
+            return
+
+        conn, pid = self._scoring
+        self._scoring = None
+        conn.close()
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _restart_scoring_process(self) -> None:
+        self._kill_scoring_process()
+        try:
+            self._start_scoring_process()
+        except (EOFError, OSError):
+            # The next call will try again.
+            logger.error("Failed to start a new scoring process: {0}".format(traceback.format_exc()))
@@ -0,0 +1,78 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import contextlib
+import logging
+import threading
+from typing import Iterator, Optional
+
+from .admission import AdmissionController
+
+logger = logging.getLogger("azmlinfsrv.load_tracker")
+
+# Headers through which the load of the worker is reported to clients and load balancers
+UTILIZATION_HEADER = "x-ms-worker-utilization"
+QUEUE_DEPTH_HEADER = "x-ms-worker-queue-depth"
+
+
+class LoadTracker:
+    """Counts the scoring requests of a worker, from the time they arrive until they are answered, to report the load
+    of the worker and whether it is saturated.
+
+    The worker becomes saturated when ``high_watermark`` requests are pending (being scored or waiting in the admission
+    queue), and stops being saturated once no more than ``low_watermark`` requests are pending, so that its readiness
+    does not flap around a single threshold. Saturation is not tracked when ``high_watermark`` is not set.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        high_watermark: Optional[int] = None,
+        low_watermark: Optional[int] = None,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.capacity = capacity
+        self.high_watermark = high_watermark
+        if low_watermark is None and high_watermark is not None:
+            low_watermark = high_watermark // 2
+        self.low_watermark = low_watermark
+        self.admission = admission
+        self.saturated = False
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Number of requests being scored or waiting to be admitted."""
+        return self._pending
+
+    @property
+    def queued(self) -> int:
+        """Number of requests waiting to be admitted."""
+        return self.admission.queued if self.admission else 0
+
+    @property
+    def utilization(self) -> float:
+        """Share of the scoring capacity of the worker in use."""
+        return min(1.0, max(0, self._pending - self.queued) / self.capacity)
+
+    @contextlib.contextmanager
+    def track(self) -> Iterator[None]:
+        """Count a request as pending while in the context."""
+        self._add(1)
+        try:
+            yield
+        finally:
+            self._add(-1)
+
+    def _add(self, delta: int) -> None:
+        with self._lock:
+            self._pending += delta
+            if self.high_watermark is None:
+                return
+            if not self.saturated and self._pending >= self.high_watermark:
+                self.saturated = True
+                logger.warning(f"The worker is saturated with {self._pending} pending requests. It is not ready.")
+            elif self.saturated and self._pending <= self.low_watermark:
+                self.saturated = False
+                logger.info(f"The worker has {self._pending} pending requests. It is ready again.")
@@ -0,0 +1,119 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import collections
+import contextlib
+import logging
+import threading
+import tracemalloc
+from typing import Deque, Iterator, NamedTuple, Optional
+
+from .utils import get_rss
+
+logger = logging.getLogger("azmlinfsrv.memory")
+
+# Number of frames recorded per allocation. More frames give better allocation sites but slow down tracing.
+TRACEBACK_FRAMES = 10
+
+# Number of allocation sites logged when a leak is suspected.
+TOP_ALLOCATION_SITES = 10
+
+
+class MemoryUsage(NamedTuple):
+    # Change of the resident set size of the worker during run(), in bytes. None if the RSS cannot be read.
+    rss_delta: Optional[int]
+    # Peak of the memory allocated by Python during run(), over what was allocated before it, in bytes.
+    traced_peak: int
+
+
+class MemoryMeasurement:
+    __slots__ = ["usage"]
+
+    def __init__(self):
+        self.usage: Optional[MemoryUsage] = None
+
+
+class MemoryTracker:
+    """Measures the memory used by each call of ``run()`` and watches for leaks.
+
+    Tracing is done with ``tracemalloc``, which is started when the tracker starts, along with a baseline snapshot.
+    After every request, the memory traced by Python is recorded in a rolling window of ``window`` requests. When the
+    window is full, split in quarters, and the median of each quarter grew over the previous one by a total of more
+    than ``threshold_mb``, the top allocation sites compared to the baseline are logged and the window starts over.
+
+    Workers serving concurrent requests measure the memory of all of them, so per-request figures are approximate.
+    """
+
+    def __init__(self, window: int, threshold_mb: float):
+        self.window = max(window, 4)
+        self.threshold = threshold_mb * 1024 * 1024
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self._traced: Deque[int] = collections.deque(maxlen=self.window)
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEBACK_FRAMES)
+        self.take_baseline()
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+        self.baseline = None
+
+    def take_baseline(self) -> None:
+        """Take the snapshot that allocation sites are compared to when a leak is suspected."""
+        self.baseline = tracemalloc.take_snapshot()
+        with self._lock:
+            self._traced.clear()
+
+    @contextlib.contextmanager
+    def track(self) -> Iterator[MemoryMeasurement]:
+        """Measure the memory used by the block. The usage is set on the yielded measurement when the block exits."""
+        measurement = MemoryMeasurement()
+        rss_before = get_rss()
+        traced_before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            yield measurement
+        finally:
+            traced_after, traced_peak = tracemalloc.get_traced_memory()
+            rss_after = get_rss()
+            rss_delta = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+            measurement.usage = MemoryUsage(rss_delta=rss_delta, traced_peak=max(traced_peak - traced_before, 0))
+            self.record(traced_after)
+
+    def record(self, traced: int) -> bool:
+        """Record the memory traced after a request. Returns whether a leak is suspected."""
+        with self._lock:
+            self._traced.append(traced)
+            if not self._is_growing():
+                return False
+            growth = self._traced[-1] - self._traced[0]
+            self._traced.clear()
+
+        logger.warning(
+            f"Memory traced by Python grew by {growth / 1024 / 1024:.1f} MB over the last {self.window} requests."
+            " This may be a memory leak in the scoring script."
+        )
+        self.log_top_allocations()
+        return True
+
+    def log_top_allocations(self) -> None:
+        if self.baseline is None:
+            return
+
+        stats = tracemalloc.take_snapshot().compare_to(self.baseline, "lineno")
+        lines = [f"Top {TOP_ALLOCATION_SITES} allocation sites since the worker became ready:"]
+        for stat in stats[:TOP_ALLOCATION_SITES]:
+            lines.append(f"  {stat}")
+        logger.warning("\n".join(lines))
+
+    def _is_growing(self) -> bool:
+        if len(self._traced) < self.window:
+            return False
+
+        samples = list(self._traced)
+        size = len(samples) // 4
+        medians = [sorted(samples[start:][:size])[size // 2] for start in range(0, 4 * size, size)]
+        increasing = all(earlier < later for earlier, later in zip(medians, medians[1:]))
+        return increasing and medians[-1] - medians[0] > self.threshold
@@ -0,0 +1,196 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Metrics of the server in the Prometheus text exposition format. See
+https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format for the specification.
+"""
+
+import logging
+from multiprocessing.shared_memory import SharedMemory
+import os
+import struct
+from typing import Dict, List, Optional, Tuple, Union
+
+from .admission import AdmissionController, OTHER_TENANTS, TenantStats
+from .config import config
+from .utils import is_alive, ProcessLock
+
+logger = logging.getLogger("azmlinfsrv.metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# The metrics table inherited from the gunicorn master. See start_shared_metrics().
+_shared: Optional["SharedMetrics"] = None
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class SharedMetrics:
+    """The admission metrics of all the workers of the server, so that whichever worker serves ``/metrics`` returns
+    the metrics of the server.
+
+    Each worker writes its metrics to a slot of a table in shared memory, created before the workers are forked, and
+    the slots are summed when the metrics are served. The gauges of a worker are no longer counted once it has exited,
+    while its counters are kept: when its slot is taken by a new worker, they are added to the first slot of the table,
+    which no worker owns.
+    """
+
+    def __init__(self, tenants: List[str], slots: int):
+        self.tenants = sorted({*tenants, OTHER_TENANTS})
+        self._index = {tenant: index for index, tenant in enumerate(self.tenants)}
+        # A slot holds the pid of its worker (0 when free), the number of requests being scored, and for each tenant
+        # the number of requests waiting, admitted and shed, and the time they waited.
+        self._slot = struct.Struct(f"<q{1 + 4 * len(self.tenants)}d")
+        self._slots = slots + 1
+
+        self._shm = SharedMemory(create=True, size=self._slot.size * self._slots)
+        # Every process using the table is forked from this one and inherits the mapping, so it does not need a name.
+        self._shm.unlink()
+        self._lock = ProcessLock()
+
+        # Offset of the slot of this process, claimed on the first update
+        self._pid = 0
+        self._offset: Optional[int] = None
+
+    def publish(self, active: int, stats: Dict[str, TenantStats]) -> None:
+        """Write the metrics of this worker to its slot. Only the worker writes to its slot, so this does not take
+        the lock of the table.
+        """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._offset = self._claim()
+        if self._offset is None:
+            return
+
+        values = [0.0] * (4 * len(self.tenants))
+        for tenant, tenant_stats in stats.items():
+            index = 4 * self._index.get(tenant, self._index[OTHER_TENANTS])
+            values[index] += tenant_stats.queued
+            values[index + 1] += tenant_stats.admitted
+            values[index + 2] += tenant_stats.shed
+            values[index + 3] += tenant_stats.wait_s
+        self._slot.pack_into(self._shm.buf, self._offset, self._pid, active, *values)
+
+    def collect(self) -> Tuple[int, Dict[str, TenantStats]]:
+        """Return the number of requests being scored and the metrics of the tenants, summed over the workers."""
+        active = 0
+        totals = {tenant: TenantStats() for tenant in self.tenants}
+        with self._lock:
+            for index in range(self._slots):
+                pid, slot_active, *values = self._slot.unpack_from(self._shm.buf, index * self._slot.size)
+                live = index > 0 and pid > 0 and _is_alive(pid)
+                if live:
+                    active += int(slot_active)
+                for tenant, stats in totals.items():
+                    offset = 4 * self._index[tenant]
+                    if live:
+                        stats.queued += int(values[offset])
+                    stats.admitted += int(values[offset + 1])
+                    stats.shed += int(values[offset + 2])
+                    stats.wait_s += values[offset + 3]
+        return active, totals
+
+    def _claim(self) -> Optional[int]:
+        # Returns the offset of a free slot, or of the slot of a worker that exited once its counters have been moved
+        # to the first slot.
+        with self._lock:
+            retired = None
+            for index in range(1, self._slots):
+                offset = index * self._slot.size
+                (pid,) = struct.unpack_from("<q", self._shm.buf, offset)
+                if pid == 0:
+                    break
+                if retired is None and not _is_alive(pid):
+                    retired = offset
+            else:
+                if retired is None:
+                    logger.warning("The metrics table is full. The metrics of this worker are not served.")
+                    return None
+                offset = retired
+                self._retire(offset)
+
+            self._slot.pack_into(self._shm.buf, offset, self._pid, *[0.0] * (self._slot.size // 8 - 1))
+            return offset
+
+    def _retire(self, offset: int) -> None:
+        # Adds the counters of the slot at offset to the first slot. Called with the lock.
+        _, _, *values = self._slot.unpack_from(self._shm.buf, offset)
+        _, _, *totals = self._slot.unpack_from(self._shm.buf, 0)
+        for index in range(0, len(values), 4):
+            for counter in (index + 1, index + 2, index + 3):
+                totals[counter] += values[counter]
+        self._slot.pack_into(self._shm.buf, 0, 0, 0, *totals)
+
+    def close(self) -> None:
+        self._shm.close()
+        self._lock.close()
+
+
+def _is_alive(pid: int) -> bool:
+    # Signals cannot probe a process on Windows, where the server runs in a single process anyway.
+    return os.name == "nt" or is_alive(pid)
+
+
+def start_shared_metrics(worker_count: int) -> Optional[SharedMetrics]:
+    """Create the metrics table that the processes forked from this one will share, if admission control is enabled.
+    Workers that are replaced exit shortly after their replacement is started, so the table has room for twice as many
+    workers.
+    """
+    global _shared
+    if config.max_concurrent_requests:
+        _shared = SharedMetrics(list(config.tenant_weights), 2 * worker_count)
+    return _shared
+
+
+def get_shared_metrics() -> Optional[SharedMetrics]:
+    return _shared
+
+
+class _Writer:
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def metric(self, name: str, metric_type: str, description: str) -> None:
+        self.lines.append(f"# HELP {name} {description}")
+        self.lines.append(f"# TYPE {name} {metric_type}")
+
+    def sample(self, name: str, value: Union[int, float], **labels: str) -> None:
+        if labels:
+            formatted = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+            name = f"{name}{{{formatted}}}"
+        self.lines.append(f"{name} {value}")
+
+
+def render(admission: Optional[AdmissionController], shared: Optional[SharedMetrics] = None) -> str:
+    """Return the metrics of the server: those of all its workers when they share them through ``shared``, or else
+    those of this process.
+    """
+    writer = _Writer()
+
+    if admission:
+        active, by_tenant = shared.collect() if shared else (admission.active, admission.stats())
+        writer.metric("azmlinfsrv_admission_active", "gauge", "Number of requests being scored.")
+        writer.sample("azmlinfsrv_admission_active", active)
+
+        stats = sorted(by_tenant.items())
+        writer.metric("azmlinfsrv_admission_queue_depth", "gauge", "Number of requests waiting to be admitted.")
+        for tenant, tenant_stats in stats:
+            writer.sample("azmlinfsrv_admission_queue_depth", tenant_stats.queued, tenant=tenant)
+        writer.metric("azmlinfsrv_admission_admitted_total", "counter", "Number of requests admitted.")
+        for tenant, tenant_stats in stats:
+            writer.sample("azmlinfsrv_admission_admitted_total", tenant_stats.admitted, tenant=tenant)
+        writer.metric("azmlinfsrv_admission_shed_total", "counter", "Number of requests shed.")
+        for tenant, tenant_stats in stats:
+            writer.sample("azmlinfsrv_admission_shed_total", tenant_stats.shed, tenant=tenant)
+        writer.metric(
+            "azmlinfsrv_admission_wait_seconds", "summary", "Time the admitted and shed requests waited in the queue."
+        )
+        for tenant, tenant_stats in stats:
+            writer.sample("azmlinfsrv_admission_wait_seconds_sum", round(tenant_stats.wait_s, 6), tenant=tenant)
+            writer.sample(
+                "azmlinfsrv_admission_wait_seconds_count", tenant_stats.admitted + tenant_stats.shed, tenant=tenant
+            )
+
+    return "".join(f"{line}\n" for line in writer.lines)
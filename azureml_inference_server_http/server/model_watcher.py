@@ -0,0 +1,207 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import gc
+import importlib.util
+import logging
+import os
+import threading
+import time
+import traceback
+from typing import Callable, Optional, Tuple
+
+from .config import config
+from .user_script import UserScript
+from .utils import SharedLock
+from .warmup import warm_up
+
+logger = logging.getLogger("azmlinfsrv.model_watcher")
+
+# (model directory to serve, resolved path of the model directory, modification time of the model directory)
+_ModelVersion = Tuple[str, Optional[str], Optional[int]]
+
+
+def _find_main_script() -> str:
+    # Without an entry script the user script is `import main`. Import it from its file instead so that the candidate
+    # gets its own module (and its own globals) rather than the module cached in sys.modules.
+    spec = importlib.util.find_spec("main")
+    if spec is None or not spec.origin:
+        raise FileNotFoundError("Could not locate main.py on the PYTHONPATH.")
+    return spec.origin
+
+
+class ModelWatcher:
+    """Watches the model directory (or ``config.model_version_file``) and loads a new copy of the user script when
+    the model changes. The new copy is initialized by calling the user's ``init()`` while the current copy keeps
+    serving. Once it has passed the warm-up requests, ``on_swap`` is invoked with it so the caller can switch traffic.
+    Requests scored under ``lock`` (in shared mode) only wait for the switch. Loading is given up on after
+    ``config.model_load_timeout`` seconds.
+
+    An ``init()`` that takes a ``model_dir`` argument is passed the new model directory. Otherwise ``init()`` reads
+    it from ``AZUREML_MODEL_DIR``, which is process-wide state that ``run()`` may read too, so requests wait while
+    ``init()`` runs.
+
+    When ``config.model_version_file`` is set, its content is the path of the model directory to serve. In either case
+    a change to the modification time of the model directory (or to the target of a symlink) is treated as a new
+    version.
+    """
+
+    def __init__(
+        self,
+        interval_s: float,
+        current: UserScript,
+        on_swap: Callable[[UserScript], None],
+        lock: Optional[SharedLock] = None,
+    ):
+        self.interval_s = interval_s
+        self.current = current
+        self.on_swap = on_swap
+        # Held exclusively while AZUREML_MODEL_DIR points to a new model, and by requests in shared mode while scoring.
+        self.lock = lock or SharedLock()
+        self._stopped = threading.Event()
+        self._version = self._get_version()
+        self._thread = threading.Thread(target=self._watch, name="azmlinfsrv-model-watcher", daemon=True)
+        # Thread of the last step of a load given up on, and whether a step was given up on while it ran
+        self._abandoned_step: Optional[threading.Thread] = None
+        self._abandoned_lock = threading.Lock()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def check(self) -> bool:
+        """Swap in the new model if the model version changed. Returns whether a swap happened."""
+        version = self._get_version()
+        if version == self._version:
+            return False
+
+        if self._abandoned_step is not None and self._abandoned_step.is_alive():
+            # Wait for the load given up on to end, so that it does not replace the schemas of the next one.
+            logger.warning("The previous model version given up on is still loading. Waiting for it to end.")
+            return False
+
+        # Record the version up front so that a broken model is not retried on every poll.
+        self._version = version
+        model_dir = version[0]
+        logger.info(f"Detected a new model version at {model_dir}. Loading it alongside the current model.")
+
+        candidate = self._load_candidate(model_dir)
+        if candidate is None:
+            # The current script keeps serving, with its own schemas.
+            self.current.install_schemas()
+            return False
+
+        # Requests still running against the current script may read the model directory, so it is switched once
+        # they finish.
+        with self.lock.exclusive():
+            self._set_model_dir(model_dir)
+            candidate.install_schemas()
+            self.on_swap(candidate)
+            self.current = candidate
+
+        # Nothing references the previous script anymore once in-flight requests finish. Collect now so its model is
+        # released right away instead of at the next collection (models often sit in reference cycles).
+        gc.collect()
+        logger.info(f"Now serving the model at {model_dir}")
+        return True
+
+    def _load_candidate(self, model_dir: str) -> Optional[UserScript]:
+        try:
+            candidate = UserScript(self.current.entry_script or _find_main_script())
+        except Exception:
+            logger.error(
+                "Failed to load the new model version. Continuing with the current model. {0}".format(
+                    traceback.format_exc()
+                )
+            )
+            return None
+
+        deadline = time.monotonic() + config.model_load_timeout
+        loaded = (
+            self._run_step(lambda: candidate.load_script(config.app_root), deadline)
+            and self._init_candidate(candidate, model_dir, deadline)
+            and self._run_step(lambda: warm_up(candidate), deadline)
+        )
+        return candidate if loaded else None
+
+    def _init_candidate(self, candidate: UserScript, model_dir: str, deadline: float) -> bool:
+        if candidate.init_takes_model_dir:
+            return self._run_step(lambda: candidate.invoke_init(model_dir), deadline)
+
+        # init() reads the model directory from AZUREML_MODEL_DIR, so requests are not scored while it points to the
+        # new model.
+        with self.lock.exclusive():
+            previous_model_dir = os.environ.get("AZUREML_MODEL_DIR")
+            self._set_model_dir(model_dir)
+            try:
+                return self._run_step(candidate.invoke_init, deadline)
+            finally:
+                self._set_model_dir(previous_model_dir)
+
+    def _run_step(self, step: Callable[[], None], deadline: float) -> bool:
+        # Signals can't interrupt the user script outside of the main thread. Run each step of the load in a thread of
+        # its own instead, and give up on it (leaving the thread to finish in the background) when it misses the
+        # deadline.
+        succeeded = threading.Event()
+
+        def run():
+            try:
+                step()
+                succeeded.set()
+            except Exception:
+                logger.error(
+                    "Failed to load the new model version. Continuing with the current model. {0}".format(
+                        traceback.format_exc()
+                    )
+                )
+            finally:
+                with self._abandoned_lock:
+                    if self._abandoned_step is threading.current_thread():
+                        # Importing the script given up on may have registered its schemas in place of the schemas
+                        # of the current script.
+                        self.current.install_schemas()
+
+        thread = threading.Thread(target=run, name="azmlinfsrv-model-loader", daemon=True)
+        thread.start()
+        thread.join(max(0, deadline - time.monotonic()))
+        if thread.is_alive():
+            with self._abandoned_lock:
+                self._abandoned_step = thread
+            logger.error(
+                f"The new model version was not loaded within {config.model_load_timeout} seconds. Continuing with the"
+                " current model."
+            )
+            return False
+
+        return succeeded.is_set()
+
+    def _set_model_dir(self, model_dir: Optional[str]) -> None:
+        if model_dir is None:
+            os.environ.pop("AZUREML_MODEL_DIR", None)
+            config.azureml_model_dir = ""
+        else:
+            os.environ["AZUREML_MODEL_DIR"] = model_dir
+            config.azureml_model_dir = model_dir
+
+    def _get_version(self) -> _ModelVersion:
+        model_dir = config.azureml_model_dir
+        if config.model_version_file:
+            try:
+                with open(config.model_version_file) as fp:
+                    model_dir = fp.read().strip() or model_dir
+            except OSError:
+                pass
+
+        try:
+            return model_dir, os.path.realpath(model_dir), os.stat(model_dir).st_mtime_ns
+        except OSError:
+            return model_dir, None, None
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval_s):
+            try:
+                self.check()
+            except Exception:
+                logger.error("Error while checking for a new model version: {0}".format(traceback.format_exc()))
@@ -0,0 +1,93 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import hashlib
+import logging
+from multiprocessing.shared_memory import SharedMemory
+import struct
+import time
+from typing import Optional, Tuple
+
+from .config import config
+from .utils import ProcessLock
+
+logger = logging.getLogger("azmlinfsrv.rate_limiter")
+
+# An entry of the table holds the hash of the client key (0 when the entry is free), the tokens in the bucket of the
+# client and the time the bucket was last refilled.
+_ENTRY = struct.Struct("<Qdd")
+
+# Number of entries looked at to find the entry of a client.
+_MAX_PROBES = 8
+
+# The rate limiter inherited from the gunicorn master. See start_limiter().
+_limiter: Optional["RateLimiter"] = None
+
+
+class RateLimiter:
+    """Token buckets that limit each client to ``rate`` requests per second, with bursts of up to ``burst`` requests.
+
+    The buckets are kept in a fixed-size hash table in shared memory, so that all the processes forked after the rate
+    limiter is created enforce one combined budget per client. When the table is full, the client that was seen the
+    longest ago is forgotten.
+    """
+
+    def __init__(self, rate: float, burst: float, table_size: int):
+        self.rate = rate
+        self.burst = burst
+        self.table_size = table_size
+
+        self._shm = SharedMemory(create=True, size=_ENTRY.size * table_size)
+        # Every process using the table is forked from this one and inherits the mapping, so it does not need a name.
+        self._shm.unlink()
+        self._lock = ProcessLock()
+
+    def acquire(self, key: str) -> float:
+        """Take a token from the bucket of the client ``key``. Returns 0 if the request may proceed, or else the time
+        in seconds until the bucket holds a token again.
+        """
+        # Keys may be secrets such as API keys, so only their hash is stored. 0 marks a free entry.
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+        with self._lock:
+            now = time.monotonic()
+            offset, tokens, refilled_at = self._find(key_hash, now)
+            tokens = min(self.burst, tokens + (now - refilled_at) * self.rate)
+            retry_after_s = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after_s = (1 - tokens) / self.rate
+            _ENTRY.pack_into(self._shm.buf, offset, key_hash, tokens, now)
+            return retry_after_s
+
+    def _find(self, key_hash: int, now: float) -> Tuple[int, float, float]:
+        # Returns the offset, tokens and refill time of the entry of the client. A new client starts with a full
+        # bucket. Called with the lock.
+        oldest = None
+        for probe in range(_MAX_PROBES):
+            offset = ((key_hash + probe) % self.table_size) * _ENTRY.size
+            entry_hash, tokens, refilled_at = _ENTRY.unpack_from(self._shm.buf, offset)
+            if entry_hash == key_hash:
+                return offset, tokens, refilled_at
+            if entry_hash == 0:
+                return offset, self.burst, now
+            if oldest is None or refilled_at < oldest[1]:
+                oldest = (offset, refilled_at)
+        return oldest[0], self.burst, now
+
+    def close(self) -> None:
+        self._shm.close()
+        self._lock.close()
+
+
+def start_limiter() -> Optional[RateLimiter]:
+    """Create the rate limiter that the processes forked from this one will share, if rate limiting is enabled."""
+    global _limiter
+    if config.rate_limit_per_second:
+        burst = config.rate_limit_burst or max(1.0, config.rate_limit_per_second)
+        _limiter = RateLimiter(config.rate_limit_per_second, burst, config.rate_limit_table_size)
+    return _limiter
+
+
+def get_limiter() -> Optional[RateLimiter]:
+    return _limiter
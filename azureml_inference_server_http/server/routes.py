@@ -1,29 +1,40 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import contextlib
 import datetime
 import faulthandler
+import json
 import logging
-import os
+import math
+import random
 import time
 import traceback
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 import uuid
 
-from flask import g, request, Response
+from flask import g, Request, request, Response, stream_with_context
 from werkzeug.exceptions import HTTPException
 
+from azureml_inference_server_http import __version__
 from azureml_inference_server_http.api.aml_response import AMLResponse
+from . import arrow_ipc, body_codecs, metrics, v2_protocol
+from .admission import AdmissionRejected, PRIORITY_HEADER, RETRY_AFTER_S
 from .aml_blueprint import AMLInferenceBlueprint
+from .async_operations import error_result, OPERATION_RETRY_AFTER_S, OperationResult, OperationsFull, RUNNING
 from .config import config
+from .executor_pool import OutputTooLargeError, PayloadTooLargeError
 from .input_parsers import (
     BadInput,
     JsonStringInput,
     RawRequestInput,
+    TENSORS_ENVIRON_KEY,
     UnsupportedHTTPMethod,
     UnsupportedInput,
 )
+from .load_tracker import QUEUE_DEPTH_HEADER, UTILIZATION_HEADER
 from .swagger import SwaggerException
-from .user_script import TimedResult, UserScriptException, UserScriptTimeout
+from .user_script import TimedResult, UserScriptException, UserScriptKilled, UserScriptTimeout
 
 # Get (hopefully useful, but at least obvious) output from segfaults, etc.
 faulthandler.enable()
@@ -31,6 +42,7 @@ faulthandler.enable()
 HEADER_LIMIT = 100
 
 logger = logging.getLogger("azmlinfsrv")
+access_logger = logging.getLogger("azmlinfsrv.access")
 main_blueprint = AMLInferenceBlueprint("main", __name__)
 
 
@@ -39,6 +51,18 @@ def wrap_response(response):
     response_body = response
     response_status_code = 200
 
+    # Tabular outputs are sent in the Arrow IPC streaming format to the clients that ask for it.
+    if arrow_ipc.accepts_arrow(request):
+        table = arrow_ipc.to_table(response)
+        if table is not None:
+            response_headers["Content-Type"] = arrow_ipc.ARROW_STREAM_CONTENT_TYPE
+            return AMLResponse(arrow_ipc.write_table(table), response_status_code, response_headers)
+
+    codec = body_codecs.negotiate(request)
+    if codec:
+        response_headers["Content-Type"] = codec.content_type
+        return AMLResponse(codec.dumps(response_body), response_status_code, response_headers)
+
     return AMLResponse(response_body, response_status_code, response_headers, json_str=True)
 
 
@@ -64,6 +88,13 @@ def health_probe():
     return "Healthy"
 
 
+@main_blueprint.route("/metrics", methods=["GET"])
+def get_metrics():
+    # Whichever worker serves the request, the metrics are those of all the workers. See metrics.SharedMetrics.
+    body = metrics.render(main_blueprint.admission, main_blueprint.shared_metrics)
+    return Response(body, status=200, mimetype=metrics.CONTENT_TYPE)
+
+
 # Errors from Server Side
 @main_blueprint.errorhandler(HTTPException)
 def handle_http_exception(ex: HTTPException):
@@ -88,20 +119,26 @@ def all_unhandled_exception(error):
     return ErrorResponse(500, internal_error)
 
 
-@main_blueprint.before_request
+# Requests matching no route are timed, identified and logged too, so these hooks are registered on the app.
+@main_blueprint.before_app_request
 def _before_request() -> None:
+    if main_blueprint.request_progress:
+        main_blueprint.request_progress.start()
     g.api_name = None
-    g.start_datetime = datetime.datetime.utcnow()
+    # The start time is only reported to App Insights.
+    g.start_datetime = datetime.datetime.utcnow() if main_blueprint.appinsights_client.enabled else None
     g.starting_perf_counter = time.perf_counter()
 
 
-@main_blueprint.before_request
+@main_blueprint.before_app_request
 def _init_headers() -> None:
     g.request_id = ""
     g.client_request_id = ""
     g.legacy_client_request_id = ""
 
-    request_id = request.headers.get("x-request-id", str(uuid.uuid4()))
+    request_id = request.headers.get("x-request-id")
+    if request_id is None:
+        request_id = str(uuid.uuid4())
     if len(request_id) <= HEADER_LIMIT:
         g.request_id = request_id
     else:
@@ -113,13 +150,16 @@ def _init_headers() -> None:
     legacy_client_request_id = request.headers.get("x-ms-request-id", "")
     client_request_id = request.headers.get("x-ms-client-request-id", "")
     if legacy_client_request_id:
-        # Warning message
-        logger.warning(
-            (
-                "x-ms-request-id header has been deprecated and will be removed from future versions of the server."
-                " Please use x-ms-client-request-id."
+        # Warning message. With AML_LOG_THROTTLE_WINDOW_SECONDS set, it is logged once per window rather than for every
+        # request of a client.
+        deprecated = main_blueprint.log_throttle.admit("x-ms-request-id deprecated", "The x-ms-request-id header")
+        if deprecated is not None:
+            logger.warning(
+                (
+                    "x-ms-request-id header has been deprecated and will be removed from future versions of the"
+                    " server. Please use x-ms-client-request-id."
+                )
             )
-        )
         # When `x-ms-request-id` is set and `x-ms-client-request-id` isn't. Use `x-ms-request-id` as the Client Request
         # ID.
         if not client_request_id:
@@ -138,11 +178,35 @@ def _init_headers() -> None:
         )
 
 
-@main_blueprint.after_request
+# Endpoints whose requests count against the rate limit of their client
+RATE_LIMITED_ENDPOINTS = {"main.handle_score", "main.handle_score_bulk", "main.v2_infer"}
+
+
+@main_blueprint.before_request
+def _rate_limit() -> Optional[Response]:
+    # Runs before the body is read, so that clients over their limit cost as little as possible.
+    if main_blueprint.rate_limiter is None or request.endpoint not in RATE_LIMITED_ENDPOINTS:
+        return None
+
+    key = request.headers.get(config.rate_limit_header)
+    if not key:
+        # Clients without a key are limited by their address, rather than sharing a single budget.
+        key = f"address:{request.remote_addr}"
+    elif config.rate_limit_key_length:
+        key = key[: config.rate_limit_key_length]
+    retry_after_s = main_blueprint.rate_limiter.acquire(key)
+    if not retry_after_s:
+        return None
+
+    response = ErrorResponse(429, "Too many requests. Retry later.")
+    response.headers["Retry-After"] = str(math.ceil(retry_after_s))
+    return response
+
+
+@main_blueprint.after_app_request
 def populate_response_headers(response: Response) -> Response:
-    server_ver = os.environ.get("HTTP_X_MS_SERVER_VERSION", "")
-    if server_ver:
-        response.headers.add("x-ms-server-version", server_ver)
+    if main_blueprint.server_version:
+        response.headers.add("x-ms-server-version", main_blueprint.server_version)
 
     # We may not have a request id we receive an invalid request id.
     if g.request_id:
@@ -156,37 +220,36 @@ def populate_response_headers(response: Response) -> Response:
     if "TraceId" in request.headers:
         response.headers.add("TraceId", request.headers["TraceId"])
 
+    # Let load balancers pick the least loaded replica. Scored requests report the load recorded while they still
+    # counted towards it (see _admit()), the others report the current load.
+    load_tracker = main_blueprint.load_tracker
+    if config.load_headers_enabled and load_tracker:
+        utilization, queued = g.get("worker_load") or (load_tracker.utilization, load_tracker.queued)
+        response.headers[UTILIZATION_HEADER] = f"{utilization:.2f}"
+        response.headers[QUEUE_DEPTH_HEADER] = str(queued)
+
     return response
 
 
 # log all response status code after request is done
-@main_blueprint.after_request
+@main_blueprint.after_app_request
 def _after_request(response: Response) -> Response:
     duration_ms = (time.perf_counter() - g.starting_perf_counter) * 1e3  # second to millisecond
-    if g.api_name:
-        path = request.path
-        # No query, don't bother
-        if request.query_string:
-            path += f"?{request.query_string.decode()}"
 
+    if main_blueprint.request_progress and response.is_streamed:
+        g.finish_on_close = True
+        response.call_on_close(main_blueprint.request_progress.finish)
+
+    # Health probes and metrics scrapes are not logged. Every other request is, including those matching no route.
+    if request.path not in ("/", "/metrics") and not request.path.startswith("/v2/health/"):
+        entry = _access_entry(response)
         if response.is_streamed:
-            response_length = "N/A"
+            # The body of a streamed response, such as the results of /score/bulk, is generated after this. The request
+            # is logged once the body is sent, with the time it took.
+            start = g.starting_perf_counter
+            response.call_on_close(lambda: _log_access(entry, (time.perf_counter() - start) * 1e3))
         else:
-            response_length = response.calculate_content_length()
-
-        response_props = (
-            request.method,
-            path,
-            response.status_code,
-            # Always show 3 decimal places of precision
-            "{:0.3f}ms".format(round(duration_ms, 3)),
-            response_length,
-        )
-
-        logger.info(" ".join(map(str, response_props)))
-
-    # Log to app insights
-    if request.path != "/":
+            _log_access(entry, duration_ms)
         main_blueprint.appinsights_client.log_request(
             request=request,
             response=response,
@@ -196,10 +259,70 @@ def _after_request(response: Response) -> Response:
             client_request_id=g.client_request_id,
         )
 
+    # Recycling relies on gunicorn draining the worker on SIGTERM, so it is only done under gunicorn.
+    if main_blueprint.worker_recycler and request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn/"):
+        main_blueprint.worker_recycler.after_request()
+
     return response
 
 
-def log_successful_request(timed_result: TimedResult):
+@main_blueprint.teardown_app_request
+def _teardown_request(error: Optional[BaseException]) -> None:
+    # Called once the response is sent, but before the body of streamed responses is generated. Those are finished
+    # once their body is sent (see _after_request).
+    if main_blueprint.request_progress and not g.get("finish_on_close"):
+        main_blueprint.request_progress.finish()
+
+
+def _access_entry(response: Response) -> Dict[str, Any]:
+    path = request.path
+    # No query, don't bother
+    if request.query_string:
+        path += f"?{request.query_string.decode()}"
+
+    return {
+        "method": request.method,
+        "path": path,
+        # Requests matching no route are grouped by their path.
+        "api": g.api_name or request.path,
+        "status": response.status_code,
+        "duration_ms": None,
+        "response_length": None if response.is_streamed else response.calculate_content_length(),
+        "request_id": g.request_id,
+        "client_request_id": g.client_request_id,
+        "remote_addr": request.remote_addr,
+        "user_agent": request.user_agent.string,
+    }
+
+
+def _log_access(entry: Dict[str, Any], duration_ms: float) -> None:
+    # Failed and slow requests are always logged, the others are sampled.
+    slow_request_ms = config.access_log_slow_request_ms
+    slow = slow_request_ms is not None and duration_ms >= slow_request_ms
+    if entry["status"] < 400 and not slow and random.random() >= config.access_log_sample_rate:
+        return
+
+    entry["duration_ms"] = round(duration_ms, 3)
+    if config.access_log_format == "json":
+        access_logger.info(json.dumps(entry))
+        return
+
+    response_props = (
+        entry["method"],
+        entry["path"],
+        entry["status"],
+        # Always show 3 decimal places of precision
+        "{:0.3f}ms".format(entry["duration_ms"]),
+        "N/A" if entry["response_length"] is None else entry["response_length"],
+    )
+    access_logger.info(" ".join(map(str, response_props)))
+
+
+def log_successful_request(
+    timed_result: TimedResult, request_id: Optional[str] = None, client_request_id: Optional[str] = None
+):
+    # The request ids default to those of the current request. Background jobs pass the ids of the request that
+    # submitted them.
     # This is ugly but we have to do this to maintain backwards compatibility. In the future we should simply log
     # `time_result.input` as-is.
     if isinstance(main_blueprint.user_script.input_parser, (JsonStringInput, RawRequestInput)):
@@ -210,21 +333,89 @@ def log_successful_request(timed_result: TimedResult):
         model_input = timed_result.input
 
     main_blueprint.appinsights_client.send_model_data_log(
-        g.request_id, g.client_request_id, model_input, timed_result.output
+        g.request_id if request_id is None else request_id,
+        g.client_request_id if client_request_id is None else client_request_id,
+        model_input,
+        timed_result.output,
     )
 
 
+@contextlib.contextmanager
+def _admit() -> Iterator[int]:
+    # Wait for the request to be admitted by the admission controller, if any. Yields the scoring timeout of the
+    # request, which depends on its priority class, less the time it waited. The request counts towards the load of the
+    # worker meanwhile.
+    with _admit_as(*_request_class()) as timeout_ms:
+        try:
+            yield timeout_ms
+        finally:
+            load_tracker = main_blueprint.load_tracker
+            if config.load_headers_enabled and load_tracker:
+                g.worker_load = (load_tracker.utilization, load_tracker.queued)
+
+
+def _request_class() -> Tuple[Optional[str], str]:
+    # Returns the priority class and the tenant of the current request, when admission control is enabled.
+    admission = main_blueprint.admission
+    if admission is None:
+        return None, ""
+    priority_class = admission.get_class(request.headers.get(PRIORITY_HEADER))
+    tenant = request.headers.get(config.tenant_header, "") if config.tenant_header else ""
+    return priority_class, tenant
+
+
+@contextlib.contextmanager
+def _admit_as(priority_class: Optional[str], tenant: str) -> Iterator[int]:
+    # Like _admit(), for work of the given priority class and tenant. Background jobs, which run outside of their
+    # request, are admitted this way.
+    load_tracker = main_blueprint.load_tracker
+    with load_tracker.track() if load_tracker else contextlib.nullcontext():
+        admission = main_blueprint.admission
+        if admission is None:
+            with main_blueprint.model_lock.shared():
+                yield config.scoring_timeout
+            return
+
+        timeout_ms = admission.classes[priority_class].timeout_ms or config.scoring_timeout
+        start = time.perf_counter()
+        with admission.admit(priority_class, timeout_ms / 1000, tenant), main_blueprint.model_lock.shared():
+            # The timeout covers the wait, so that a request does not take up to twice as long. A request that waited
+            # the whole timeout is shed rather than admitted.
+            waited_ms = (time.perf_counter() - start) * 1000
+            yield max(1, int(timeout_ms - waited_ms))
+
+
+def _shed_response(error_response_class: Callable[[int, str], AMLResponse], ex: AdmissionRejected) -> AMLResponse:
+    logger.debug(f"Request shed: {ex}")
+    response = error_response_class(503, "The server is too busy to score the request. Retry later.")
+    response.headers["Retry-After"] = str(RETRY_AFTER_S)
+    return response
+
+
 @main_blueprint.route("/score", methods=["GET", "POST", "OPTIONS"], provide_automatic_options=False)
 def handle_score():
     g.api_name = "/score"
 
     try:
-        timed_result = main_blueprint.user_script.invoke_run(request, timeout_ms=config.scoring_timeout)
+        if main_blueprint.async_operations and _prefers_respond_async():
+            return _submit_operation()
+
+        with _admit() as timeout_ms:
+            timed_result = main_blueprint.user_script.invoke_run(
+                request, timeout_ms=timeout_ms, coalesce=config.single_flight_enabled
+            )
         log_successful_request(timed_result)
+    except AdmissionRejected as ex:
+        return _shed_response(ErrorResponse, ex)
     except BadInput as ex:
         return ErrorResponse(400, ex.args[0])
     except UnsupportedInput as ex:
         return ErrorResponse(415, ex.args[0])
+    except PayloadTooLargeError as ex:
+        return ErrorResponse(413, ex.args[0])
+    except OutputTooLargeError as ex:
+        logger.error(ex.args[0])
+        return ErrorResponse(500, ex.args[0])
     except UnsupportedHTTPMethod:
         # return 200 response for OPTIONS call, if CORS is enabled the required headers are implicitly
         # added by flask-cors package
@@ -232,14 +423,14 @@ def handle_score():
             return AMLResponse("", 200)
         return ErrorResponse(405, "Method not allowed")
     except UserScriptTimeout as ex:
-        main_blueprint.send_exception_to_app_insights(g.request_id, g.client_request_id)
         logger.debug("Run function timeout caught")
-        logger.error("Encountered Exception: {0}".format(traceback.format_exc()))
-        return ErrorResponse(500, f"Scoring timeout after {ex.timeout_ms} ms", run_function_failed=True)
+        main_blueprint.log_exception(g.request_id, g.client_request_id)
+        # A killed scoring process means the request was cut off at the deadline, like a gateway timeout.
+        status_code = 504 if isinstance(ex, UserScriptKilled) else 500
+        return ErrorResponse(status_code, f"Scoring timeout after {ex.timeout_ms} ms", run_function_failed=True)
     except UserScriptException:
-        main_blueprint.send_exception_to_app_insights(g.request_id, g.client_request_id)
         logger.debug("Run function exception caught")
-        logger.error("Encountered Exception: {0}".format(traceback.format_exc()))
+        main_blueprint.log_exception(g.request_id, g.client_request_id)
         return ErrorResponse(
             500,
             "An unexpected error occurred in scoring script. Check the logs for more info.",
@@ -248,7 +439,8 @@ def handle_score():
 
     response = timed_result.output
     if isinstance(response, Response):  # this covers both AMLResponse and flask.Response
-        logger.info("run() output is HTTP Response")
+        if not config.lean_mode:
+            logger.info("run() output is HTTP Response")
         if response.status_code >= 500:
             if "x-ms-run-function-failed" in response.headers:
                 response.headers["x-ms-run-function-failed"] = True
@@ -258,6 +450,333 @@ def handle_score():
         response = wrap_response(response)
 
     # we're formatting time_taken_ms explicitly to get '0.012' and not '1.2e-2'
+    response.headers.add("x-ms-run-fn-exec-ms", f"{timed_result.elapsed_ms:.3f}")
+    if timed_result.coalesced:
+        response.headers.add("x-ms-run-coalesced", "true")
+    if main_blueprint.user_script.cacheable and request.method in ("GET", "HEAD"):
+        response = _make_cacheable(response)
+    return response
+
+
+def _make_cacheable(response: Response) -> Response:
+    """Mark a response to a GET request cacheable, and answer it with 304 if the client has its current version."""
+    # A shared cache would hand the cookies of a client to the others.
+    if response.status_code != 200 or response.is_streamed or "Set-Cookie" in response.headers:
+        return response
+    response.headers["Cache-Control"] = main_blueprint.user_script.cache_control or config.cache_control
+    # The output is encoded according to the Accept header (see wrap_response()).
+    response.vary.add("Accept")
+    if "ETag" not in response.headers:
+        response.add_etag()
+    return response.make_conditional(request)
+
+
+# Bulk scoring. The records of the request body are scored as they are read, and their results are streamed back.
+
+
+@main_blueprint.route("/score/bulk", methods=["POST"])
+def handle_score_bulk():
+    g.api_name = "/score/bulk"
+
+    if isinstance(main_blueprint.user_script.input_parser, RawRequestInput):
+        return ErrorResponse(415, "Bulk scoring is not supported when run() is decorated with @rawhttp.")
+
+    request_class = _request_class()
+
+    def generate():
+        chunk = []
+        index = 0
+        for line in request.stream:
+            record = line.rstrip(b"\r\n")
+            if not record.strip():
+                continue
+            chunk.append(record)
+            if len(chunk) >= config.bulk_chunk_size:
+                yield _score_bulk_chunk(chunk, index, request_class)
+                index += len(chunk)
+                chunk = []
+        if chunk:
+            yield _score_bulk_chunk(chunk, index, request_class)
+
+    return Response(stream_with_context(generate()), status=200, mimetype="application/x-ndjson")
+
+
+def _score_bulk_chunk(records: List[bytes], start_index: int, request_class: Tuple[Optional[str], str]) -> str:
+    """Score a chunk of the records of a bulk request and return their result lines. A record that fails gets an error
+    line with the status code /score would have returned, without failing the others. Each chunk is admitted like a
+    /score request of the priority class and tenant of the bulk request.
+    """
+    user_script = main_blueprint.user_script
+    entries: List[Dict[str, Any]] = [{"index": start_index + i} for i in range(len(records))]
+
+    parsed = []
+    for i, record in enumerate(records):
+        try:
+            parsed.append((i, user_script.input_parser.parse_record(record)))
+        except BadInput as ex:
+            entries[i].update(status_code=400, error=ex.args[0])
+
+    try:
+        with _admit_as(*request_class) if parsed else contextlib.nullcontext(0) as timeout_ms:
+            if user_script.run_batch_enabled and parsed:
+                batch = [run_parameters for _, run_parameters in parsed]
+                results, error = _run_bulk(lambda: user_script.invoke_run_batch(batch, timeout_ms=timeout_ms))
+                for j, (i, _) in enumerate(parsed):
+                    _set_bulk_result(entries[i], results[j] if results else None, error)
+            else:
+                for i, run_parameters in parsed:
+                    results, error = _run_bulk(
+                        lambda: [user_script.invoke_run_record(run_parameters, request, timeout_ms=timeout_ms)]
+                    )
+                    _set_bulk_result(entries[i], results[0] if results else None, error)
+    except AdmissionRejected as ex:
+        logger.debug(f"Bulk chunk shed: {ex}")
+        for i, _ in parsed:
+            entries[i].update(status_code=503, error="The server is too busy to score the record. Retry later.")
+
+    lines = []
+    for entry in entries:
+        try:
+            lines.append(json.dumps(entry))
+        except (TypeError, ValueError) as ex:
+            error = f"The output of run() could not be serialized to JSON: {ex}"
+            lines.append(json.dumps({"index": entry["index"], "status_code": 500, "error": error}))
+    return "\n".join(lines) + "\n"
+
+
+def _run_bulk(score: Callable[[], List[TimedResult]]) -> Tuple[Optional[List[TimedResult]], Optional[Dict[str, Any]]]:
+    # Returns the results, or the status code and the message of the error. Each record scored is progress of the
+    # bulk request, which may stream for longer than any single request.
+    try:
+        return score(), None
+    except PayloadTooLargeError as ex:
+        return None, {"status_code": 413, "error": ex.args[0]}
+    except OutputTooLargeError as ex:
+        logger.error(ex.args[0])
+        return None, {"status_code": 500, "error": ex.args[0]}
+    except UserScriptTimeout as ex:
+        main_blueprint.log_exception(g.request_id, g.client_request_id)
+        status_code = 504 if isinstance(ex, UserScriptKilled) else 500
+        return None, {"status_code": status_code, "error": f"Scoring timeout after {ex.timeout_ms} ms"}
+    except UserScriptException:
+        main_blueprint.log_exception(g.request_id, g.client_request_id)
+        message = "An unexpected error occurred in scoring script. Check the logs for more info."
+        return None, {"status_code": 500, "error": message}
+    finally:
+        if main_blueprint.request_progress:
+            main_blueprint.request_progress.advance()
+
+
+def _set_bulk_result(entry: Dict[str, Any], timed_result: Optional[TimedResult], error: Optional[Dict[str, Any]]):
+    if error:
+        entry.update(error)
+    elif isinstance(timed_result.output, Response):
+        entry.update(status_code=500, error="run() returned an HTTP response, which bulk scoring does not support.")
+    else:
+        log_successful_request(timed_result)
+        entry.update(status_code=200, output=timed_result.output)
+
+
+# Asynchronous scoring. Requests that prefer to be answered asynchronously are scored in the background, and their
+# results are fetched later from /operations/<operation_id>.
+
+
+def _prefers_respond_async() -> bool:
+    # Scripts decorated with @rawhttp are handed the request itself, which does not outlive it. They are always
+    # answered synchronously, which RFC 7240 allows.
+    if isinstance(main_blueprint.user_script.input_parser, RawRequestInput):
+        return False
+    preferences = ",".join(request.headers.getlist("Prefer")).split(",")
+    return any(preference.split(";")[0].strip().lower() == "respond-async" for preference in preferences)
+
+
+def _submit_operation() -> Response:
+    user_script = main_blueprint.user_script
+    # Parse the input now, so that invalid requests are rejected right away.
+    run_parameters = user_script.input_parser(request)
+    scoring_request = request._get_current_object()
+    request_id, client_request_id = g.request_id, g.client_request_id
+    request_class = _request_class()
+
+    def job() -> OperationResult:
+        try:
+            # Jobs share the scoring slots of the worker with the requests scored synchronously.
+            with _admit_as(*request_class) as timeout_ms:
+                timed_result = user_script.invoke_run_record(run_parameters, scoring_request, timeout_ms=timeout_ms)
+        except AdmissionRejected as ex:
+            logger.debug(f"Operation shed: {ex}")
+            return error_result(503, "The server is too busy to score the request. Retry later.")
+        except PayloadTooLargeError as ex:
+            return error_result(413, ex.args[0])
+        except OutputTooLargeError as ex:
+            logger.error(ex.args[0])
+            return error_result(500, ex.args[0])
+        except UserScriptTimeout as ex:
+            main_blueprint.log_exception(request_id, client_request_id)
+            status_code = 504 if isinstance(ex, UserScriptKilled) else 500
+            return error_result(status_code, f"Scoring timeout after {ex.timeout_ms} ms")
+        except UserScriptException:
+            main_blueprint.log_exception(request_id, client_request_id)
+            return error_result(500, "An unexpected error occurred in scoring script. Check the logs for more info.")
+
+        output = timed_result.output
+        if isinstance(output, Response):
+            return OperationResult(output.status_code, output.content_type, output.get_data())
+        try:
+            body = json.dumps(output).encode("utf-8")
+        except (TypeError, ValueError) as ex:
+            return error_result(500, f"The output of run() could not be serialized to JSON: {ex}")
+        log_successful_request(timed_result, request_id, client_request_id)
+        return OperationResult(200, "application/json", body)
+
+    try:
+        operation_id = main_blueprint.async_operations.submit(job)
+    except OperationsFull as ex:
+        logger.debug(f"Operation refused: {ex}")
+        response = ErrorResponse(503, "The server has too many pending operations. Retry later.")
+        response.headers["Retry-After"] = str(RETRY_AFTER_S)
+        return response
+    headers = {
+        "Location": f"{request.script_root}/operations/{operation_id}",
+        "Preference-Applied": "respond-async",
+        "Retry-After": str(OPERATION_RETRY_AFTER_S),
+    }
+    return AMLResponse({"id": operation_id, "status": RUNNING}, 202, headers, json_str=True)
+
+
+@main_blueprint.route("/operations/<operation_id>", methods=["GET"])
+def get_operation(operation_id: str):
+    g.api_name = "/operations"
+
+    operation = main_blueprint.async_operations.get(operation_id) if main_blueprint.async_operations else None
+    if operation is None:
+        return ErrorResponse(404, "Operation not found. It may have expired, or its result was already fetched.")
+
+    if operation.result is None:
+        headers = {"Retry-After": str(OPERATION_RETRY_AFTER_S)}
+        return AMLResponse({"id": operation.id, "status": operation.status}, 202, headers, json_str=True)
+
+    result = operation.result
+    response = Response(result.body, status=result.status_code, content_type=result.content_type)
+    response.headers["x-ms-operation-status"] = operation.status
+    return response
+
+
+# Open Inference Protocol (KServe v2). The server serves a single model, named after the service.
+
+
+@main_blueprint.route("/v2", methods=["GET"])
+def v2_server_metadata():
+    g.api_name = "/v2"
+    metadata = {"name": "azureml-inference-server-http", "version": __version__, "extensions": v2_protocol.EXTENSIONS}
+    return AMLResponse(metadata, 200, json_str=True)
+
+
+@main_blueprint.route("/v2/health/live", methods=["GET"])
+def v2_health():
+    # The routes are only served once init() has completed, so the server is live as soon as it serves requests.
+    return AMLResponse("", 200)
+
+
+@main_blueprint.route("/v2/health/ready", methods=["GET"])
+def v2_health_ready():
+    # A saturated worker is not ready, so that load balancers send new requests to other replicas.
+    if main_blueprint.load_tracker and main_blueprint.load_tracker.saturated:
+        return AMLResponse("", 503)
+    return AMLResponse("", 200)
+
+
+def _check_v2_model(model_name: str, model_version: Optional[str]) -> Optional[Response]:
+    if model_name != config.service_name or model_version not in (None, config.service_version):
+        version = f" (version {model_version})" if model_version else ""
+        return V2ErrorResponse(404, f"Model {model_name}{version} is not served by this server.")
+    return None
+
+
+@main_blueprint.route("/v2/models/<model_name>", methods=["GET"])
+@main_blueprint.route("/v2/models/<model_name>/versions/<model_version>", methods=["GET"])
+def v2_model_metadata(model_name: str, model_version: Optional[str] = None):
+    g.api_name = "/v2/models"
+    error = _check_v2_model(model_name, model_version)
+    if error:
+        return error
+
+    # The schemas are those of the new model version while it is being loaded.
+    with main_blueprint.model_lock.shared():
+        metadata = v2_protocol.get_model_metadata(
+            config.service_name, config.service_version, main_blueprint.user_script.get_run_function()
+        )
+    return AMLResponse(metadata, 200, json_str=True)
+
+
+@main_blueprint.route("/v2/models/<model_name>/ready", methods=["GET"])
+@main_blueprint.route("/v2/models/<model_name>/versions/<model_version>/ready", methods=["GET"])
+def v2_model_ready(model_name: str, model_version: Optional[str] = None):
+    return _check_v2_model(model_name, model_version) or AMLResponse("", 200)
+
+
+@main_blueprint.route("/v2/models/<model_name>/infer", methods=["POST"])
+@main_blueprint.route("/v2/models/<model_name>/versions/<model_version>/infer", methods=["POST"])
+def v2_infer(model_name: str, model_version: Optional[str] = None):
+    g.api_name = "/v2/models/infer"
+    error = _check_v2_model(model_name, model_version)
+    if error:
+        return error
+
+    if v2_protocol.np is None:
+        return V2ErrorResponse(501, "The inference endpoint requires numpy. Install numpy to enable it.")
+
+    try:
+        header_length = request.headers.get(v2_protocol.HEADER_CONTENT_LENGTH, type=int)
+        infer_request, tensors = v2_protocol.parse_infer_request(request.get_data(), header_length)
+
+        # The tensors are handed to run() as-is. The body has been consumed, so the user script sees an empty one.
+        environ = dict(request.environ, CONTENT_LENGTH="0")
+        environ[TENSORS_ENVIRON_KEY] = tensors
+        with _admit() as timeout_ms:
+            timed_result = main_blueprint.user_script.invoke_run(
+                Request(environ), timeout_ms=timeout_ms, coalesce=config.single_flight_enabled
+            )
+    except AdmissionRejected as ex:
+        return _shed_response(V2ErrorResponse, ex)
+    except BadInput as ex:
+        return V2ErrorResponse(400, ex.args[0])
+    except UnsupportedInput as ex:
+        return V2ErrorResponse(415, ex.args[0])
+    except PayloadTooLargeError as ex:
+        return V2ErrorResponse(413, ex.args[0])
+    except OutputTooLargeError as ex:
+        logger.error(ex.args[0])
+        return V2ErrorResponse(500, ex.args[0])
+    except UserScriptTimeout as ex:
+        main_blueprint.log_exception(g.request_id, g.client_request_id)
+        status_code = 504 if isinstance(ex, UserScriptKilled) else 500
+        return V2ErrorResponse(status_code, f"Scoring timeout after {ex.timeout_ms} ms", run_function_failed=True)
+    except UserScriptException:
+        main_blueprint.log_exception(g.request_id, g.client_request_id)
+        return V2ErrorResponse(
+            500,
+            "An unexpected error occurred in scoring script. Check the logs for more info.",
+            run_function_failed=True,
+        )
+
+    if isinstance(timed_result.output, Response):
+        response = timed_result.output
+    else:
+        try:
+            body, header_length = v2_protocol.encode_infer_response(
+                config.service_name, config.service_version, infer_request, timed_result.output
+            )
+        except v2_protocol.OutputConversionError as ex:
+            logger.error(ex.args[0])
+            return V2ErrorResponse(500, ex.args[0])
+
+        if header_length is None:
+            response = Response(body, status=200, mimetype="application/json")
+        else:
+            response = Response(body, status=200, mimetype="application/octet-stream")
+            response.headers[v2_protocol.HEADER_CONTENT_LENGTH] = str(header_length)
+
     response.headers.add("x-ms-run-fn-exec-ms", f"{timed_result.elapsed_ms:.3f}")
     return response
 
@@ -266,3 +785,10 @@ class ErrorResponse(AMLResponse):
     def __init__(self, status_code: int, message: str, run_function_failed: bool = False):
         message_json = {"message": message}
         super().__init__(message_json, status_code, json_str=True, run_function_failed=run_function_failed)
+
+
+class V2ErrorResponse(AMLResponse):
+    """Error response of the Open Inference Protocol routes, which puts the message under "error"."""
+
+    def __init__(self, status_code: int, message: str, run_function_failed: bool = False):
+        super().__init__({"error": message}, status_code, json_str=True, run_function_failed=run_function_failed)
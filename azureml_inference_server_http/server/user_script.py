@@ -1,18 +1,28 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import contextlib
+import hashlib
 import inspect
+import json
 import logging
 import os
+import time
 from types import ModuleType
-from typing import Any, Callable, Dict, NamedTuple, Optional
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
 
 import flask
+from inference_schema import schema_util
 from inference_schema.schema_util import is_schema_decorated
 
+from .columnar_input import get_decoders
+from .config import config
 from .exceptions import AzmlinfsrvError
+from .executor_pool import BufferOverflowError, ExecutorPool, ExecutorUnavailable
 from .input_parsers import InputParserBase, JsonStringInput, ObjectInput, RawRequestInput
-from .utils import timeout, Timer
+from .isolated_runner import IsolatedRunner
+from .memory_tracker import MemoryTracker, MemoryUsage
+from .utils import CoalescedError, SingleFlight, timeout, Timer
 from ..api import aml_request
 
 
@@ -48,20 +58,63 @@ class UserScriptTimeout(UserScriptError):
         self.elapsed_ms = elapsed_ms
 
 
+class UserScriptKilled(UserScriptTimeout):
+    """The scoring process running run() was killed because run() did not finish within the allocated time."""
+
+
 class TimedResult(NamedTuple):
     elapsed_ms: float
     input: Dict[str, Any]
     output: Any
+    # Whether the output was produced by a concurrent identical request and shared with this one
+    coalesced: bool = False
+    # Memory used by run(), when memory tracking is enabled
+    memory: Optional[MemoryUsage] = None
+
+
+def _schema_registries() -> Tuple[Dict[str, Any], ...]:
+    # Where inference-schema registers the schemas and the swagger versions of the decorated functions, by name
+    return schema_util.__functions_schema__, schema_util.__versions__
+
+
+def _copy_schemas(prefix: str) -> Tuple[Dict[str, Any], ...]:
+    # Return the entries of the functions whose name starts with ``prefix``, from each registry.
+    return tuple(
+        {name: registry[name] for name in registry if name.startswith(prefix)} for registry in _schema_registries()
+    )
+
+
+def _pop_schemas(prefix: str) -> Tuple[Dict[str, Any], ...]:
+    # Remove and return the entries of the functions whose name starts with ``prefix``, from each registry.
+    popped = []
+    for registry in _schema_registries():
+        popped.append({name: registry.pop(name) for name in [name for name in registry if name.startswith(prefix)]})
+    return tuple(popped)
 
 
 class UserScript:
     input_parser: InputParserBase
+    _has_request_headers: bool
+    # Whether run() is decorated with @cacheable, and the Cache-Control header it asked for
+    cacheable: bool = False
+    cache_control: Optional[str] = None
     _wrapped_user_run: Callable
     _user_init: Callable
+    # Whether init() takes the model directory as its ``model_dir`` argument
+    _init_takes_model_dir: bool = False
     _user_run: Callable
+    _user_run_batch: Optional[Callable] = None
+    memory_tracker: Optional[MemoryTracker] = None
+    isolated_runner: Optional[IsolatedRunner] = None
+    executor_pool: Optional[ExecutorPool] = None
+    # inference-schema schemas of the previously loaded script, set aside while this one was loaded
+    _replaced_schemas: Optional[Tuple[Dict[str, Any], ...]] = None
+    # inference-schema schemas registered by this script. See install_schemas().
+    _schemas: Optional[Tuple[Dict[str, Any], ...]] = None
 
     def __init__(self, entry_script: Optional[str] = None):
         self.entry_script = entry_script
+        self._single_flight = SingleFlight()
 
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}({self.entry_script})"
@@ -71,11 +124,17 @@ class UserScript:
             import importlib.util as imp
 
             script_location = os.path.join(app_root, self.entry_script.replace("/", os.sep))
+            # inference-schema merges the schemas registered for the same function. Set the schemas of the previously
+            # loaded script aside so that a new copy of the script (for example when hot-swapping the model) starts
+            # afresh, and so that they can be put back if the new copy is discarded. See restore_schemas().
+            self._replaced_schemas = _pop_schemas("entry_module.")
+
             try:
                 main_module_spec = imp.spec_from_file_location("entry_module", script_location)
                 user_module = imp.module_from_spec(main_module_spec)
                 main_module_spec.loader.exec_module(user_module)
             except BaseException as ex:
+                self.restore_schemas()
                 raise UserScriptImportException(ex) from ex
         else:
             try:
@@ -100,36 +159,139 @@ class UserScript:
             # Until the driver modules are fixed (or, better, removed), we call the run() of the actual score script
             # directly to lessen the impact.
             self._user_run = maybe_user_module.run
+            run_module = maybe_user_module
             logger.info(
                 f"Found driver script at {user_module.__file__} and the score script at {maybe_user_module.__file__}"
             )
         else:
             # No driver module
             self._user_run = user_module.run
+            run_module = user_module
             logger.info(f"Found user script at {user_module.__file__}")
 
+        # run_batch() is optional, and taken from the same script as run(). It scores the records of bulk requests a
+        # chunk at a time.
+        self._user_run_batch = getattr(run_module, "run_batch", None)
+
         # Driver modules usually add special logic into init(), so we don't want to skip over it like we do with run().
         self._user_init = user_module.init
+        self._init_takes_model_dir = "model_dir" in inspect.signature(self._user_init).parameters
 
         self._analyze_run()
-
-    def invoke_init(self) -> None:
+        if self.entry_script:
+            self._schemas = _copy_schemas("entry_module.")
+
+    def restore_schemas(self) -> None:
+        """Put back the schemas of the script loaded before this one, in place of the schemas of this script. Called
+        when this script is discarded, so that the previous script keeps its schemas.
+        """
+        if self._replaced_schemas is None:
+            return
+        _pop_schemas("entry_module.")
+        for registry, schemas in zip(_schema_registries(), self._replaced_schemas):
+            registry.update(schemas)
+        self._replaced_schemas = None
+
+    def install_schemas(self) -> None:
+        """Replace the schemas registered under the entry script by the schemas of this script. Called when this script
+        is served after another copy of the script was loaded, or given up on.
+        """
+        _pop_schemas("entry_module.")
+        for registry, schemas in zip(_schema_registries(), self._schemas or ({}, {})):
+            registry.update(schemas)
+
+    @property
+    def init_takes_model_dir(self) -> bool:
+        return self._init_takes_model_dir
+
+    def invoke_init(self, model_dir: Optional[str] = None) -> None:
+        """Call the user's init(). An init() that takes a ``model_dir`` argument is passed ``model_dir``, by default
+        the model directory in the config.
+        """
         logger.info("Invoking user's init function")
+        kwargs = {"model_dir": model_dir or config.azureml_model_dir} if self._init_takes_model_dir else {}
         try:
-            self._user_init()
+            self._user_init(**kwargs)
         except BaseException as ex:
             raise UserScriptException(ex) from ex
 
         logger.info("Users's init has completed successfully")
 
-    def invoke_run(self, request: flask.Request, *, timeout_ms: int) -> TimedResult:
+    def invoke_run(self, request: flask.Request, *, timeout_ms: int, coalesce: bool = False) -> TimedResult:
         run_parameters = self.input_parser(request)
 
-        # Invoke the user's code with a timeout and a timer.
+        key = self._get_coalescing_key(run_parameters) if coalesce else None
+        if key is None:
+            return self._timed_run(run_parameters, request, timeout_ms)
+
+        start_time = time.perf_counter()
+        try:
+            timed_result, coalesced = self._single_flight.do(
+                key, lambda: self._timed_run(run_parameters, request, timeout_ms), timeout_s=timeout_ms / 1000
+            )
+        except TimeoutError:
+            raise UserScriptTimeout(timeout_ms, (time.perf_counter() - start_time) * 1000) from None
+        except CoalescedError as ex:
+            error = ex.__cause__
+            if isinstance(error, UserScriptTimeout):
+                raise type(error)(timeout_ms, (time.perf_counter() - start_time) * 1000) from error
+            raise UserScriptException(getattr(error, "user_ex", error)) from error
+
+        if not coalesced:
+            return timed_result
+        if isinstance(timed_result.output, flask.Response):
+            # HTTP responses are mutated on the way out and can't be shared between requests.
+            return self._timed_run(run_parameters, request, timeout_ms)
+        return timed_result._replace(input=run_parameters, coalesced=True)
+
+    @property
+    def run_batch_enabled(self) -> bool:
+        """Whether the records of bulk requests are scored by run_batch(). run_batch() is not used when run() runs in
+        a separate process, because init() has not been called in the worker.
+        """
+        return self._user_run_batch is not None and not (self.executor_pool or self.isolated_runner)
+
+    def invoke_run_record(
+        self, run_parameters: Dict[str, Any], request: flask.Request, *, timeout_ms: int
+    ) -> TimedResult:
+        """Call run() with parameters parsed ahead of time from ``request``, such as a record of a bulk request or the
+        input of a background job.
+        """
+        return self._timed_run(run_parameters, request, timeout_ms)
+
+    def invoke_run_batch(self, batch: List[Dict[str, Any]], *, timeout_ms: int) -> List[TimedResult]:
+        """Call run_batch() with the parameters parsed from a chunk of records of a bulk request. Returns one result
+        per record.
+        """
         timer = None
         try:
             with timeout(timeout_ms), Timer() as timer:
-                run_output = self._wrapped_user_run(**run_parameters, request_headers=dict(request.headers))
+                # run_batch() may return a generator, whose outputs are computed as it is consumed.
+                outputs = list(self._user_run_batch(batch))
+            if len(outputs) != len(batch):
+                raise ValueError(f"run_batch() returned {len(outputs)} outputs for {len(batch)} records.")
+        except TimeoutError:
+            elapsed_ms = timer.elapsed_ms if timer else 0
+            raise UserScriptTimeout(timeout_ms, elapsed_ms) from None
+        except Exception as ex:
+            raise UserScriptException(ex) from ex
+
+        return [
+            TimedResult(elapsed_ms=timer.elapsed_ms, input=run_parameters, output=output)
+            for run_parameters, output in zip(batch, outputs)
+        ]
+
+    def _timed_run(self, run_parameters: Dict[str, Any], request: flask.Request, timeout_ms: int) -> TimedResult:
+        runner = self.executor_pool or self.isolated_runner
+        if runner and not isinstance(self.input_parser, RawRequestInput):
+            return self._isolated_run(runner, run_parameters, request, timeout_ms)
+
+        # Invoke the user's code with a timeout and a timer.
+        timer = None
+        tracking = self.memory_tracker.track() if self.memory_tracker else contextlib.nullcontext()
+        try:
+            with tracking as measurement, timeout(timeout_ms), Timer() as timer:
+                run_output = self._wrapped_user_run(**run_parameters, request_headers=self._request_headers(request))
         except TimeoutError:
             # timer may be unset if timeout() threw TimeoutError before Timer() is called. Should probably not happen
             # but not impossible.
@@ -138,8 +300,61 @@ class UserScript:
         except Exception as ex:
             raise UserScriptException(ex) from ex
 
+        memory = measurement.usage if measurement else None
+        if memory:
+            logger.debug(f"run() memory usage: RSS delta {memory.rss_delta} bytes, peak {memory.traced_peak} bytes")
+        return TimedResult(elapsed_ms=timer.elapsed_ms, input=run_parameters, output=run_output, memory=memory)
+
+    def _request_headers(self, request: flask.Request) -> Optional[Dict[str, str]]:
+        # Copying the headers is only worth it when run() takes them.
+        return dict(request.headers) if self._has_request_headers else None
+
+    def _isolated_run(
+        self,
+        runner: Union[ExecutorPool, IsolatedRunner],
+        run_parameters: Dict[str, Any],
+        request: flask.Request,
+        timeout_ms: int,
+    ) -> TimedResult:
+        # Invoke the user's code in the scoring process or an executor, which is killed when the timeout expires.
+        kwargs = dict(run_parameters, request_headers=self._request_headers(request))
+        with Timer() as timer:
+            try:
+                run_output = runner.run(kwargs, timeout_ms)
+            except ExecutorUnavailable:
+                raise UserScriptTimeout(timeout_ms, (time.perf_counter() - timer.start_time) * 1000) from None
+            except TimeoutError:
+                raise UserScriptKilled(timeout_ms, (time.perf_counter() - timer.start_time) * 1000) from None
+            except BufferOverflowError:
+                # Not an error of the user script. Answered with 413 for the input and 500 for the output.
+                raise
+            except Exception as ex:
+                raise UserScriptException(ex) from ex
+
         return TimedResult(elapsed_ms=timer.elapsed_ms, input=run_parameters, output=run_output)
 
+    def start_isolated_runner(self) -> None:
+        """Run run() in a scoring process from now on. See ``IsolatedRunner``."""
+        if isinstance(self.input_parser, RawRequestInput):
+            logger.warning(
+                "run() is decorated with @rawhttp, so it cannot run in a separate scoring process. It will run in the"
+                " worker and timeouts cannot interrupt native code."
+            )
+            return
+
+        self.isolated_runner = IsolatedRunner(self._wrapped_user_run)
+
+    def _get_coalescing_key(self, run_parameters: Dict[str, Any]) -> Optional[str]:
+        # Requests can only share a result if the result depends on nothing but the parsed input. That excludes
+        # @rawhttp scripts (which see the whole request) and run() functions that take the request headers.
+        if isinstance(self.input_parser, RawRequestInput) or self._has_request_headers:
+            return None
+        try:
+            serialized = json.dumps(run_parameters, sort_keys=True)
+        except (TypeError, ValueError):
+            return None
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
     def _analyze_run(self) -> None:
         # Inspect the the run() function. Make sure it is declared in the right way.
         run_params = inspect.signature(self._user_run).parameters.values()
@@ -148,20 +363,25 @@ class UserScript:
 
         # Determine whether we need to pass "request_headers" to run().
         if any(param.name == "request_headers" for param in run_params):
-            has_request_headers = True
+            self._has_request_headers = True
             run_params = [param for param in run_params if param.name != "request_headers"]
             self._wrapped_user_run = self._user_run
         else:
-            has_request_headers = False
+            self._has_request_headers = False
             self._wrapped_user_run = lambda request_headers, **kwargs: self._user_run(**kwargs)
 
         first_param = next(iter(run_params), None)
         if not first_param:
-            if has_request_headers:
+            if self._has_request_headers:
                 raise UserScriptError('run() needs to accept an argument other than "request_headers".')
             else:
                 raise UserScriptError("run() needs to accept an argument for input data.")
 
+        self.cacheable = getattr(self._user_run, "_azureml_cacheable", False)
+        self.cache_control = getattr(self._user_run, "_azureml_cache_control", None)
+        if self.cacheable:
+            logger.info("run() is decorated with @cacheable. Responses to GET requests will be cacheable.")
+
         # Decide the input parser we need for user's run() function.
         if aml_request._rawHttpRequested and is_schema_decorated(self._user_run):
             raise UserScriptError("run() cannot be decorated with both @rawhttp and @input_schema")
@@ -169,7 +389,7 @@ class UserScript:
             self.input_parser = RawRequestInput(first_param.name)
             logger.info("run() is decorated with @rawhttp. Server will invoke it with the flask request object.")
         elif is_schema_decorated(self._user_run):
-            self.input_parser = ObjectInput(run_params)
+            self.input_parser = ObjectInput(run_params, get_decoders(self._user_run))
             logger.info(
                 "run() is decorated with @input_schema. Server will invoke it with the following arguments: "
                 f"{', '.join(param.name for param in run_params)}."
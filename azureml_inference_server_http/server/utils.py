@@ -4,10 +4,18 @@
 import contextlib
 import os
 import signal
+import tempfile
 import threading
 import time
+import traceback
 from types import FrameType, TracebackType
-from typing import Generator, Iterator, Optional, Type
+from typing import Any, Callable, Dict, Generator, Hashable, Iterator, Optional, Tuple, Type
+
+# fcntl is only available on POSIX, where the workers are forked by gunicorn.
+try:
+    import fcntl
+except ModuleNotFoundError:
+    fcntl = None
 
 
 class Timer:
@@ -26,6 +34,27 @@ class Timer:
         self.elapsed_ms = (time.perf_counter() - self.start_time) * 1000
 
 
+def get_rss() -> Optional[int]:
+    """Return the resident set size of this process in bytes, or None if it cannot be read."""
+    try:
+        with open("/proc/self/statm", "rb") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        # AttributeError: os.sysconf() is not available on Windows.
+        return None
+
+
+def is_alive(pid: int) -> bool:
+    """Return whether the process ``pid`` exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
 def timeout_supported() -> bool:
     # Signals are not supported on Windows and can only be used in the main thread.
     return os.name != "nt" and threading.current_thread() is threading.main_thread()
@@ -35,24 +64,228 @@ def _alarm_handler(signalnum: int, frame: Optional[FrameType]) -> None:
     raise TimeoutError
 
 
+def install_alarm_handler() -> None:
+    """Keep the handler of the timeouts installed, so that timeout() does not install and restore it every time."""
+    if timeout_supported():
+        signal.signal(signal.SIGALRM, _alarm_handler)
+
+
 @contextlib.contextmanager
 def timeout(timeout_ms: int) -> Iterator[None]:
     # TODO: if timeout is not supported, we should let the user know.
     if timeout_supported():
         timeout_s = timeout_ms / 1000  # millisecond to seconds
 
-        old_handler = signal.signal(signal.SIGALRM, _alarm_handler)
+        # signal.getsignal() does not make a system call, unlike signal.signal().
+        old_handler = signal.getsignal(signal.SIGALRM)
+        if old_handler is not _alarm_handler:
+            signal.signal(signal.SIGALRM, _alarm_handler)
         signal.setitimer(signal.ITIMER_REAL, timeout_s)
 
         try:
             yield
         finally:
             signal.setitimer(signal.ITIMER_REAL, 0)
-            signal.signal(signal.SIGALRM, old_handler)
+            if old_handler is not _alarm_handler:
+                signal.signal(signal.SIGALRM, old_handler)
     else:
         yield
 
 
+class _Flight:
+    __slots__ = ["done", "result", "error"]
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class CoalescedError(Exception):
+    """Raised in the callers of ``SingleFlight.do()`` that waited for a call which raised. Its cause is the exception
+    of the call, which is only raised in the caller that made the call.
+    """
+
+
+class SingleFlight:
+    """Runs a function once for all the threads that concurrently ask for the same key. The first caller runs the
+    function; callers arriving while it is running wait for it and get the same result (or a ``CoalescedError``).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout_s: Optional[float] = None) -> Tuple[Any, bool]:
+        """Returns the result of ``fn`` and whether it was shared with another caller. Waiting callers raise
+        ``TimeoutError`` if the running call does not finish within ``timeout_s``.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+
+        if not is_leader:
+            if not flight.done.wait(timeout_s):
+                raise TimeoutError
+            if flight.error is not None:
+                # Each waiter raises an exception of its own, so that the tracebacks of the threads don't pile up on
+                # the exception of the call.
+                raise CoalescedError() from flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except BaseException as ex:
+            flight.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+        return flight.result, False
+
+
+class SharedLock:
+    """A lock held by any number of threads in shared mode, or by a single thread in exclusive mode. Threads asking
+    for the exclusive mode go first: once one is waiting, new threads wait for it before sharing the lock.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+
+    @contextlib.contextmanager
+    def shared(self) -> Iterator[None]:
+        with self._condition:
+            self._condition.wait_for(lambda: not self._exclusive)
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._shared -= 1
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with self._condition:
+            self._condition.wait_for(lambda: not self._exclusive)
+            self._exclusive = True
+            self._condition.wait_for(lambda: self._shared == 0)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+
+class ProcessLock:
+    """A lock shared by a process and the processes forked from it. It is a record lock on a file they inherit, which
+    the kernel releases when its holder exits, so that a process that dies while holding it does not block the others.
+    Without fcntl, on Windows, the server runs in a single process and the lock is only taken by its threads.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile() if fcntl else None
+        # A record lock is held by a process rather than a thread, so the threads of a process take turns through a
+        # lock of their own.
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self) -> None:
+        self._thread_lock.acquire()
+        if self._file is not None:
+            try:
+                fcntl.lockf(self._file, fcntl.LOCK_EX)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        if self._file is not None:
+            fcntl.lockf(self._file, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+class LogThrottle:
+    """Collapses repeated log events. The first time an event is seen in a window of ``window_s`` seconds it is logged,
+    and the following occurrences in the window are only counted. When the window expires, the count is passed to
+    ``report`` along with the description of the event, or, without ``report``, returned along with the first
+    occurrence logged after the window. A window of 0 (or None) logs every event.
+    """
+
+    # Number of distinct events remembered. Past that, events whose window has expired are forgotten.
+    MAX_EVENTS = 1000
+
+    def __init__(self, window_s: Optional[float], report: Optional[Callable[[str, int], None]] = None):
+        self.window_s = window_s or 0
+        self.report = report
+        self._lock = threading.Lock()
+        # Start of the current window, number of occurrences suppressed in it and description, by event
+        self._events: Dict[Hashable, Tuple[float, int, str]] = {}
+
+    def admit(self, key: Hashable, description: str = "") -> Optional[int]:
+        """Returns None if the event must not be logged, otherwise the number of occurrences of the event that were
+        suppressed since it was last logged and not reported yet.
+        """
+        if self.window_s <= 0:
+            return 0
+
+        now = time.monotonic()
+        with self._lock:
+            window_start, suppressed, _ = self._events.get(key, (None, 0, description))
+            if window_start is not None and now - window_start < self.window_s:
+                self._events[key] = (window_start, suppressed + 1, description)
+                if suppressed == 0 and self.report:
+                    timer = threading.Timer(window_start + self.window_s - now, self._flush, (key, window_start))
+                    timer.daemon = True
+                    timer.start()
+                return None
+
+            if window_start is None and len(self._events) >= self.MAX_EVENTS:
+                self._events = {k: v for k, v in self._events.items() if now - v[0] < self.window_s}
+            self._events[key] = (now, 0, description)
+            return suppressed
+
+    def _flush(self, key: Hashable, window_start: float) -> None:
+        # Report the occurrences suppressed in the window that started at ``window_start``, once it has expired. The
+        # event is then forgotten, so that its next occurrence is logged.
+        with self._lock:
+            event = self._events.get(key)
+            if event is None or event[0] != window_start:
+                return
+            del self._events[key]
+        _, suppressed, description = event
+        self.report(description, suppressed)
+
+
+def exception_key(ex: BaseException) -> Hashable:
+    """Identify an exception by its type and where it was raised, along with the exceptions it was chained to. The
+    message is left out since it often contains request data. This is much cheaper than formatting the traceback.
+    """
+    key = []
+    seen = set()
+    while ex is not None and id(ex) not in seen:
+        seen.add(id(ex))
+        frames = tuple((frame.f_code.co_filename, lineno) for frame, lineno in traceback.walk_tb(ex.__traceback__))
+        key.append((type(ex).__module__, type(ex).__qualname__, frames))
+        ex = ex.__cause__ or (None if ex.__suppress_context__ else ex.__context__)
+    return tuple(key)
+
+
 def walk_path(path: str, depth: int = 0, indent_space: int = 4) -> Generator[str, None, None]:
     # Normalize the path
     path = os.path.normpath(path)
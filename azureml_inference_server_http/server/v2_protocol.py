@@ -0,0 +1,252 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Encoding and decoding of the Open Inference Protocol (KServe v2) REST messages, including the binary tensor data
+extension. See https://github.com/kserve/open-inference-protocol for the specification.
+"""
+
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from inference_schema.schema_util import get_input_schema, get_output_schema, is_schema_decorated
+
+from .exceptions import AzmlinfsrvError
+from .input_parsers import BadInput
+
+# check if numpy is available
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+# Length of the JSON header when a request or a response uses the binary tensor data extension. The tensor bytes follow
+# the JSON header in the body.
+HEADER_CONTENT_LENGTH = "Inference-Header-Content-Length"
+
+EXTENSIONS = ["binary_tensor_data"]
+
+# Name of the output when run() returns a single value and the request does not name its outputs.
+DEFAULT_OUTPUT_NAME = "output0"
+
+_DATATYPES = {
+    "BOOL": "bool",
+    "UINT8": "uint8",
+    "UINT16": "uint16",
+    "UINT32": "uint32",
+    "UINT64": "uint64",
+    "INT8": "int8",
+    "INT16": "int16",
+    "INT32": "int32",
+    "INT64": "int64",
+    "FP16": "float16",
+    "FP32": "float32",
+    "FP64": "float64",
+    "BYTES": "object",
+}
+_DTYPE_NAMES = {dtype: datatype for datatype, dtype in _DATATYPES.items()}
+
+# Maps the (type, format) of an inference-schema JSON schema to a datatype.
+_SCHEMA_DATATYPES = {
+    ("boolean", None): "BOOL",
+    ("integer", "int8"): "INT8",
+    ("integer", "int16"): "INT16",
+    ("integer", "int32"): "INT32",
+    ("integer", "int64"): "INT64",
+    ("integer", "uint8"): "UINT8",
+    ("integer", "uint16"): "UINT16",
+    ("integer", "uint32"): "UINT32",
+    ("integer", "uint64"): "UINT64",
+    ("integer", None): "INT64",
+    ("number", "float"): "FP32",
+    ("number", "double"): "FP64",
+    ("number", None): "FP64",
+    ("string", None): "BYTES",
+}
+
+
+class OutputConversionError(AzmlinfsrvError):
+    pass
+
+
+def parse_infer_request(body: bytes, header_length: Optional[int]) -> Tuple[Dict[str, Any], Dict[str, "np.ndarray"]]:
+    """Parse an inference request into its JSON header and its input tensors, keyed by input name. ``header_length`` is
+    the value of the Inference-Header-Content-Length header, if any. Binary tensors are read-only views over ``body``.
+    """
+    if header_length is None:
+        header_length = len(body)
+    elif not 0 <= header_length <= len(body):
+        raise BadInput(f"{HEADER_CONTENT_LENGTH} must be between 0 and the length of the body.")
+
+    try:
+        infer_request = json.loads(body[:header_length])
+    except ValueError as ex:
+        raise BadInput(f"Invalid inference request JSON: {ex}") from None
+
+    if not isinstance(infer_request, dict) or not isinstance(infer_request.get("inputs"), list):
+        raise BadInput("The inference request must be a JSON object with a list of inputs.")
+    if not infer_request["inputs"]:
+        raise BadInput("The inference request has no inputs.")
+
+    tensors = {}
+    binary = memoryview(body)[header_length:]
+    for tensor in infer_request["inputs"]:
+        try:
+            name, datatype, shape = tensor["name"], tensor["datatype"], tuple(tensor["shape"])
+        except (KeyError, TypeError):
+            raise BadInput("Each input must have a name, a datatype and a shape.") from None
+        if datatype not in _DATATYPES:
+            raise BadInput(f"Input {name} has an unsupported datatype: {datatype}")
+
+        binary_data_size = (tensor.get("parameters") or {}).get("binary_data_size")
+        try:
+            if binary_data_size is None:
+                tensors[name] = _from_json(tensor.get("data"), datatype, shape)
+            else:
+                if binary_data_size > len(binary):
+                    raise ValueError("the binary data is shorter than binary_data_size")
+                tensors[name] = _from_bytes(binary[:binary_data_size], datatype, shape)
+                binary = binary[binary_data_size:]
+        except (TypeError, ValueError) as ex:
+            raise BadInput(f"Invalid data for input {name}: {ex}") from None
+
+    return infer_request, tensors
+
+
+def encode_infer_response(
+    model_name: str, model_version: str, infer_request: Dict[str, Any], output: Any
+) -> Tuple[bytes, Optional[int]]:
+    """Encode the output of run() as an inference response. Returns the body and, when the response uses the binary
+    tensor data extension, the length of its JSON header.
+
+    A dict output is returned as one tensor per key. Any other output is returned as a single tensor named after the
+    first requested output, or ``output0``.
+    """
+    requested = {o.get("name"): o.get("parameters") or {} for o in infer_request.get("outputs") or []}
+    binary_output = bool((infer_request.get("parameters") or {}).get("binary_data_output"))
+
+    if isinstance(output, dict):
+        items = [(name, value) for name, value in output.items() if not requested or name in requested]
+    else:
+        items = [(next(iter(requested), DEFAULT_OUTPUT_NAME), output)]
+
+    outputs = []
+    chunks = []
+    for name, value in items:
+        array = _to_array(name, value)
+        tensor = {"name": name, "datatype": _get_datatype(array.dtype), "shape": list(array.shape)}
+        if requested.get(name, {}).get("binary_data", binary_output):
+            data = _to_bytes(array)
+            tensor["parameters"] = {"binary_data_size": len(data)}
+            chunks.append(data)
+        else:
+            tensor["data"] = _to_json(array)
+        outputs.append(tensor)
+
+    infer_response = {"model_name": model_name, "model_version": model_version, "outputs": outputs}
+    if "id" in infer_request:
+        infer_response["id"] = infer_request["id"]
+
+    header = json.dumps(infer_response).encode("utf-8")
+    if not chunks:
+        return header, None
+    return b"".join([header, *chunks]), len(header)
+
+
+def get_model_metadata(name: str, version: str, run_function: Callable) -> Dict[str, Any]:
+    """Describe the model served by ``run_function``. The inputs and outputs are derived from its inference-schema
+    decorators, so they are empty when ``run()`` is not decorated.
+    """
+    inputs = []
+    outputs = []
+    if is_schema_decorated(run_function):
+        input_schema = get_input_schema(run_function)
+        for input_name, schema in (input_schema.get("properties") or {}).items():
+            example = (input_schema.get("example") or {}).get(input_name)
+            inputs.append(_get_tensor_metadata(input_name, schema, example))
+
+        output_schema = get_output_schema(run_function)
+        if output_schema:
+            outputs.append(_get_tensor_metadata(DEFAULT_OUTPUT_NAME, output_schema, output_schema.get("example")))
+
+    return {"name": name, "versions": [version], "platform": "azureml", "inputs": inputs, "outputs": outputs}
+
+
+def _get_tensor_metadata(name: str, schema: Dict[str, Any], example: Any) -> Dict[str, Any]:
+    shape = []
+    while schema.get("type") == "array" and "items" in schema:
+        schema = schema["items"]
+        shape.append(-1)
+
+    # The example tells the size of the inner dimensions. The first one is the batch dimension.
+    if shape and np is not None and isinstance(example, list):
+        try:
+            shape = [-1, *np.shape(example)[1:]]
+        except ValueError:
+            pass
+
+    datatype = _SCHEMA_DATATYPES.get((schema.get("type"), schema.get("format")))
+    if datatype is None:
+        datatype = _SCHEMA_DATATYPES.get((schema.get("type"), None), "BYTES")
+    return {"name": name, "datatype": datatype, "shape": shape}
+
+
+def _get_datatype(dtype: "np.dtype") -> str:
+    if dtype.kind in "OSU":
+        return "BYTES"
+    return _DTYPE_NAMES[dtype.name]
+
+
+def _from_json(data: Any, datatype: str, shape: Tuple[int, ...]) -> "np.ndarray":
+    if data is None:
+        raise ValueError("the input has no data")
+    array = np.array(data, dtype=_DATATYPES[datatype])
+    return array.reshape(shape)
+
+
+def _from_bytes(data: memoryview, datatype: str, shape: Tuple[int, ...]) -> "np.ndarray":
+    if datatype != "BYTES":
+        return np.frombuffer(data, dtype=np.dtype(_DATATYPES[datatype]).newbyteorder("<")).reshape(shape)
+
+    # Each element is a 4-byte little-endian length followed by that many bytes.
+    items = []
+    offset = 0
+    while offset < len(data):
+        start = offset + 4
+        end = start + int.from_bytes(data[offset:start], "little")
+        if end > len(data):
+            raise ValueError("the BYTES element lengths do not match the binary data")
+        items.append(bytes(data[start:end]))
+        offset = end
+    array = np.empty(len(items), dtype=object)
+    array[:] = items
+    return array.reshape(shape)
+
+
+def _to_array(name: str, value: Any) -> "np.ndarray":
+    try:
+        array = np.asarray(value)
+    except ValueError as ex:
+        raise OutputConversionError(f"Output {name} cannot be converted to a tensor: {ex}") from None
+
+    if array.dtype.kind not in "OSU" and array.dtype.name not in _DTYPE_NAMES:
+        raise OutputConversionError(f"Output {name} has an unsupported dtype: {array.dtype}")
+    return array
+
+
+def _to_json(array: "np.ndarray") -> List[Any]:
+    data = array.ravel().tolist()
+    if array.dtype.kind in "OS":
+        data = [item.decode("utf-8") if isinstance(item, bytes) else item for item in data]
+    return data
+
+
+def _to_bytes(array: "np.ndarray") -> bytes:
+    if array.dtype.kind not in "OSU":
+        return np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<")).tobytes()
+
+    chunks = []
+    for item in array.ravel().tolist():
+        item = item if isinstance(item, bytes) else str(item).encode("utf-8")
+        chunks.append(len(item).to_bytes(4, "little"))
+        chunks.append(item)
+    return b"".join(chunks)
@@ -0,0 +1,54 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import logging
+import os
+from typing import List
+
+import flask
+from inference_schema.schema_util import get_input_schema, is_schema_decorated
+from werkzeug.test import EnvironBuilder
+
+from .config import config
+from .user_script import UserScript
+
+logger = logging.getLogger("azmlinfsrv.warmup")
+
+WARMUP_FILENAME = "warmup.json"
+
+
+def get_warmup_payloads(user_script: UserScript) -> List[bytes]:
+    """Collect the JSON request bodies used to warm up ``run()``. These come from ``config.model_warmup_file`` (or a
+    ``warmup.json`` in the app root when it is not set) and, if ``config.warmup_from_schema`` is enabled, from the
+    ``example`` that inference-schema generates for the input of ``run()``.
+    """
+    payloads = []
+
+    warmup_file = config.model_warmup_file or os.path.join(config.app_root, WARMUP_FILENAME)
+    if os.path.isfile(warmup_file):
+        with open(warmup_file, "rb") as fp:
+            payloads.append(fp.read())
+
+    run_function = user_script.get_run_function()
+    if config.warmup_from_schema and is_schema_decorated(run_function):
+        example = get_input_schema(run_function).get("example")
+        if example is not None:
+            payloads.append(json.dumps(example).encode("utf-8"))
+
+    return payloads
+
+
+def warm_up(user_script: UserScript) -> None:
+    """Send each warm-up payload through ``invoke_run()`` as a POST to /score. Exceptions from the user script are
+    propagated to the caller.
+    """
+    payloads = get_warmup_payloads(user_script)
+    if not payloads:
+        logger.info("No warm-up payload is configured. Skipping the warm-up requests.")
+        return
+
+    for i, body in enumerate(payloads, start=1):
+        builder = EnvironBuilder(method="POST", path="/score", data=body, content_type="application/json")
+        timed_result = user_script.invoke_run(flask.Request(builder.get_environ()), timeout_ms=config.scoring_timeout)
+        logger.info(f"Warm-up request {i}/{len(payloads)} completed in {timed_result.elapsed_ms:.3f}ms")
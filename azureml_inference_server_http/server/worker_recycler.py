@@ -0,0 +1,117 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from contextlib import contextmanager
+import logging
+import os
+import random
+import signal
+import tempfile
+from typing import IO, Iterator, Optional, Tuple
+
+from .utils import get_rss, is_alive
+
+# fcntl is only available on POSIX, where the workers are managed by gunicorn.
+try:
+    import fcntl
+except ModuleNotFoundError:
+    fcntl = None
+
+logger = logging.getLogger("azmlinfsrv.worker_recycler")
+
+
+class WorkerRecycler:
+    """Recycles the gunicorn worker it runs in once it has served ``max_requests`` requests (plus a random jitter of up
+    to ``max_requests_jitter``, drawn per worker) or once its resident memory exceeds ``max_memory_mb``.
+
+    A worker is recycled by sending SIGTERM to itself, which makes gunicorn finish the in-flight requests before the
+    worker exits and the master starts a replacement. Only one worker of a master is recycled at a time: the worker
+    records its pid in a file shared by the workers, and the next worker that becomes ready marks it as replaced. Until
+    the recycled worker has exited and has been replaced, other workers that are due for recycling keep serving and
+    check again after their next request.
+    """
+
+    def __init__(
+        self, max_requests: int, max_requests_jitter: int, max_memory_mb: int, lock_dir: Optional[str] = None
+    ):
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_rss = max_memory_mb * 1024 * 1024
+        self.lock_dir = lock_dir or tempfile.gettempdir()
+        self.reset()
+
+    @property
+    def lock_path(self) -> str:
+        # Scoped to the gunicorn master so that a restarted server does not see stale markers.
+        return os.path.join(self.lock_dir, f"azmlinfsrv-recycle-{os.getppid()}")
+
+    def reset(self) -> None:
+        """Reset the request count and draw a new jitter. Called when a worker starts."""
+        self.requests = 0
+        self.recycling = False
+        self.request_limit = 0
+        if self.max_requests > 0:
+            self.request_limit = self.max_requests + random.randint(0, max(self.max_requests_jitter, 0))
+
+    def on_ready(self) -> None:
+        """Mark the worker as ready, which ends the recycling of the worker it replaces once that one has exited."""
+        self.reset()
+        with self._locked() as fp:
+            pid, _ = self._read_marker(fp)
+            if pid is not None:
+                fp.truncate(0)
+                fp.write(f"{pid} replaced")
+
+    def after_request(self) -> Optional[str]:
+        """Count a served request and recycle the worker if it is due. Returns why the worker is recycled, if it is."""
+        if self.recycling:
+            return None
+
+        self.requests += 1
+        reason = self._get_reason()
+        if reason is None or not self._claim():
+            return None
+
+        self.recycling = True
+        logger.info(f"Recycling worker {os.getpid()}: {reason}. It will exit once its in-flight requests complete.")
+        os.kill(os.getpid(), signal.SIGTERM)
+        return reason
+
+    def _get_reason(self) -> Optional[str]:
+        if self.request_limit and self.requests >= self.request_limit:
+            return f"served {self.requests} requests"
+
+        if self.max_rss:
+            rss = get_rss()
+            if rss is not None and rss > self.max_rss:
+                return f"resident memory of {rss / 1024 / 1024:.0f} MB exceeds {self.max_rss // 1024 // 1024} MB"
+
+        return None
+
+    def _claim(self) -> bool:
+        with self._locked() as fp:
+            pid, replaced = self._read_marker(fp)
+            if pid is not None and not (replaced and not is_alive(pid)):
+                # Another worker is draining, or its replacement is not ready yet.
+                return False
+            fp.truncate(0)
+            fp.write(str(os.getpid()))
+            return True
+
+    @contextmanager
+    def _locked(self) -> Iterator[IO[str]]:
+        # Closing the file releases the lock.
+        with open(self.lock_path, "a+") as fp:
+            if fcntl:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            yield fp
+
+    @staticmethod
+    def _read_marker(fp: IO[str]) -> Tuple[Optional[int], bool]:
+        # The marker is the pid of the recycled worker, followed by "replaced" once its replacement is ready.
+        fp.seek(0)
+        content = fp.read().split()
+        fp.seek(0)
+        if not content or not content[0].isdigit():
+            return None, False
+        return int(content[0]), content[1:] == ["replaced"]
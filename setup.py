@@ -83,15 +83,20 @@ setuptools.setup(
         "dev": [
             "azure-monitor-query",
             "black",
+            "cbor2",
             "coverage",
             "debugpy",
             "flake8",
             "flake8-comprehensions",
             "flake8-import-order",
+            "grpcio",
+            "grpcio-tools",
             "junitparser==2.0.0",
+            "msgpack",
             "numpy",
             "pandas",
             "pre-commit",
+            "pyarrow",
             "pytest",
             "pytest-asyncio",
             "pytest-benchmark",
@@ -99,7 +104,11 @@ setuptools.setup(
             "requests",
             "towncrier==21.9.0",
             "wheel",
-        ]
+        ],
+        "arrow": ["pyarrow"],
+        "cbor": ["cbor2"],
+        "grpc": ["grpcio", "grpcio-tools", "numpy"],
+        "msgpack": ["msgpack"],
     },
     entry_points={"console_scripts": [f"azmlinfsrv={PACKAGE_DIR}.amlserver:run"]},
     include_package_data=True,
@@ -42,6 +42,10 @@ class TestingApp(wrapt.ObjectProxy):
         self.regenerate_swagger()
         self.user_script.reset_run_decorators()
 
+    def set_user_run_batch(self, run_batch_fn: _CallableT) -> _CallableT:
+        self.user_script._user_run_batch = run_batch_fn
+        return run_batch_fn
+
     @contextmanager
     def appinsights_enabled(self):
         prev_val = config.app_insights_enabled
@@ -119,6 +123,7 @@ class TestingUserScript(UserScript):
     def reset_user_module(self) -> None:
         self._user_init = lambda: None
         self._user_run = lambda data: None
+        self._user_run_batch = None
         self.reset_run_decorators()
 
         # Call analyze_run() to update input_parser.
@@ -134,6 +139,6 @@ class TestingUserScript(UserScript):
         self._analyze_run()
         return run_fn
 
-    def invoke_run(self, request: flask.Request, *, timeout_ms: int) -> TimedResult:
-        self.last_run = super().invoke_run(request, timeout_ms=timeout_ms)
+    def invoke_run(self, request: flask.Request, *, timeout_ms: int, **kwargs) -> TimedResult:
+        self.last_run = super().invoke_run(request, timeout_ms=timeout_ms, **kwargs)
         return self.last_run
@@ -0,0 +1,22 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import time
+
+model_version = None
+
+
+def init():
+    global model_version
+
+    with open(os.path.join(os.environ["AZUREML_MODEL_DIR"], "version.txt")) as fp:
+        model_version = fp.read()
+    if model_version == "slow":
+        time.sleep(1)
+
+
+def run(data):
+    if model_version == "broken":
+        raise RuntimeError("This model version fails the warm-up request")
+    return model_version
@@ -0,0 +1,20 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import time
+
+model_version = None
+
+
+def init(model_dir):
+    global model_version
+
+    with open(os.path.join(model_dir, "version.txt")) as fp:
+        model_version = fp.read()
+    if model_version == "slow":
+        time.sleep(1)
+
+
+def run(data):
+    return model_version
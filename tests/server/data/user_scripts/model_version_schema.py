@@ -0,0 +1,27 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import time
+
+from inference_schema.parameter_types.standard_py_parameter_type import StandardPythonParameterType
+from inference_schema.schema_decorators import input_schema
+
+# Lets tests slow down the import of a new copy of the script.
+time.sleep(float(os.environ.get("MODEL_IMPORT_DELAY_SECONDS", "0")))
+
+model_version = None
+
+
+def init():
+    global model_version
+
+    with open(os.path.join(os.environ["AZUREML_MODEL_DIR"], "version.txt")) as fp:
+        model_version = fp.read()
+
+
+@input_schema("data", StandardPythonParameterType(1))
+def run(data):
+    if model_version == "broken":
+        raise RuntimeError("This model version fails the warm-up request")
+    return model_version
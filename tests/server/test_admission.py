@@ -0,0 +1,310 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from azureml_inference_server_http.server.admission import AdmissionController, AdmissionRejected
+from azureml_inference_server_http.server.config import PriorityClass
+from azureml_inference_server_http.server.metrics import SharedMetrics
+from .common import TestingApp, TestingClient
+
+CLASSES = {
+    "interactive": PriorityClass(priority=0),
+    "batch": PriorityClass(priority=1, share=0.5),
+}
+
+
+def _controller(concurrency: int = 1, queue_size: int = 10) -> AdmissionController:
+    return AdmissionController(concurrency, queue_size, CLASSES, "interactive")
+
+
+def _start(controller: AdmissionController, priority_class: str, order: list, tenant: str = ""):
+    # Start a request of priority_class that records when it is admitted (or shed) and then waits to be released. It is
+    # recorded by its tenant if it has one.
+    release = threading.Event()
+    name = tenant or priority_class
+
+    def request():
+        try:
+            with controller.admit(priority_class, 10, tenant):
+                order.append(name)
+                release.wait(10)
+        except AdmissionRejected:
+            order.append(f"{name} shed")
+
+    # Wait for the request to be admitted, queued or shed (or for the request it displaced to be shed).
+    before = len(order) + controller.queued
+    thread = threading.Thread(target=request, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while len(order) + controller.queued == before and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return release, thread
+
+
+def _release(release: threading.Event, thread: threading.Thread):
+    release.set()
+    thread.join(10)
+
+
+def test_admission_priority():
+    controller = _controller()
+    order = []
+    running = _start(controller, "batch", order)
+    waiting = [_start(controller, name, order) for name in ["batch", "interactive", "batch", "interactive"]]
+    assert controller.active == 1
+    assert controller.queued == 4
+
+    # The interactive requests are admitted ahead of the batch ones, in the order they arrived.
+    _release(*running)
+    for index in [1, 3, 0, 2]:
+        _release(*waiting[index])
+    assert order == ["batch", "interactive", "interactive", "batch", "batch"]
+    assert controller.active == 0
+
+
+def test_admission_share():
+    controller = _controller(concurrency=2)
+    order = []
+    batch = _start(controller, "batch", order)
+    # The batch class may take one of the two slots, so the second batch request waits while a slot is free.
+    second_batch = _start(controller, "batch", order)
+    interactive = _start(controller, "interactive", order)
+    assert order == ["batch", "interactive"]
+    assert controller.queued == 1
+
+    _release(*batch)
+    _release(*second_batch)
+    _release(*interactive)
+    assert order == ["batch", "interactive", "batch"]
+
+
+def test_admission_shed():
+    controller = _controller(queue_size=1)
+    order = []
+    running = _start(controller, "interactive", order)
+    batch = _start(controller, "batch", order)
+
+    # The batch request is shed to make room for the interactive one.
+    interactive = _start(controller, "interactive", order)
+    batch[1].join(10)
+    assert order == ["interactive", "batch shed"]
+
+    # When the queue is full of requests of the same priority, the new request is shed.
+    with pytest.raises(AdmissionRejected):
+        with controller.admit("interactive", 10):
+            pass
+
+    _release(*running)
+    _release(*interactive)
+    assert order == ["interactive", "batch shed", "interactive"]
+
+
+def test_admission_timeout():
+    controller = _controller()
+    order = []
+    running = _start(controller, "interactive", order)
+    with pytest.raises(AdmissionRejected, match="waited more than"):
+        with controller.admit("batch", 0.01):
+            pass
+    assert controller.queued == 0
+    _release(*running)
+
+
+def test_admission_tenants():
+    controller = AdmissionController(1, 10, CLASSES, "interactive", {"a": 2, "b": 1})
+    order = []
+    running = _start(controller, "interactive", order)
+    waiting = [_start(controller, "interactive", order, tenant) for tenant in ["a"] * 4 + ["b"] * 2]
+
+    # The tenants take turns, and a gets twice as many requests admitted as b.
+    _release(*running)
+    for index in [0, 1, 4, 2, 3, 5]:
+        _release(*waiting[index])
+    assert order == ["interactive", "a", "a", "b", "a", "a", "b"]
+
+    stats = controller.stats()
+    assert stats["a"].admitted == 4
+    assert stats["b"].admitted == 2
+    assert stats["a"].queued == stats["b"].queued == 0
+    assert stats["a"].wait_s > 0
+    # The tenants without a weight are counted together.
+    assert stats["other"].admitted == 1
+
+
+def test_admission_tenants_shed():
+    controller = AdmissionController(1, 2, CLASSES, "interactive", {"a": 1, "b": 1})
+    order = []
+    running = _start(controller, "interactive", order)
+    first = _start(controller, "interactive", order, "a")
+    _start(controller, "interactive", order, "a")
+
+    # The newest request of the tenant with the longest queue is shed.
+    b = _start(controller, "interactive", order, "b")
+    assert order == ["interactive", "a shed"]
+    assert controller.stats()["a"].shed == 1
+
+    _release(*running)
+    _release(*first)
+    _release(*b)
+    assert order == ["interactive", "a shed", "a", "b"]
+
+
+def test_admission_metrics(app: TestingApp, client: TestingClient):
+    assert client.get("/metrics").data == b""
+
+    controller = AdmissionController(1, 10, CLASSES, "interactive", {"a": 1})
+    app.azml_blueprint.admission = controller
+    with controller.admit("interactive", 10, "a"):
+        pass
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    lines = response.get_data(as_text=True).splitlines()
+    assert "azmlinfsrv_admission_active 0" in lines
+    assert 'azmlinfsrv_admission_queue_depth{tenant="a"} 0' in lines
+    assert 'azmlinfsrv_admission_admitted_total{tenant="a"} 1' in lines
+    assert 'azmlinfsrv_admission_wait_seconds_count{tenant="a"} 1' in lines
+    assert "# TYPE azmlinfsrv_admission_shed_total counter" in lines
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="The metrics are shared with forked processes")
+def test_admission_metrics_shared(app: TestingApp, client: TestingClient):
+    shared = SharedMetrics(["a"], slots=2)
+    app.azml_blueprint.shared_metrics = shared
+    controller = AdmissionController(2, 10, CLASSES, "interactive", {"a": 1}, on_change=shared.publish)
+    app.azml_blueprint.admission = controller
+
+    def worker(requests: int, hold: bool):
+        # A worker that scores requests, and exits while scoring one more when ``hold`` is set.
+        pid = os.fork()
+        if pid == 0:
+            try:
+                worker_controller = AdmissionController(
+                    2, 10, CLASSES, "interactive", {"a": 1}, on_change=shared.publish
+                )
+                for _ in range(requests):
+                    with worker_controller.admit("interactive", 10, "a"):
+                        pass
+                if hold:
+                    worker_controller._acquire("batch", "b", 10)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+    def metrics():
+        return client.get("/metrics").get_data(as_text=True).splitlines()
+
+    with controller.admit("interactive", 10, "a"):
+        worker(2, hold=True)
+        # The requests admitted by all the workers are counted, but the gauges of a worker that exited are not.
+        lines = metrics()
+        assert "azmlinfsrv_admission_active 1" in lines
+        assert 'azmlinfsrv_admission_admitted_total{tenant="a"} 3' in lines
+        assert 'azmlinfsrv_admission_admitted_total{tenant="other"} 1' in lines
+
+    # The counters of a worker that exited are kept when a new worker takes its slot.
+    worker(1, hold=False)
+    lines = metrics()
+    assert "azmlinfsrv_admission_active 0" in lines
+    assert 'azmlinfsrv_admission_admitted_total{tenant="a"} 4' in lines
+    assert 'azmlinfsrv_admission_admitted_total{tenant="other"} 1' in lines
+    assert 'azmlinfsrv_admission_wait_seconds_count{tenant="a"} 4' in lines
+
+
+def test_admission_get_class():
+    controller = _controller()
+    assert controller.get_class("Batch") == "batch"
+    assert controller.get_class(" interactive ") == "interactive"
+    assert controller.get_class("unknown") == "interactive"
+    assert controller.get_class(None) == "interactive"
+
+
+def test_admission_score(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    def run(data):
+        return data
+
+    controller = AdmissionController(1, 0, CLASSES, "interactive")
+    app.azml_blueprint.admission = controller
+
+    response = client.post_score({"a": 1}, headers={"x-ms-priority": "batch"})
+    assert response.status_code == 200
+
+    # Requests are shed while the worker is busy and the queue is full.
+    with controller.admit("interactive", 10):
+        response = client.post_score({"a": 1})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json == {"message": "The server is too busy to score the request. Retry later."}
+
+
+def test_admission_score_timeout(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    def run(data):
+        time.sleep(0.7)
+        return data
+
+    controller = AdmissionController(1, 10, {"interactive": PriorityClass(timeout_ms=1000)}, "interactive")
+    app.azml_blueprint.admission = controller
+    release = threading.Event()
+
+    def busy():
+        with controller.admit("interactive", 10):
+            release.wait(0.5)
+
+    thread = threading.Thread(target=busy)
+    thread.start()
+    time.sleep(0.05)
+    # The time the request waited to be admitted is taken from its scoring timeout.
+    response = client.post_score({"a": 1})
+    thread.join()
+    assert response.status_code == 500
+    assert response.json["message"].startswith("Scoring timeout after ")
+    assert int(response.json["message"].split()[3]) < 600
+
+
+@pytest.mark.parametrize("threads, warned", [(None, True), ("1", True), ("4", False)])
+def test_admission_single_thread(app: TestingApp, config, caplog, monkeypatch, threads, warned):
+    # A single-threaded worker never queues requests, so priorities have no effect.
+    if threads:
+        monkeypatch.setenv("WORKER_THREADS", threads)
+    else:
+        monkeypatch.delenv("WORKER_THREADS", raising=False)
+    config.max_concurrent_requests = 1
+    app.azml_blueprint._init_admission()
+
+    assert app.azml_blueprint.admission is not None
+    warnings = [record.message for record in caplog.records if record.levelname == "WARNING"]
+    assert any("never wait in the admission queue" in message for message in warnings) == warned
+
+
+def test_admission_bulk(app: TestingApp, client: TestingClient, config):
+    @app.set_user_run
+    def run(data):
+        return data
+
+    controller = AdmissionController(1, 0, CLASSES, "interactive", {"a": 1})
+    app.azml_blueprint.admission = controller
+    config.tenant_header = "x-tenant"
+    config.bulk_chunk_size = 1
+
+    # Each chunk of a bulk request is admitted with the class and the tenant of the request.
+    headers = {"x-ms-priority": "batch", "x-tenant": "a"}
+    response = client.post("/score/bulk", data='{"x": 1}\n{"x": 2}\n', headers=headers)
+    assert [json.loads(line)["status_code"] for line in response.get_data(as_text=True).splitlines()] == [200, 200]
+    assert controller.stats()["a"].admitted == 2
+
+    with controller.admit("interactive", 10):
+        response = client.post("/score/bulk", data='{"x": 1}\n', headers=headers)
+    assert json.loads(response.get_data(as_text=True)) == {
+        "index": 0,
+        "status_code": 503,
+        "error": "The server is too busy to score the record. Retry later.",
+    }
@@ -291,3 +291,21 @@ def test_appinsights_model_log_without_clientrequestid(app_appinsights):
         assert expected_log_data[item] == custom_dimensions[item]
 
     uuid.UUID(custom_dimensions["Request Id"]).hex
+
+
+def test_appinsights_suppressed_exceptions(app: flask.Flask, monkeypatch):
+    """Verifies that the exceptions suppressed by throttling are reported with their count"""
+
+    from azureml_inference_server_http.server import appinsights_client
+
+    logs_channel = Mock()
+    monkeypatch.setattr(appinsights_client, "logger", logs_channel)
+    client = app.azml_blueprint.appinsights_client
+    monkeypatch.setattr(client, "enabled", True)
+    monkeypatch.setattr(client, "_container_id", "Unknown", raising=False)
+
+    client.send_suppressed_log("The exception ValueError occurred", 2)
+
+    (message,), kwargs = logs_channel.warning.call_args
+    assert message == "The exception ValueError occurred"
+    assert kwargs["extra"]["custom_dimensions"] == {"Container Id": "Unknown", "Suppressed Count": 2}
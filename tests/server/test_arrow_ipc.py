@@ -0,0 +1,107 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from inference_schema.parameter_types.pandas_parameter_type import PandasParameterType
+from inference_schema.parameter_types.standard_py_parameter_type import StandardPythonParameterType
+from inference_schema.schema_decorators import input_schema
+import pytest
+
+from azureml_inference_server_http.server.arrow_ipc import ARROW_STREAM_CONTENT_TYPE, read_table, write_table
+from .common import TestingApp, TestingClient
+
+pa = pytest.importorskip("pyarrow")
+pd = pytest.importorskip("pandas")
+
+
+def test_arrow_ipc_input_table(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    @input_schema("table", StandardPythonParameterType({}), convert_to_provided_type=False)
+    def run(table):
+        return {"type": type(table).__name__, "sum": sum(table.column("x").to_pylist())}
+
+    table = pa.table({"x": [1, 2, 3]})
+    response = client.post_score(data=write_table(table), content_type=ARROW_STREAM_CONTENT_TYPE)
+    assert response.status_code == 200
+    assert response.json == {"type": "Table", "sum": 6}
+
+
+def test_arrow_ipc_input_pandas(app: TestingApp, client: TestingClient):
+    sample = pd.DataFrame({"x": [1.5], "n": [1]})
+
+    @app.set_user_run
+    @input_schema("df", PandasParameterType(sample))
+    def run(df, scale=2):
+        return (df["x"] * df["n"] * scale).tolist()
+
+    table = pa.table({"x": pa.array([0.5, 1.0]), "n": pa.array([2, 3], type=pa.int32())})
+    response = client.post_score(data=write_table(table), content_type=ARROW_STREAM_CONTENT_TYPE)
+    assert response.status_code == 200
+    assert response.json == [2.0, 6.0]
+
+    # The column types of the sample are enforced.
+    assert app.last_run.input["df"].dtypes.to_dict() == sample.dtypes.to_dict()
+
+
+@pytest.mark.filterwarnings("ignore:apply_column_names is a deprecated parameter:DeprecationWarning")
+def test_arrow_ipc_input_pandas_column_names(app: TestingApp, client: TestingClient):
+    sample = pd.DataFrame({"x": [1.5], "n": [1]})
+    parameter_type = PandasParameterType(sample, apply_column_names=True)
+
+    @app.set_user_run
+    @input_schema("df", parameter_type)
+    def run(df):
+        return df.to_dict(orient="list")
+
+    table = pa.table({"a": pa.array([0.5, 1.0]), "b": pa.array([2, 3], type=pa.int32())})
+    response = client.post_score(data=write_table(table), content_type=ARROW_STREAM_CONTENT_TYPE)
+    assert response.status_code == 200
+    assert response.json == {"x": [0.5, 1.0], "n": [2, 3]}
+
+    # The names and the types of the sample are applied as inference-schema does.
+    expected = parameter_type.deserialize_input(table.to_pylist())
+    pd.testing.assert_frame_equal(app.last_run.input["df"], expected)
+
+
+def test_arrow_ipc_input_invalid(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    @input_schema("table", StandardPythonParameterType({}), convert_to_provided_type=False)
+    def run(table):
+        pass
+
+    response = client.post_score(data=b"not arrow", content_type=ARROW_STREAM_CONTENT_TYPE)
+    assert response.status_code == 400
+    assert response.json["message"].startswith("POST body could not be decoded as an Arrow IPC stream")
+
+
+@pytest.mark.parametrize(
+    "accept, arrow",
+    [
+        (ARROW_STREAM_CONTENT_TYPE, True),
+        (f"{ARROW_STREAM_CONTENT_TYPE}, application/json;q=0.5", True),
+        ("application/json", False),
+        ("*/*", False),
+        (None, False),
+    ],
+)
+def test_arrow_ipc_output(app: TestingApp, client: TestingClient, accept: str, arrow: bool):
+    @app.set_user_run
+    @input_schema("n", StandardPythonParameterType(1))
+    def run(n, tabular=True):
+        if n < 0:
+            return {"error": "negative"}
+        df = pd.DataFrame({"i": range(n), "s": [str(i) for i in range(n)]})
+        return df if tabular else df.to_dict(orient="list")
+
+    headers = {"Accept": accept} if accept else {}
+    response = client.post_score({"n": 3, "tabular": arrow}, headers=headers)
+    assert response.status_code == 200
+    if arrow:
+        assert response.mimetype == ARROW_STREAM_CONTENT_TYPE
+        assert read_table(response.data).to_pydict() == {"i": [0, 1, 2], "s": ["0", "1", "2"]}
+    else:
+        assert response.json == {"i": [0, 1, 2], "s": ["0", "1", "2"]}
+
+    # Outputs that are not tabular are sent as JSON.
+    response = client.post_score({"n": -1}, headers=headers)
+    assert response.status_code == 200
+    assert response.json == {"error": "negative"}
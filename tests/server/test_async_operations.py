@@ -0,0 +1,247 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import os
+import threading
+import time
+
+from inference_schema.parameter_types.standard_py_parameter_type import StandardPythonParameterType
+from inference_schema.schema_decorators import input_schema
+import pytest
+
+from azureml_inference_server_http.api.aml_request import rawhttp
+from azureml_inference_server_http.api.aml_response import AMLResponse
+from azureml_inference_server_http.server import async_operations
+from azureml_inference_server_http.server.admission import AdmissionController, OTHER_TENANTS
+from azureml_inference_server_http.server.async_operations import AsyncOperations, OperationResult
+from azureml_inference_server_http.server.config import PriorityClass
+from .common import TestingApp, TestingClient
+
+PREFER_ASYNC = {"Prefer": "respond-async, wait=10"}
+
+release = threading.Event()
+
+
+@pytest.fixture()
+def operations(app: TestingApp, tmp_path):
+    operations = AsyncOperations(str(tmp_path), ttl_s=3600, max_workers=1)
+    app.azml_blueprint.async_operations = operations
+    release.set()
+    yield operations
+    release.set()
+    operations.close()
+
+
+def _wait_for_result(client: TestingClient, location: str):
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        response = client.get(location)
+        if response.status_code != 202:
+            return response
+        assert response.json["status"] == "Running"
+        time.sleep(0.01)
+    raise AssertionError("The operation did not complete in time.")
+
+
+def test_async_operation(app: TestingApp, client: TestingClient, operations: AsyncOperations):
+    @app.set_user_run
+    @input_schema("data", StandardPythonParameterType(1))
+    def run(data):
+        release.wait(10)
+        return {"doubled": data * 2}
+
+    release.clear()
+    response = client.post_score({"data": 21}, headers=PREFER_ASYNC)
+    assert response.status_code == 202
+    assert response.headers["Preference-Applied"] == "respond-async"
+    assert response.headers["Retry-After"] == "1"
+    operation_id = response.json["id"]
+    assert response.json == {"id": operation_id, "status": "Running"}
+    location = response.headers["Location"]
+    assert location == f"/operations/{operation_id}"
+
+    response = client.get(location)
+    assert response.status_code == 202
+    assert response.json == {"id": operation_id, "status": "Running"}
+
+    release.set()
+    response = _wait_for_result(client, location)
+    assert response.status_code == 200
+    assert response.headers["x-ms-operation-status"] == "Succeeded"
+    assert response.json == {"doubled": 42}
+
+    # The result is removed once it has been fetched.
+    assert client.get(location).status_code == 404
+    assert os.listdir(operations.spool_dir) == []
+
+
+def test_async_operation_failed(app: TestingApp, client: TestingClient, operations: AsyncOperations):
+    @app.set_user_run
+    @input_schema("data", StandardPythonParameterType("fail"))
+    def run(data):
+        if data == "response":
+            return AMLResponse("teapot", 418)
+        raise ValueError("boom")
+
+    response = client.post_score({"data": "fail"}, headers=PREFER_ASYNC)
+    assert response.status_code == 202
+    response = _wait_for_result(client, response.headers["Location"])
+    assert response.status_code == 500
+    assert response.headers["x-ms-operation-status"] == "Failed"
+    message = "An unexpected error occurred in scoring script. Check the logs for more info."
+    assert response.json == {"message": message}
+
+    # HTTP responses returned by run() are kept as they are.
+    response = client.post_score({"data": "response"}, headers=PREFER_ASYNC)
+    response = _wait_for_result(client, response.headers["Location"])
+    assert response.status_code == 418
+    assert response.data == b"teapot"
+
+
+def test_async_operation_admission(app: TestingApp, client: TestingClient, operations: AsyncOperations):
+    @app.set_user_run
+    @input_schema("data", StandardPythonParameterType(1))
+    def run(data):
+        return data
+
+    # Jobs take a scoring slot of the worker like synchronous requests, and are shed when there is none.
+    admission = AdmissionController(1, 0, {"interactive": PriorityClass()}, "interactive")
+    app.azml_blueprint.admission = admission
+    with admission.admit("interactive", 10):
+        response = client.post_score({"data": 1}, headers=PREFER_ASYNC)
+        response = _wait_for_result(client, response.headers["Location"])
+    assert response.status_code == 503
+    assert response.json == {"message": "The server is too busy to score the request. Retry later."}
+
+    response = client.post_score({"data": 1}, headers=PREFER_ASYNC)
+    response = _wait_for_result(client, response.headers["Location"])
+    assert response.status_code == 200
+    stats = admission.stats()[OTHER_TENANTS]
+    assert (stats.admitted, stats.shed) == (2, 1)
+
+
+def test_async_operation_queue_full(app: TestingApp, client: TestingClient, operations: AsyncOperations):
+    @app.set_user_run
+    @input_schema("data", StandardPythonParameterType(1))
+    def run(data):
+        release.wait(10)
+        return data
+
+    # One job runs and one waits for the thread. Further jobs are refused until one of them completes.
+    operations.max_pending = 1
+    release.clear()
+    locations = []
+    for data in (1, 2):
+        response = client.post_score({"data": data}, headers=PREFER_ASYNC)
+        assert response.status_code == 202
+        locations.append(response.headers["Location"])
+
+    response = client.post_score({"data": 3}, headers=PREFER_ASYNC)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json == {"message": "The server has too many pending operations. Retry later."}
+    assert len(os.listdir(operations.spool_dir)) == 2
+
+    release.set()
+    for data, location in zip((1, 2), locations):
+        response = _wait_for_result(client, location)
+        assert response.status_code == 200
+        assert response.json == data
+
+    response = client.post_score({"data": 4}, headers=PREFER_ASYNC)
+    assert response.status_code == 202
+    assert _wait_for_result(client, response.headers["Location"]).json == 4
+
+
+def test_async_operation_bad_input(app: TestingApp, client: TestingClient, operations: AsyncOperations):
+    @app.set_user_run
+    @input_schema("data", StandardPythonParameterType(1))
+    def run(data):
+        return data
+
+    # The input is parsed before the operation is started.
+    response = client.post_score(data=b"{not json", content_type="application/json", headers=PREFER_ASYNC)
+    assert response.status_code == 400
+    assert os.listdir(operations.spool_dir) == []
+
+
+def test_async_operation_synchronous(app: TestingApp, client: TestingClient, operations: AsyncOperations):
+    @app.set_user_run
+    def run_json(data):
+        return data
+
+    # Requests that do not prefer an async response are answered synchronously.
+    response = client.post_score({"data": 1}, headers={"Prefer": "return=minimal"})
+    assert response.status_code == 200
+    assert "Preference-Applied" not in response.headers
+
+    # So are all requests when run() is decorated with @rawhttp.
+    @app.set_user_run
+    @rawhttp
+    def run_raw(request):
+        return AMLResponse(request.get_data(), 200)
+
+    response = client.post_score(data=b"raw", headers=PREFER_ASYNC)
+    assert response.status_code == 200
+    assert response.data == b"raw"
+
+
+def test_async_operation_disabled(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    def run(data):
+        return data
+
+    response = client.post_score({"data": 1}, headers=PREFER_ASYNC)
+    assert response.status_code == 200
+    assert client.get("/operations/0123456789abcdef0123456789abcdef").status_code == 404
+
+
+@pytest.mark.parametrize("operation_id", ["0123456789abcdef0123456789abcdef", "..", "not-an-id"])
+def test_async_operation_not_found(client: TestingClient, operations: AsyncOperations, operation_id: str):
+    response = client.get(f"/operations/{operation_id}")
+    assert response.status_code == 404
+    assert response.json["message"].startswith("Operation not found.")
+
+
+def test_async_operations_expired(tmp_path):
+    operations = AsyncOperations(str(tmp_path), ttl_s=60, max_workers=1)
+    operation_id = operations.submit(lambda: OperationResult(200, "application/json", b"{}"))
+    operations.close()
+
+    # Results that were not fetched within the TTL are removed.
+    for name in os.listdir(tmp_path):
+        expired = time.time() - 120
+        os.utime(os.path.join(tmp_path, name), (expired, expired))
+    operations._last_sweep = 0
+    assert operations.get(operation_id) is None
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Worker liveness is not checked on Windows")
+def test_async_operations_worker_exited(tmp_path, monkeypatch):
+    operations = AsyncOperations(str(tmp_path), ttl_s=60, max_workers=1)
+    operation_id = "0123456789abcdef0123456789abcdef"
+    with open(os.path.join(tmp_path, f"{operation_id}.status"), "w") as fp:
+        json.dump({"status": "Running", "pid": os.getpid(), "status_code": None, "content_type": None}, fp)
+
+    assert operations.get(operation_id).status == "Running"
+
+    monkeypatch.setattr(async_operations, "is_alive", lambda pid: False)
+    operation = operations.get(operation_id)
+    assert operation.status == "Failed"
+    assert operation.result.status_code == 500
+    assert operations.get(operation_id) is None
+
+
+@pytest.mark.skipif(os.name == "nt", reason="The spool directory is not checked on Windows")
+def test_async_operations_default_spool_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(async_operations.tempfile, "gettempdir", lambda: str(tmp_path))
+    operations = AsyncOperations(None, ttl_s=60, max_workers=1)
+    assert operations.spool_dir == str(tmp_path / "azmlinfsrv-operations")
+    assert os.stat(operations.spool_dir).st_mode & 0o777 == 0o700
+
+    # A directory that other users can access is refused.
+    os.chmod(operations.spool_dir, 0o777)
+    with pytest.raises(PermissionError):
+        AsyncOperations(None, ttl_s=60, max_workers=1)
@@ -1,13 +1,20 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import signal
+
 from azureml.contrib.services.aml_request import rawhttp
 import flask
 from inference_schema.parameter_types.standard_py_parameter_type import StandardPythonParameterType
 from inference_schema.schema_decorators import input_schema
+import pytest
 
 from .common import TestingClient
 
+# Budget in seconds for the median time the test client takes to score a request with a no-op run(). It is about ten
+# times the overhead measured on a development machine, so that only a gross regression fails the benchmark.
+SERVER_OVERHEAD_BUDGET_S = 0.005
+
 
 def test_benchmark_run_not_decorated(benchmark, app: flask.Flask, client: TestingClient):
     @benchmark
@@ -43,3 +50,30 @@ def test_benchmark_run_decorated_with_inference_schema(benchmark, app: flask.Fla
         input_data = {"num": 10}
         response = client.post_score(input_data)
         assert response.status_code == 200
+
+
+@pytest.mark.parametrize("lean_mode", [False, True])
+def test_benchmark_server_overhead(benchmark, app: flask.Flask, client: TestingClient, config, lean_mode: bool):
+    # run() does nothing, so this measures the overhead of the server for each request.
+    @app.set_user_run
+    def run(data):
+        return None
+
+    config.lean_mode = lean_mode
+    previous_handler = signal.getsignal(signal.SIGALRM) if hasattr(signal, "SIGALRM") else None
+    try:
+        app.azml_blueprint._init_lean_mode()
+
+        @benchmark
+        def test_scoring():
+            response = client.post_score({"a": 1}, headers={"x-request-id": "benchmark"})
+            assert response.status_code == 200
+
+    finally:
+        # Lean mode leaves its SIGALRM handler installed.
+        if previous_handler is not None:
+            signal.signal(signal.SIGALRM, previous_handler)
+
+    # No statistics are collected when benchmarks are disabled.
+    if benchmark.stats:
+        assert benchmark.stats.stats.median < SERVER_OVERHEAD_BUDGET_S
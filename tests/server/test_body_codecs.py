@@ -0,0 +1,64 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from inference_schema.parameter_types.standard_py_parameter_type import StandardPythonParameterType
+from inference_schema.schema_decorators import input_schema
+import pytest
+
+from azureml_inference_server_http.server.body_codecs import CBOR_CONTENT_TYPE, MSGPACK_CONTENT_TYPE
+from .common import TestingApp, TestingClient
+
+msgpack = pytest.importorskip("msgpack")
+cbor2 = pytest.importorskip("cbor2")
+
+CODECS = [
+    pytest.param(MSGPACK_CONTENT_TYPE, msgpack.packb, msgpack.unpackb, id="msgpack"),
+    pytest.param(CBOR_CONTENT_TYPE, cbor2.dumps, cbor2.loads, id="cbor"),
+]
+
+
+@pytest.fixture()
+def app(app: TestingApp):
+    @app.set_user_run
+    @input_schema("data", StandardPythonParameterType([1.5]))
+    def run(data, label="none"):
+        return {"sum": sum(data), "label": label}
+
+    return app
+
+
+@pytest.mark.parametrize("content_type, dumps, loads", CODECS)
+def test_body_codecs_input(client: TestingClient, content_type, dumps, loads):
+    response = client.post_score(data=dumps({"data": [1, 2.5], "label": "a"}), content_type=content_type)
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    assert response.json == {"sum": 3.5, "label": "a"}
+
+
+@pytest.mark.parametrize("content_type, dumps, loads", CODECS)
+def test_body_codecs_output(client: TestingClient, content_type, dumps, loads):
+    response = client.post_score({"data": [1, 2]}, headers={"Accept": content_type})
+    assert response.status_code == 200
+    assert response.mimetype == content_type
+    assert loads(response.data) == {"sum": 3, "label": "none"}
+
+    # JSON stays the default.
+    response = client.post_score({"data": [1, 2]}, headers={"Accept": f"application/json, {content_type}"})
+    assert response.mimetype == "application/json"
+
+
+@pytest.mark.parametrize("content_type, dumps, loads", CODECS)
+def test_body_codecs_invalid(client: TestingClient, content_type, dumps, loads):
+    name = "MessagePack" if content_type == MSGPACK_CONTENT_TYPE else "CBOR"
+
+    response = client.post_score(data=dumps([1, 2]), content_type=content_type)
+    assert response.status_code == 400
+    assert response.json == {"message": f"POST body should be a {name} dictionary."}
+
+    response = client.post_score(data=b"", content_type=content_type)
+    assert response.status_code == 400
+    assert response.json == {"message": f"POST body is empty. Expecting a {name} dictionary."}
+
+    response = client.post_score(data=b"\xc1\xff", content_type=content_type)
+    assert response.status_code == 400
+    assert response.json["message"].startswith(f"POST body could not be decoded as {name}: ")
@@ -0,0 +1,154 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import logging
+import time
+
+from inference_schema.parameter_types.standard_py_parameter_type import StandardPythonParameterType
+from inference_schema.schema_decorators import input_schema
+
+from azureml_inference_server_http.api.aml_request import rawhttp
+from .common import TestingApp, TestingClient
+
+
+def _post_bulk(client: TestingClient, records):
+    body = "".join(record if isinstance(record, str) else json.dumps(record) + "\n" for record in records)
+    response = client.post("/score/bulk", data=body)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_bulk_run(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    @input_schema("a", StandardPythonParameterType(1))
+    def run(a, b=1):
+        if a < 0:
+            raise ValueError("negative")
+        return a * b
+
+    results = _post_bulk(client, [{"a": 1}, {"a": 2, "b": 3}, "\n", {"a": -1}, "[1]\n", "{\n", {"b": 2}])
+    assert results == [
+        {"index": 0, "status_code": 200, "output": 1},
+        {"index": 1, "status_code": 200, "output": 6},
+        {
+            "index": 2,
+            "status_code": 500,
+            "error": "An unexpected error occurred in scoring script. Check the logs for more info.",
+        },
+        {"index": 3, "status_code": 400, "error": "Record should be a JSON dictionary."},
+        {
+            "index": 4,
+            "status_code": 400,
+            "error": "Record could not be decoded as JSON: "
+            "Expecting property name enclosed in double quotes: line 1 column 2 (char 1)",
+        },
+        {"index": 5, "status_code": 400, "error": "A value is not provided for the 'a' parameter."},
+    ]
+
+
+def test_bulk_run_not_decorated(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    def run(data):
+        return json.loads(data)["x"]
+
+    assert _post_bulk(client, [{"x": 1}, {"x": "y"}]) == [
+        {"index": 0, "status_code": 200, "output": 1},
+        {"index": 1, "status_code": 200, "output": "y"},
+    ]
+
+
+def test_bulk_run_timeout(app: TestingApp, client: TestingClient, config):
+    @app.set_user_run
+    @input_schema("a", StandardPythonParameterType(1))
+    def run(a):
+        time.sleep(a)
+        return a
+
+    config.scoring_timeout = 200
+    assert _post_bulk(client, [{"a": 1}, {"a": 0}]) == [
+        {"index": 0, "status_code": 500, "error": "Scoring timeout after 200 ms"},
+        {"index": 1, "status_code": 200, "output": 0},
+    ]
+
+
+def test_bulk_run_batch(app: TestingApp, client: TestingClient, config):
+    calls = []
+
+    @app.set_user_run
+    @input_schema("a", StandardPythonParameterType(1))
+    def run(a):
+        raise AssertionError("run() should not be called")
+
+    @app.set_user_run_batch
+    def run_batch(batch):
+        calls.append(batch)
+        if any(record["a"] < 0 for record in batch):
+            raise ValueError("negative")
+        return [record["a"] * 2 for record in batch]
+
+    config.bulk_chunk_size = 2
+    results = _post_bulk(client, [{"a": 1}, {"a": 2}, {"b": 1}, {"a": 3}, {"a": -1}])
+    assert calls == [[{"a": 1}, {"a": 2}], [{"a": 3}], [{"a": -1}]]
+    assert [result.get("output", result["status_code"]) for result in results] == [2, 4, 400, 6, 500]
+
+
+def test_bulk_run_batch_wrong_length(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    def run(data):
+        pass
+
+    @app.set_user_run_batch
+    def run_batch(batch):
+        return []
+
+    results = _post_bulk(client, [{"a": 1}])
+    assert [result["status_code"] for result in results] == [500]
+
+
+def test_bulk_run_batch_generator_timeout(app: TestingApp, client: TestingClient, config):
+    @app.set_user_run
+    def run(data):
+        pass
+
+    @app.set_user_run_batch
+    def run_batch(batch):
+        for record in batch:
+            time.sleep(1)
+            yield record
+
+    # The outputs of a generator are computed within the timeout.
+    config.scoring_timeout = 200
+    results = _post_bulk(client, [{"a": 1}])
+    assert results == [{"index": 0, "status_code": 500, "error": "Scoring timeout after 200 ms"}]
+
+
+def test_bulk_access_log(app: TestingApp, client: TestingClient, caplog):
+    @app.set_user_run
+    @input_schema("a", StandardPythonParameterType(1.0))
+    def run(a):
+        time.sleep(a)
+        return a
+
+    with caplog.at_level(logging.INFO, logger="azmlinfsrv.access"):
+        # The WSGI server closes the response once it has sent the body.
+        with client.post("/score/bulk", data='{"a": 0.2}\n') as response:
+            assert json.loads(response.get_data())["output"] == 0.2
+
+    # The request is logged once its results are sent, with the time taken to score them.
+    (record,) = [record for record in caplog.records if record.name == "azmlinfsrv.access"]
+    method, path, status_code, duration, response_length = record.getMessage().split()
+    assert (method, path, status_code, response_length) == ("POST", "/score/bulk", "200", "N/A")
+    assert float(duration[: -len("ms")]) >= 200
+
+
+def test_bulk_rawhttp(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    @rawhttp
+    def run(request):
+        pass
+
+    response = client.post("/score/bulk", data="{}\n")
+    assert response.status_code == 415
+    assert response.json == {"message": "Bulk scoring is not supported when run() is decorated with @rawhttp."}
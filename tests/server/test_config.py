@@ -1,24 +1,144 @@
-# Copyright (c) Microsoft Corporation.
-# Licensed under the MIT License.
-
-import logging
-
-import pydantic
-import pytest
-
-from azureml_inference_server_http.server.config import AMLInferenceServerConfig, log_config_errors
-
-
-def test_config_errors(caplog):
-    with pytest.raises(pydantic.ValidationError) as exc:
-        AMLInferenceServerConfig(scoring_timeout="string")
-    with caplog.at_level(logging.CRITICAL, logger="azmlinfsrv"):
-        log_config_errors(exc.value)
-    info_tuple = (
-        "azmlinfsrv",
-        logging.CRITICAL,
-        "\n===============Configuration Error=================\nSCORING_TIMEOUT_MS: Input should be a valid integer, unable to parse string as an integer "
-        "(environment variable: SCORING_TIMEOUT_MS)\n============================"
-        "=======================",
-    )
-    assert info_tuple in caplog.record_tuples
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import logging
+import os
+import unittest.mock
+
+import pydantic
+import pytest
+
+from azureml_inference_server_http.server import aml_blueprint
+from azureml_inference_server_http.server.config import (
+    AMLInferenceServerConfig,
+    ConfigFileWatcher,
+    log_config_errors,
+    reload_config,
+)
+
+
+def test_config_errors(caplog):
+    with pytest.raises(pydantic.ValidationError) as exc:
+        AMLInferenceServerConfig(scoring_timeout="string")
+    with caplog.at_level(logging.CRITICAL, logger="azmlinfsrv"):
+        log_config_errors(exc.value)
+    info_tuple = (
+        "azmlinfsrv",
+        logging.CRITICAL,
+        "\n===============Configuration Error=================\nSCORING_TIMEOUT_MS: Input should be a valid integer, unable to parse string as an integer "
+        "(environment variable: SCORING_TIMEOUT_MS)\n============================"
+        "=======================",
+    )
+    assert info_tuple in caplog.record_tuples
+
+
+def test_config_priority_classes(monkeypatch):
+    monkeypatch.setenv("AML_PRIORITY_CLASSES", json.dumps({"high": {"priority": 0}, "low": {"share": 0.25}}))
+    monkeypatch.setenv("AML_DEFAULT_PRIORITY_CLASS", "low")
+    new_config = AMLInferenceServerConfig()
+    assert new_config.priority_classes["low"].priority == 0
+    assert new_config.priority_classes["low"].share == 0.25
+    assert new_config.priority_classes["high"].timeout_ms is None
+
+    monkeypatch.setenv("AML_DEFAULT_PRIORITY_CLASS", "unknown")
+    with pytest.raises(pydantic.ValidationError, match="unknown is not one of the classes"):
+        AMLInferenceServerConfig()
+
+
+def test_config_readiness_watermarks(monkeypatch):
+    monkeypatch.setenv("AML_READINESS_HIGH_WATERMARK", "10")
+    monkeypatch.setenv("AML_READINESS_LOW_WATERMARK", "4")
+    new_config = AMLInferenceServerConfig()
+    assert new_config.readiness_high_watermark == 10
+    assert new_config.readiness_low_watermark == 4
+
+    monkeypatch.setenv("AML_READINESS_LOW_WATERMARK", "10")
+    with pytest.raises(pydantic.ValidationError, match="must be lower than AML_READINESS_HIGH_WATERMARK"):
+        AMLInferenceServerConfig()
+
+
+def test_config_file_parsed_once(tmp_path, monkeypatch):
+    """Ensure the config file is read once no matter how many fields the config has."""
+
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps({"SCORING_TIMEOUT_MS": 5000, "AML_CORS_ORIGINS": "www.microsoft.com"}))
+    monkeypatch.setenv("AZUREML_CONFIG_FILE", str(config_file))
+
+    with unittest.mock.patch("json.load", wraps=json.load) as json_load:
+        new_config = AMLInferenceServerConfig()
+
+    assert json_load.call_count == 1
+    assert new_config.scoring_timeout == 5000
+    # Keys of fields without an alias are read using their documented names.
+    assert new_config.cors_origins == "www.microsoft.com"
+
+
+def test_config_reload(tmp_path, monkeypatch, config):
+    """Ensure only the reloadable settings are applied when the config file changes."""
+
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps({"SCORING_TIMEOUT_MS": 5000, "SERVICE_NAME": "before"}))
+    monkeypatch.setenv("AZUREML_CONFIG_FILE", str(config_file))
+    monkeypatch.delenv("SCORING_TIMEOUT_MS", raising=False)
+    monkeypatch.delenv("SERVICE_NAME", raising=False)
+
+    reload_config()
+    assert config.scoring_timeout == 5000
+
+    config_file.write_text(json.dumps({"SCORING_TIMEOUT_MS": 1000, "SERVICE_NAME": "after"}))
+    changed = reload_config()
+
+    assert changed == {"scoring_timeout": 1000}
+    assert config.scoring_timeout == 1000
+    assert config.service_name != "after"
+
+
+def test_config_reload_invalid(tmp_path, monkeypatch, config, caplog):
+    """Ensure an invalid config file does not change the current settings."""
+
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps({"SCORING_TIMEOUT_MS": "string"}))
+    monkeypatch.setenv("AZUREML_CONFIG_FILE", str(config_file))
+    monkeypatch.delenv("SCORING_TIMEOUT_MS", raising=False)
+
+    scoring_timeout = config.scoring_timeout
+    with caplog.at_level(logging.ERROR, logger="azmlinfsrv"):
+        assert reload_config() == {}
+
+    assert config.scoring_timeout == scoring_timeout
+    assert ("azmlinfsrv", logging.ERROR, "Config reload failed. Keeping the current settings.") in caplog.record_tuples
+
+
+def test_config_file_watcher(tmp_path, monkeypatch, config):
+    """Ensure the watcher reloads the config only when the file changes."""
+
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps({"SCORING_TIMEOUT_MS": 5000}))
+    monkeypatch.setenv("AZUREML_CONFIG_FILE", str(config_file))
+    monkeypatch.delenv("SCORING_TIMEOUT_MS", raising=False)
+
+    on_reload = unittest.mock.Mock()
+    watcher = ConfigFileWatcher(60, on_reload)
+    watcher.check()
+    on_reload.assert_not_called()
+
+    config_file.write_text(json.dumps({"SCORING_TIMEOUT_MS": 1000}))
+    os.utime(config_file, ns=(0, 0))
+    watcher.check()
+    on_reload.assert_called_once_with({"scoring_timeout": 1000})
+
+
+def test_config_file_watcher_preload(app, config, monkeypatch):
+    """Ensure each worker watches the config file when the app is preloaded in the gunicorn master."""
+
+    started = []
+    monkeypatch.setenv("WORKER_PRELOAD", "true")
+    monkeypatch.setattr(aml_blueprint, "_run_in_workers", started.append)
+    config.config_reload_interval = 60
+
+    app.azml_blueprint._init_config_watcher()
+    watcher = app.azml_blueprint.config_watcher
+    assert started == [watcher.start]
+    assert not watcher._thread.is_alive()
+    watcher.stop()
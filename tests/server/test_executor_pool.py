@@ -0,0 +1,186 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from azureml_inference_server_http.server.executor_pool import (
+    ExecutorPool,
+    ExecutorStartupError,
+    OutputTooLargeError,
+    PayloadTooLargeError,
+)
+from azureml_inference_server_http.server.isolated_runner import ScoringProcessError
+from .common import TestingApp, TestingClient
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="Executors require os.fork()")
+
+
+def _run(data, request_headers):
+    if isinstance(data, np.ndarray):
+        return data * 2
+    if data == "pid":
+        return os.getpid()
+    if data == "hang":
+        time.sleep(30)
+    if data == "slow":
+        time.sleep(0.5)
+        return os.getpid()
+    if data == "crash":
+        os._exit(1)
+    if data == "error":
+        raise ValueError("bad data")
+    if data == "large":
+        return bytes(2 * 1024 * 1024)
+    return data * 2
+
+
+def _load():
+    return _run
+
+
+@pytest.fixture()
+def pool():
+    pool = ExecutorPool(_load, 2, 1024 * 1024)
+    try:
+        yield pool
+    finally:
+        pool.close()
+
+
+def test_executor_pool_run(pool: ExecutorPool):
+    assert pool.run({"data": 21, "request_headers": {}}, timeout_ms=5000) == 42
+    assert pool.run({"data": "pid", "request_headers": {}}, timeout_ms=5000) != os.getpid()
+
+
+def test_executor_pool_numpy(pool: ExecutorPool):
+    array = np.arange(1000, dtype=np.float32).reshape(10, 100)
+    result = pool.run({"data": array, "request_headers": {}}, timeout_ms=5000)
+    np.testing.assert_array_equal(result, array * 2)
+
+    # The result is copied out of shared memory and owned by the worker.
+    result[0, 0] = -1
+    np.testing.assert_array_equal(pool.run({"data": array, "request_headers": {}}, timeout_ms=5000), array * 2)
+
+
+def test_executor_pool_concurrent(pool: ExecutorPool):
+    results = []
+
+    def call():
+        results.append(pool.run({"data": "slow", "request_headers": {}}, timeout_ms=5000))
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Both calls ran at the same time, each in its own executor.
+    assert time.perf_counter() - start < 0.9
+    assert len(set(results)) == 2
+
+
+def test_executor_pool_exception(pool: ExecutorPool):
+    with pytest.raises(ValueError, match="bad data") as excinfo:
+        pool.run({"data": "error", "request_headers": {}}, timeout_ms=5000)
+
+    assert 'raise ValueError("bad data")' in str(excinfo.value.__cause__)
+
+
+def test_executor_pool_payload_too_large(pool: ExecutorPool):
+    with pytest.raises(PayloadTooLargeError, match="The input of run()") as excinfo:
+        pool.run({"data": bytes(2 * 1024 * 1024), "request_headers": {}}, timeout_ms=5000)
+    assert excinfo.value.buffer_size == 1024 * 1024
+
+    with pytest.raises(OutputTooLargeError, match="The output of run()") as excinfo:
+        pool.run({"data": "large", "request_headers": {}}, timeout_ms=5000)
+    assert excinfo.value.buffer_size == 1024 * 1024
+
+    assert pool.run({"data": 1, "request_headers": {}}, timeout_ms=5000) == 2
+
+
+def test_executor_pool_timeout(pool: ExecutorPool):
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        pool.run({"data": "hang", "request_headers": {}}, timeout_ms=200)
+    assert time.perf_counter() - start < 5
+
+    # The killed executor is replaced without calling init() again.
+    test_executor_pool_concurrent(pool)
+    assert pool.run({"data": 1, "request_headers": {}}, timeout_ms=5000) == 2
+
+
+def test_executor_pool_crash(pool: ExecutorPool):
+    with pytest.raises(ScoringProcessError):
+        pool.run({"data": "crash", "request_headers": {}}, timeout_ms=5000)
+
+    assert pool.run({"data": 1, "request_headers": {}}, timeout_ms=5000) == 2
+
+
+def test_executor_pool_owner_exited():
+    pool = ExecutorPool(_load, 1, 1024 * 1024)
+    try:
+        # A worker that exits while holding the only executor.
+        pid = os.fork()
+        if pid == 0:
+            pool._claim(time.monotonic() + 5)
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert pool.run({"data": 1, "request_headers": {}}, timeout_ms=5000) == 2
+    finally:
+        pool.close()
+
+
+def test_executor_pool_startup_error():
+    def load():
+        raise RuntimeError("init failed")
+
+    with pytest.raises(ExecutorStartupError, match="init failed"):
+        ExecutorPool(load, 1, 1024)
+
+
+def test_executor_pool_routes(app: TestingApp, client: TestingClient, config):
+    @app.set_user_run
+    def run(data):
+        if data == '"hang"':
+            time.sleep(30)
+        if data == '"large"':
+            return "x" * 2 * 1024 * 1024
+        return [data, os.getpid()]
+
+    pool = ExecutorPool(lambda: app.user_script._wrapped_user_run, 1, 1024 * 1024)
+    app.user_script.executor_pool = pool
+    try:
+        response = client.post_score("hello")
+        assert response.status_code == 200
+        data, pid = response.json
+        assert data == '"hello"'
+        assert pid != os.getpid()
+
+        config.scoring_timeout = 300
+        response = client.post_score("hang")
+        assert response.status_code == 504
+
+        # The killed executor is replaced and serves the next request.
+        config.scoring_timeout = 5000
+        assert client.post_score("again").status_code == 200
+
+        # Payloads larger than the buffer of the executor are rejected with their size.
+        response = client.post_score("x" * 2 * 1024 * 1024)
+        assert response.status_code == 413
+        assert "does not fit in the executor buffer of 1048576 bytes" in response.json["message"]
+
+        # An output larger than the buffer is not the fault of the request.
+        response = client.post_score("large")
+        assert response.status_code == 500
+        assert response.json["message"].startswith("The output of run()")
+        assert "EXECUTOR_BUFFER_MB" in response.json["message"]
+    finally:
+        app.user_script.executor_pool = None
+        pool.close()
@@ -0,0 +1,170 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import time
+
+from inference_schema.parameter_types.numpy_parameter_type import NumpyParameterType
+from inference_schema.parameter_types.standard_py_parameter_type import StandardPythonParameterType
+from inference_schema.schema_decorators import input_schema
+import pytest
+
+from azureml_inference_server_http.server import grpc_transport
+from .common import TestingApp
+
+grpc = pytest.importorskip("grpc")
+np = pytest.importorskip("numpy")
+
+
+@pytest.fixture()
+def stub(app: TestingApp):
+    server, port = grpc_transport.serve(app.azml_blueprint, "127.0.0.1", 0)
+    protos, services = grpc.protos_and_services(grpc_transport.PROTO_PATH)
+    with grpc.insecure_channel(f"127.0.0.1:{port}") as channel:
+        yield protos, services.InferenceServerStub(channel)
+    server.stop(None)
+
+
+def test_grpc_score_json(app: TestingApp, stub):
+    protos, client = stub
+
+    @app.set_user_run
+    @input_schema("data", StandardPythonParameterType([1, 2]))
+    def run(data):
+        return {"sum": sum(data)}
+
+    request = protos.ScoreRequest(body=json.dumps({"data": [1, 2, 3]}).encode("utf-8"))
+    response, call = client.Score.with_call(request, metadata=(("x-request-id", "grpc-test"),))
+
+    assert response.status_code == 200
+    assert json.loads(response.body) == {"sum": 6}
+    assert response.headers["x-request-id"] == "grpc-test"
+    assert "x-ms-run-fn-exec-ms" in response.headers
+    assert ("x-request-id", "grpc-test") in call.initial_metadata()
+
+
+def test_grpc_score_tensor(app: TestingApp, stub):
+    protos, client = stub
+
+    @app.set_user_run
+    @input_schema("data", NumpyParameterType(np.zeros((1, 3), dtype=np.float32)))
+    def run(data):
+        return data * 2
+
+    array = np.arange(6, dtype=np.float32).reshape(2, 3)
+    tensor = protos.Tensor(dtype=array.dtype.str, shape=array.shape, data=array.tobytes())
+    response = client.Score(protos.ScoreRequest(tensors={"data": tensor}))
+
+    assert response.status_code == 200
+    assert tuple(response.tensor.shape) == (2, 3)
+    result = np.frombuffer(response.tensor.data, dtype=response.tensor.dtype).reshape(response.tensor.shape)
+    np.testing.assert_array_equal(result, array * 2)
+
+
+def test_grpc_score_invalid_tensor(app: TestingApp, stub):
+    protos, client = stub
+
+    @app.set_user_run
+    @input_schema("data", NumpyParameterType(np.zeros((1, 3), dtype=np.float32)))
+    def run(data):
+        return data
+
+    tensor = protos.Tensor(dtype="<f4", shape=[2, 3], data=b"\x00" * 4)
+    response = client.Score(protos.ScoreRequest(tensors={"data": tensor}))
+
+    assert response.status_code == 400
+    assert json.loads(response.body)["message"].startswith("Invalid tensor:")
+
+
+def test_grpc_score_errors(app: TestingApp, stub):
+    protos, client = stub
+
+    @app.set_user_run
+    def run(data):
+        raise RuntimeError("boom")
+
+    response = client.Score(protos.ScoreRequest(body=b"{}", content_type="text/plain"))
+    assert response.status_code == 500
+    assert json.loads(response.body) == {
+        "message": "An unexpected error occurred in scoring script. Check the logs for more info."
+    }
+
+    tensor = protos.Tensor(dtype="<f4", shape=[1], data=b"\x00" * 4)
+    response = client.Score(protos.ScoreRequest(tensors={"data": tensor}))
+    assert response.status_code == 415
+
+
+def test_grpc_score_stream(app: TestingApp, stub):
+    protos, client = stub
+
+    @app.set_user_run
+    @input_schema("num", StandardPythonParameterType(1))
+    def run(num):
+        return num + 1
+
+    requests = (protos.ScoreRequest(body=json.dumps({"num": i}).encode("utf-8")) for i in range(3))
+    responses = list(client.ScoreStream(requests))
+
+    assert [json.loads(response.body) for response in responses] == [1, 2, 3]
+    assert all(response.status_code == 200 for response in responses)
+
+
+# How long run() hangs for in test_grpc_score_timeout
+HANG_S = 5
+
+
+@pytest.fixture()
+def isolated_runner(app: TestingApp):
+    @app.set_user_run
+    def run(data):
+        if data == "hang":
+            time.sleep(HANG_S)
+        return data
+
+    app.user_script.start_isolated_runner()
+    try:
+        yield app.user_script.isolated_runner
+    finally:
+        app.user_script.isolated_runner.close()
+        app.user_script.isolated_runner = None
+
+
+# The scoring processes are forked before the gRPC server starts, as in the server. gRPC does not support forking while
+# its threads are running, and scoring processes forked then may hang.
+def test_grpc_score_timeout(app: TestingApp, isolated_runner, stub, config):
+    protos, client = stub
+
+    # Warm up the scoring process, so that the deadline below is spent in run().
+    response = client.Score(protos.ScoreRequest(body=b"hello", content_type="text/plain"), timeout=HANG_S)
+    assert response.status_code == 200
+
+    # The scoring process is killed at the call deadline, long before run() returns, so that it is free for the next
+    # call.
+    start = time.monotonic()
+    try:
+        response = client.Score(protos.ScoreRequest(body=b"hang", content_type="text/plain"), timeout=HANG_S / 10)
+    except grpc.RpcError as ex:
+        assert ex.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+    else:
+        # The worker answers when the scoring timeout, capped by the deadline, expires. That may be just before the
+        # client gives up on the call.
+        assert response.status_code == 504
+    response = client.Score(protos.ScoreRequest(body=b"hello", content_type="text/plain"), timeout=HANG_S)
+    assert response.status_code == 200
+    assert time.monotonic() - start < HANG_S
+
+    config.scoring_timeout = 300
+    response = client.Score(protos.ScoreRequest(body=b"hang", content_type="text/plain"))
+    assert response.status_code == 504
+    assert json.loads(response.body) == {"message": "Scoring timeout after 300 ms"}
+
+
+def test_grpc_timeout_warning(app: TestingApp, config, caplog, monkeypatch):
+    monkeypatch.setattr(grpc_transport, "serve", lambda *args: (None, 5001))
+    app.azml_blueprint._start_grpc_server()
+    assert "the scoring timeout and the call deadline are not enforced" in caplog.text
+
+    caplog.clear()
+    config.isolated_scoring_enabled = True
+    app.azml_blueprint._start_grpc_server()
+    assert "not enforced" not in caplog.text
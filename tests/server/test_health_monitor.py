@@ -0,0 +1,197 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from azureml_inference_server_http.server import health_monitor
+from azureml_inference_server_http.server.health_monitor import HealthMonitor, RequestProgress
+from .common import TestingApp, TestingClient
+
+
+@pytest.fixture()
+def monitor():
+    monitor = HealthMonitor(table_size=4, timeout_s=60)
+    yield monitor
+    monitor.close()
+
+
+def _get(address, path: str):
+    host, port = address
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}{path}", timeout=10) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as ex:
+        return ex.code, ex.read()
+
+
+def test_health_monitor_probes(monitor: HealthMonitor):
+    address = monitor.serve("127.0.0.1", 0)
+
+    # No worker is ready yet.
+    assert _get(address, "/") == (503, b"Unhealthy")
+    assert _get(address, "/v2/health/ready")[0] == 503
+
+    assert monitor.register()
+    assert _get(address, "/") == (200, b"Healthy")
+    assert _get(address, "/v2/health/live") == (200, b"")
+    assert _get(address, "/v2/health/ready") == (200, b"")
+    assert _get(address, "/score")[0] == 404
+
+
+def test_health_monitor_saturated(monitor: HealthMonitor, monkeypatch):
+    monkeypatch.setattr(health_monitor, "HEARTBEAT_INTERVAL_S", 0.01)
+    address = monitor.serve("127.0.0.1", 0)
+    saturated = [True]
+    monitor.register(lambda: saturated[0])
+
+    # A saturated worker is live but not ready.
+    deadline = time.monotonic() + 10
+    while monitor.ready_workers() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert monitor.live_workers() == 1
+    assert _get(address, "/v2/health/ready")[0] == 503
+    assert _get(address, "/v2/health/live")[0] == 200
+    assert _get(address, "/")[0] == 200
+
+    saturated[0] = False
+    while not monitor.ready_workers() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _get(address, "/v2/health/ready")[0] == 200
+
+
+def test_health_monitor_heartbeat_timeout(monitor: HealthMonitor):
+    monitor.timeout_s = 0.05
+    monitor.register()
+    assert monitor.ready_workers() == 1
+
+    # A worker that stops sending heartbeats is not counted.
+    time.sleep(0.1)
+    assert monitor.ready_workers() == 0
+
+
+def test_health_monitor_stalled(monitor: HealthMonitor, monkeypatch):
+    monkeypatch.setattr(health_monitor, "HEARTBEAT_INTERVAL_S", 0.01)
+    monitor.timeout_s = 0.2
+    progress = RequestProgress()
+    monitor.register(progress=progress)
+    assert monitor.live_workers() == 1
+
+    # A worker whose requests make no progress, such as a run() that hangs, stops sending heartbeats.
+    progress.start()
+    deadline = time.monotonic() + 10
+    while monitor.live_workers() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert monitor.live_workers() == 0
+
+    progress.finish()
+    while not monitor.live_workers() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert monitor.live_workers() == 1
+
+
+def test_health_monitor_request_progress():
+    progress = RequestProgress()
+    assert not progress.stalled(0)
+
+    progress.start()
+    time.sleep(0.01)
+    assert progress.stalled(0)
+    assert not progress.stalled(60)
+
+    # Requests that complete count as progress, even while others are still served.
+    progress.start()
+    progress.finish()
+    assert not progress.stalled(0.005)
+    progress.finish()
+    assert not progress.stalled(0)
+
+    # Requests are not stalled before their scoring timeout, and streamed requests make progress as they go.
+    progress = RequestProgress(lambda: 60)
+    progress.start()
+    time.sleep(0.01)
+    assert not progress.stalled(0)
+    progress.budget_s = lambda: 0
+    assert progress.stalled(0.005)
+    progress.advance()
+    assert not progress.stalled(0.005)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="The table is shared with forked processes")
+def test_health_monitor_workers():
+    monitor = HealthMonitor(table_size=1, timeout_s=60)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # A worker registers once it is ready, and keeps running until it is told to exit.
+        monitor.register()
+        os.read(read_fd, 1)
+        os._exit(0)
+
+    try:
+        deadline = time.monotonic() + 10
+        while monitor.ready_workers() == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert monitor.ready_workers() == 1
+        # The table is full.
+        assert not monitor.register()
+    finally:
+        os.write(write_fd, b"x")
+        os.waitpid(pid, 0)
+
+    # Workers that have exited are not counted, and their entry is reused.
+    assert monitor.ready_workers() == 0
+    assert monitor.register()
+    assert monitor.ready_workers() == 1
+    monitor.close()
+
+
+def test_health_monitor_worker_setup(app: TestingApp, client: TestingClient, monitor: HealthMonitor, monkeypatch):
+    # Workers report to the health monitor of the gunicorn master once they are set up.
+    monkeypatch.setattr(health_monitor, "_monitor", monitor)
+    app.azml_blueprint._init_health_monitor()
+    assert monitor.ready_workers() == 1
+
+    # The progress of their requests is tracked.
+    progress = app.azml_blueprint.request_progress
+
+    @app.set_user_run
+    def run(data):
+        return progress.active
+
+    response = client.post_score({"a": 1})
+    assert response.json == 1
+    assert client.get("/missing").status_code == 404
+    assert progress.active == 0
+
+
+def test_health_monitor_bulk_stream(
+    app: TestingApp, client: TestingClient, monitor: HealthMonitor, config, monkeypatch
+):
+    monkeypatch.setattr(health_monitor, "_monitor", monitor)
+    app.azml_blueprint._init_health_monitor()
+    progress = app.azml_blueprint.request_progress
+    config.bulk_chunk_size = 1
+    config.scoring_timeout = 300
+    stalled = []
+
+    @app.set_user_run
+    def run(data):
+        time.sleep(0.1)
+        stalled.append((progress.active, progress.stalled(0.2)))
+        return data
+
+    # A bulk stream that takes longer than the scoring timeout and the worker timeout together is served until its
+    # body is sent, and is not stalled since each record it scores is progress.
+    start = time.monotonic()
+    # The WSGI server closes the response once it has sent the body.
+    with client.post("/score/bulk", data=b"\n".join(b"%d" % i for i in range(8))) as response:
+        assert response.status_code == 200
+        assert len(response.get_data(as_text=True).splitlines()) == 8
+    assert time.monotonic() - start > 0.5
+    assert stalled == [(1, False)] * 8
+    assert progress.active == 0
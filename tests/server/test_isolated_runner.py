@@ -0,0 +1,112 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import threading
+import time
+
+import pytest
+
+from azureml_inference_server_http.server.isolated_runner import IsolatedRunner, ScoringProcessError
+from .common import TestingApp, TestingClient
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="Isolated scoring requires os.fork()")
+
+
+def _run(data, request_headers):
+    if data == "pid":
+        return os.getpid()
+    if data == "hang":
+        time.sleep(30)
+    if data == "crash":
+        os._exit(1)
+    if data == "error":
+        raise ValueError("bad data")
+    return data * 2
+
+
+@pytest.fixture()
+def runner():
+    runner = IsolatedRunner(_run)
+    try:
+        yield runner
+    finally:
+        runner.close()
+
+
+def test_isolated_runner_run(runner: IsolatedRunner):
+    assert runner.run({"data": 21, "request_headers": {}}, timeout_ms=5000) == 42
+    assert runner.run({"data": "pid", "request_headers": {}}, timeout_ms=5000) != os.getpid()
+
+
+def test_isolated_runner_exception(runner: IsolatedRunner):
+    with pytest.raises(ValueError, match="bad data") as excinfo:
+        runner.run({"data": "error", "request_headers": {}}, timeout_ms=5000)
+
+    # The traceback from the scoring process is chained.
+    assert 'raise ValueError("bad data")' in str(excinfo.value.__cause__)
+
+
+def test_isolated_runner_timeout(runner: IsolatedRunner):
+    pid = runner.run({"data": "pid", "request_headers": {}}, timeout_ms=5000)
+
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        runner.run({"data": "hang", "request_headers": {}}, timeout_ms=200)
+    assert time.perf_counter() - start < 5
+
+    # A new scoring process took over.
+    assert runner.run({"data": "pid", "request_headers": {}}, timeout_ms=5000) != pid
+    assert runner.run({"data": 1, "request_headers": {}}, timeout_ms=5000) == 2
+
+
+def test_isolated_runner_queued_timeout(runner: IsolatedRunner):
+    """Ensure a call waiting for the scoring process gives up once its timeout expires."""
+
+    def hang():
+        with pytest.raises(TimeoutError):
+            runner.run({"data": "hang", "request_headers": {}}, timeout_ms=2000)
+
+    hanging = threading.Thread(target=hang)
+    hanging.start()
+    time.sleep(0.1)
+
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        runner.run({"data": 1, "request_headers": {}}, timeout_ms=200)
+    assert time.perf_counter() - start < 1
+    hanging.join()
+
+
+def test_isolated_runner_crash(runner: IsolatedRunner):
+    with pytest.raises(ScoringProcessError):
+        runner.run({"data": "crash", "request_headers": {}}, timeout_ms=5000)
+
+    assert runner.run({"data": 1, "request_headers": {}}, timeout_ms=5000) == 2
+
+
+def test_isolated_runner_routes(app: TestingApp, client: TestingClient, config, monkeypatch):
+    @app.set_user_run
+    def run(data):
+        if data == '"hang"':
+            time.sleep(30)
+        return data
+
+    app.user_script.start_isolated_runner()
+    try:
+        response = client.post_score("hello")
+        assert response.status_code == 200
+        assert response.json == '"hello"'
+
+        config.scoring_timeout = 300
+        start = time.perf_counter()
+        response = client.post_score("hang")
+        assert response.status_code == 504
+        assert response.json == {"message": "Scoring timeout after 300 ms"}
+        assert time.perf_counter() - start < 5
+
+        response = client.post_score("again")
+        assert response.status_code == 200
+    finally:
+        app.user_script.isolated_runner.close()
+        app.user_script.isolated_runner = None
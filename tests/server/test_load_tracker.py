@@ -0,0 +1,103 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import contextlib
+import json
+
+from azureml_inference_server_http.server.admission import AdmissionController
+from azureml_inference_server_http.server.async_operations import AsyncOperations
+from azureml_inference_server_http.server.config import PriorityClass
+from azureml_inference_server_http.server.load_tracker import LoadTracker
+from .common import TestingApp, TestingClient
+
+
+def test_load_tracker_watermarks():
+    tracker = LoadTracker(capacity=4, high_watermark=3, low_watermark=1)
+    with contextlib.ExitStack() as stack:
+        for _ in range(2):
+            stack.enter_context(tracker.track())
+        assert tracker.pending == 2
+        assert not tracker.saturated
+
+        stack.enter_context(tracker.track())
+        assert tracker.saturated
+
+        # The worker stays saturated until the low watermark is reached.
+        with tracker.track():
+            pass
+        assert tracker.saturated
+        stack.pop_all().close()
+    assert tracker.pending == 0
+    assert not tracker.saturated
+
+    # The low watermark defaults to half of the high watermark.
+    assert LoadTracker(capacity=1, high_watermark=5).low_watermark == 2
+    assert LoadTracker(capacity=1).low_watermark is None
+
+
+def test_load_tracker_utilization():
+    admission = AdmissionController(1, 10, {"interactive": PriorityClass()}, "interactive")
+    tracker = LoadTracker(capacity=2, admission=admission)
+    assert tracker.utilization == 0
+
+    with tracker.track():
+        assert tracker.utilization == 0.5
+        # Requests waiting to be admitted do not use the scoring capacity.
+        admission._queued = 1
+        assert tracker.utilization == 0
+        assert tracker.queued == 1
+
+
+def test_load_tracker_headers(app: TestingApp, client: TestingClient, config):
+    @app.set_user_run
+    def run(data):
+        return data
+
+    tracker = LoadTracker(capacity=2, high_watermark=2, low_watermark=1)
+    app.azml_blueprint.load_tracker = tracker
+    response = client.post_score({"a": 1})
+    assert "x-ms-worker-utilization" not in response.headers
+
+    # A scored request counts towards the load it reports.
+    config.load_headers_enabled = True
+    response = client.post_score({"a": 1})
+    assert response.headers["x-ms-worker-utilization"] == "0.50"
+    assert response.headers["x-ms-worker-queue-depth"] == "0"
+    assert client.get("/v2/health/ready").headers["x-ms-worker-utilization"] == "0.00"
+
+    with tracker.track():
+        response = client.post_score({"a": 1})
+        assert response.headers["x-ms-worker-utilization"] == "1.00"
+        assert client.get("/v2/health/ready").status_code == 200
+
+        # A saturated worker is live but not ready.
+        with tracker.track():
+            assert client.get("/v2/health/ready").status_code == 503
+            assert client.get("/v2/health/live").status_code == 200
+            assert client.get_health().status_code == 200
+    assert client.get("/v2/health/ready").status_code == 200
+    assert tracker.pending == 0
+
+
+def test_load_tracker_bulk_and_async(app: TestingApp, client: TestingClient, tmp_path):
+    tracker = LoadTracker(capacity=2, high_watermark=1)
+
+    @app.set_user_run
+    def run(data):
+        return {"pending": tracker.pending, "ready": client.get("/v2/health/ready").status_code}
+
+    app.azml_blueprint.load_tracker = tracker
+
+    # Bulk records and background jobs count as pending while they are scored, so they can saturate the worker.
+    response = client.post("/score/bulk", data='{"a": 1}\n')
+    assert json.loads(response.get_data())["output"] == {"pending": 1, "ready": 503}
+
+    operations = AsyncOperations(str(tmp_path), ttl_s=60, max_workers=1)
+    app.azml_blueprint.async_operations = operations
+    try:
+        response = client.post_score({"a": 1}, headers={"Prefer": "respond-async"})
+        operations.close()
+        assert client.get(response.headers["Location"]).json == {"pending": 1, "ready": 503}
+    finally:
+        operations.close()
+    assert tracker.pending == 0
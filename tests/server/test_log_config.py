@@ -0,0 +1,121 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import io
+import logging
+import logging.config
+import threading
+
+import pytest
+
+from azureml_inference_server_http.log_config import enable_log_queue, LogQueueHandler, RootAccessFilter
+
+
+class BlockingStream(io.StringIO):
+    """A stream whose writes wait until it is released, like stdout behind a slow log driver."""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.released = threading.Event()
+        self.writes = 0
+
+    def write(self, s: str) -> int:
+        self.entered.set()
+        self.released.wait(5)
+        self.writes += 1
+        return super().write(s)
+
+
+@pytest.fixture()
+def queued_logger():
+    logger = logging.getLogger("azmlinfsrv_test.queue")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    stream = BlockingStream()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    logger.handlers = [handler]
+    enable_log_queue(logger, 2)
+    try:
+        yield logger, stream
+    finally:
+        stream.released.set()
+        logger.handlers[0].close()
+        logger.handlers = []
+
+
+def test_log_queue_batches(queued_logger):
+    logger, stream = queued_logger
+    assert isinstance(logger.handlers[0], LogQueueHandler)
+
+    logger.info("first")
+    # The listener is writing the first record. Logging does not wait for it.
+    assert stream.entered.wait(5)
+    logger.info("second")
+    logger.info("third")
+
+    stream.released.set()
+    logger.handlers[0].flush()
+    assert stream.getvalue() == "INFO first\nINFO second\nINFO third\n"
+    # The records queued while the stream was blocked were written at once.
+    assert stream.writes == 2
+
+
+def test_log_queue_overflow(queued_logger):
+    logger, stream = queued_logger
+
+    logger.info("first")
+    assert stream.entered.wait(5)
+    for i in range(5):
+        logger.info(f"record {i}")
+    assert logger.handlers[0].dropped == 3
+
+    stream.released.set()
+    logger.handlers[0].flush()
+    logger.info("last")
+    logger.handlers[0].flush()
+    assert stream.getvalue().splitlines() == [
+        "INFO first",
+        "INFO record 0",
+        "INFO record 1",
+        "WARNING Dropped 3 log records because the log queue was full",
+        "INFO last",
+    ]
+
+
+def test_log_queue_close_writes_pending_records(queued_logger):
+    logger, stream = queued_logger
+    logger.error("failure", exc_info=ValueError("bad"))
+
+    stream.released.set()
+    logger.handlers[0].close()
+    assert "ERROR failure\nValueError: bad\n" in stream.getvalue()
+
+
+def test_log_queue_disabled():
+    logger = logging.getLogger("azmlinfsrv_test.unqueued")
+    handler = logging.StreamHandler(io.StringIO())
+    logger.handlers = [handler]
+    try:
+        enable_log_queue(logger, 0)
+        assert logger.handlers == [handler]
+    finally:
+        logger.handlers = []
+
+
+def test_root_access_filter_deprecated():
+    """Ensure logging configs that still reference RootAccessFilter load, and that it lets every record through."""
+
+    logging.config.dictConfig(
+        {
+            "version": 1,
+            "disable_existing_loggers": False,
+            "loggers": {"azmlinfsrv_test.filtered": {"filters": ["RootAccessFilter"]}},
+            "filters": {"RootAccessFilter": {"()": "azureml_inference_server_http.log_config.RootAccessFilter"}},
+        }
+    )
+    logger = logging.getLogger("azmlinfsrv_test.filtered")
+    (log_filter,) = logger.filters
+    assert isinstance(log_filter, RootAccessFilter)
+    assert logger.filter(logging.makeLogRecord({"msg": "GET / HTTP/1.1"}))
@@ -0,0 +1,66 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import logging
+
+import pytest
+
+from azureml_inference_server_http.server.memory_tracker import MemoryTracker
+from .common import TestingApp, TestingClient
+
+
+@pytest.fixture()
+def tracker():
+    tracker = MemoryTracker(window=8, threshold_mb=1)
+    tracker.start()
+    try:
+        yield tracker
+    finally:
+        tracker.stop()
+
+
+def test_memory_tracker_track(tracker: MemoryTracker):
+    with tracker.track() as measurement:
+        data = bytearray(4 * 1024 * 1024)
+        del data
+
+    assert measurement.usage.traced_peak >= 4 * 1024 * 1024
+
+
+@pytest.mark.parametrize(
+    ("samples", "growing"),
+    [
+        # Steady growth of 1.5 MB over the window
+        ([i * 200 * 1024 for i in range(8)], True),
+        # Steady growth below the threshold
+        ([i * 1024 for i in range(8)], False),
+        # A spike that is released again
+        ([0, 0, 0, 5 * 1024 * 1024, 0, 0, 0, 0], False),
+    ],
+)
+def test_memory_tracker_record(tracker: MemoryTracker, samples, growing: bool):
+    results = [tracker.record(sample) for sample in samples]
+    assert results == [False] * 7 + [growing]
+
+
+def test_memory_tracker_logs_allocation_sites(tracker: MemoryTracker, caplog):
+    leak = []
+    with caplog.at_level(logging.WARNING, logger="azmlinfsrv.memory"):
+        for _ in range(8):
+            with tracker.track():
+                leak.append(bytearray(512 * 1024))
+
+    assert "may be a memory leak" in caplog.text
+    assert f"{__file__}:" in caplog.text
+
+
+def test_memory_tracker_routes(app: TestingApp, client: TestingClient, tracker: MemoryTracker, monkeypatch):
+    monkeypatch.setattr(app.user_script, "memory_tracker", tracker)
+
+    @app.set_user_run
+    def run(data):
+        return len(bytearray(1024 * 1024))
+
+    response = client.post_score({})
+    assert response.status_code == 200
+    assert app.last_run.memory.traced_peak >= 1024 * 1024
@@ -0,0 +1,183 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import os
+import pathlib
+import threading
+import time
+
+import flask
+from inference_schema import schema_util
+import pytest
+
+from azureml_inference_server_http.server import aml_blueprint
+from azureml_inference_server_http.server.model_watcher import ModelWatcher
+from .common import TestingClient, TestingUserScript
+
+
+@pytest.fixture()
+def model_dirs(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch, config):
+    for version in ("1", "2", "broken", "slow"):
+        (tmp_path / version).mkdir()
+        (tmp_path / version / "version.txt").write_text(version)
+
+    version_file = tmp_path / "current"
+    version_file.write_text(str(tmp_path / "1"))
+    warmup_file = tmp_path / "warmup.json"
+    warmup_file.write_text(json.dumps({"data": 1}))
+
+    config.model_version_file = str(version_file)
+    config.model_warmup_file = str(warmup_file)
+    monkeypatch.setattr(config, "azureml_model_dir", str(tmp_path / "1"))
+    monkeypatch.setenv("AZUREML_MODEL_DIR", str(tmp_path / "1"))
+    return tmp_path
+
+
+def test_model_watcher_swap(app: flask.Flask, client: TestingClient, model_dirs: pathlib.Path):
+    """Ensure a new model version is loaded, warmed up and then served."""
+
+    app.azml_blueprint.user_script = TestingUserScript("model_version.py")
+    app.azml_blueprint.setup()
+    watcher = ModelWatcher(60, app.azml_blueprint.user_script, app.azml_blueprint._swap_user_script)
+
+    assert not watcher.check()
+    assert client.post_score().json == "1"
+
+    (model_dirs / "current").write_text(str(model_dirs / "2"))
+    assert watcher.check()
+    assert client.post_score().json == "2"
+
+
+def test_model_watcher_failed_warmup(app: flask.Flask, client: TestingClient, model_dirs: pathlib.Path, config):
+    """Ensure the current model keeps serving when the new version fails the warm-up request."""
+
+    app.azml_blueprint.user_script = TestingUserScript("model_version.py")
+    app.azml_blueprint.setup()
+    watcher = ModelWatcher(60, app.azml_blueprint.user_script, app.azml_blueprint._swap_user_script)
+
+    (model_dirs / "current").write_text(str(model_dirs / "broken"))
+    assert not watcher.check()
+    assert client.post_score().json == "1"
+    assert config.azureml_model_dir == str(model_dirs / "1")
+
+
+def test_model_watcher_failed_schemas(app: flask.Flask, client: TestingClient, model_dirs: pathlib.Path):
+    """Ensure the current model keeps its schemas when the new version fails to load."""
+
+    app.azml_blueprint.user_script = TestingUserScript("model_version_schema.py")
+    app.azml_blueprint.setup()
+    watcher = ModelWatcher(60, app.azml_blueprint.user_script, app.azml_blueprint._swap_user_script)
+    schemas = schema_util.__functions_schema__["entry_module.run"]
+
+    (model_dirs / "current").write_text(str(model_dirs / "broken"))
+    assert not watcher.check()
+    assert schema_util.__functions_schema__["entry_module.run"] is schemas
+    assert client.post_score(json={"data": 1}).json == "1"
+
+    # The schemas of the new version replace them once it is served.
+    (model_dirs / "current").write_text(str(model_dirs / "2"))
+    assert watcher.check()
+    assert schema_util.__functions_schema__["entry_module.run"] is not schemas
+    assert schema_util.__functions_schema__["entry_module.run"] == schemas
+    assert client.post_score(json={"data": 1}).json == "2"
+
+
+def test_model_watcher_load_timeout(app: flask.Flask, client: TestingClient, model_dirs: pathlib.Path, config):
+    """Ensure a new version whose init() does not finish in time is given up on."""
+
+    app.azml_blueprint.user_script = TestingUserScript("model_version.py")
+    app.azml_blueprint.setup()
+    watcher = ModelWatcher(60, app.azml_blueprint.user_script, app.azml_blueprint._swap_user_script)
+
+    config.model_load_timeout = 0.1
+    (model_dirs / "current").write_text(str(model_dirs / "slow"))
+    assert not watcher.check()
+    assert client.post_score().json == "1"
+    assert os.environ["AZUREML_MODEL_DIR"] == str(model_dirs / "1")
+
+
+def test_model_watcher_holds_requests(app: flask.Flask, client: TestingClient, model_dirs: pathlib.Path):
+    """Ensure requests are not scored while the model directory points to the new version."""
+
+    app.azml_blueprint.user_script = TestingUserScript("model_version.py")
+    app.azml_blueprint.setup()
+    watcher = ModelWatcher(
+        60, app.azml_blueprint.user_script, app.azml_blueprint._swap_user_script, app.azml_blueprint.model_lock
+    )
+
+    # The init() of the slow version takes a second, during which the request waits. It is then scored by the current
+    # version, or by the new one if it was swapped in meanwhile.
+    (model_dirs / "current").write_text(str(model_dirs / "slow"))
+    loading = threading.Thread(target=watcher.check)
+    loading.start()
+    while os.environ["AZUREML_MODEL_DIR"] != str(model_dirs / "slow"):
+        time.sleep(0.01)
+    start = time.monotonic()
+    assert client.post_score().json in ("1", "slow")
+    assert time.monotonic() - start > 0.5
+    loading.join()
+    assert client.post_score().json == "slow"
+
+
+def test_model_watcher_serves_while_loading(app: flask.Flask, client: TestingClient, model_dirs: pathlib.Path):
+    """Ensure the current model keeps serving while an init() taking the model directory loads the new version."""
+
+    app.azml_blueprint.user_script = TestingUserScript("model_version_dir.py")
+    app.azml_blueprint.setup()
+    watcher = ModelWatcher(
+        60, app.azml_blueprint.user_script, app.azml_blueprint._swap_user_script, app.azml_blueprint.model_lock
+    )
+
+    # The slow version takes a second to load, during which requests are scored by the current version.
+    (model_dirs / "current").write_text(str(model_dirs / "slow"))
+    loading = threading.Thread(target=watcher.check)
+    loading.start()
+    time.sleep(0.1)
+    assert loading.is_alive()
+    assert client.post_score().json == "1"
+    assert os.environ["AZUREML_MODEL_DIR"] == str(model_dirs / "1")
+    loading.join()
+
+    assert client.post_score().json == "slow"
+    assert os.environ["AZUREML_MODEL_DIR"] == str(model_dirs / "slow")
+
+
+def test_model_watcher_abandoned_load(
+    app: flask.Flask, client: TestingClient, model_dirs: pathlib.Path, config, monkeypatch: pytest.MonkeyPatch
+):
+    """Ensure a load given up on does not replace the schemas of the current model when it ends."""
+
+    app.azml_blueprint.user_script = TestingUserScript("model_version_schema.py")
+    app.azml_blueprint.setup()
+    watcher = ModelWatcher(60, app.azml_blueprint.user_script, app.azml_blueprint._swap_user_script)
+    schemas = schema_util.__functions_schema__["entry_module.run"]
+
+    config.model_load_timeout = 0.1
+    monkeypatch.setenv("MODEL_IMPORT_DELAY_SECONDS", "0.5")
+    (model_dirs / "current").write_text(str(model_dirs / "2"))
+    assert not watcher.check()
+    assert schema_util.__functions_schema__["entry_module.run"] is schemas
+
+    # The next version is not loaded before the import given up on ends.
+    (model_dirs / "current").write_text(str(model_dirs / "1"))
+    assert not watcher.check()
+
+    watcher._abandoned_step.join()
+    assert schema_util.__functions_schema__["entry_module.run"] is schemas
+    assert client.post_score(json={"data": 1}).json == "1"
+
+
+def test_model_watcher_preload(app: flask.Flask, model_dirs: pathlib.Path, config, monkeypatch: pytest.MonkeyPatch):
+    """Ensure each worker watches for new model versions when the app is preloaded in the gunicorn master."""
+
+    started = []
+    monkeypatch.setenv("WORKER_PRELOAD", "true")
+    monkeypatch.setattr(aml_blueprint, "_run_in_workers", started.append)
+    config.model_watch_interval = 60
+
+    app.azml_blueprint._init_model_watcher()
+    watcher = app.azml_blueprint.model_watcher
+    assert started == [watcher.start]
+    assert not watcher._thread.is_alive()
+    watcher.stop()
@@ -0,0 +1,111 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+
+import pytest
+
+from azureml_inference_server_http.server import rate_limiter
+from azureml_inference_server_http.server.rate_limiter import RateLimiter
+from .common import TestingApp, TestingClient
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_rate_limiter_bucket(clock):
+    limiter = RateLimiter(rate=2, burst=3, table_size=16)
+
+    # A new client starts with a full bucket.
+    assert [limiter.acquire("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("a") == pytest.approx(0.5)
+    # Clients have their own buckets.
+    assert limiter.acquire("b") == 0
+
+    # Tokens are added at the rate, up to the burst.
+    clock[0] += 0.5
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == pytest.approx(0.5)
+    clock[0] += 60
+    assert [limiter.acquire("a") for _ in range(4)] == [0, 0, 0, pytest.approx(0.5)]
+
+
+def test_rate_limiter_table_full(clock):
+    limiter = RateLimiter(rate=1, burst=1, table_size=1)
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") > 0
+
+    # The client seen the longest ago is forgotten to make room for a new one.
+    clock[0] += 0.1
+    assert limiter.acquire("b") == 0
+    assert limiter.acquire("a") == 0
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="The table is shared with forked processes")
+def test_rate_limiter_shared(clock):
+    limiter = RateLimiter(rate=1, burst=2, table_size=16)
+
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if limiter.acquire("a") == 0 and limiter.acquire("a") == 0 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+
+    # The tokens taken by the other process count against the budget of the client.
+    assert limiter.acquire("a") > 0
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="The table is shared with forked processes")
+def test_rate_limiter_holder_died(clock):
+    limiter = RateLimiter(rate=1, burst=1, table_size=16)
+
+    # A worker killed while it holds the lock of the table does not stop the others from limiting requests.
+    pid = os.fork()
+    if pid == 0:
+        limiter._lock.__enter__()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") > 0
+
+
+def test_rate_limiter_score(app: TestingApp, client: TestingClient, config):
+    @app.set_user_run
+    def run(data):
+        return data
+
+    config.rate_limit_header = "x-client-id"
+    config.rate_limit_key_length = 3
+    app.azml_blueprint.rate_limiter = RateLimiter(rate=0.5, burst=1, table_size=16)
+
+    assert client.post_score({"a": 1}, headers={"x-client-id": "abc-1"}).status_code == 200
+
+    # The limit applies before the input is parsed, and to all the keys that share the same prefix.
+    response = client.post_score(data=b"{invalid", headers={"x-client-id": "abc-2"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    assert response.json == {"message": "Too many requests. Retry later."}
+
+    assert client.post_score({"a": 1}, headers={"x-client-id": "xyz"}).status_code == 200
+    # Other routes are not rate limited.
+    assert client.get_health(headers={"x-client-id": "abc"}).status_code == 200
+
+
+def test_rate_limiter_score_without_key(app: TestingApp, client: TestingClient, config):
+    @app.set_user_run
+    def run(data):
+        return data
+
+    config.rate_limit_header = "x-client-id"
+    app.azml_blueprint.rate_limiter = RateLimiter(rate=0.5, burst=1, table_size=16)
+
+    # Requests without a key are limited by the address of the client.
+    assert client.post_score({"a": 1}, environ_base={"REMOTE_ADDR": "10.0.0.1"}).status_code == 200
+    assert client.post_score({"a": 1}, environ_base={"REMOTE_ADDR": "10.0.0.1"}).status_code == 429
+    assert client.post_score({"a": 1}, environ_base={"REMOTE_ADDR": "10.0.0.2"}).status_code == 200
+    assert client.post_score({"a": 1}, headers={"x-client-id": "abc"}).status_code == 200
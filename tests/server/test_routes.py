@@ -1,16 +1,25 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+from concurrent.futures import ThreadPoolExecutor
+import json
 import logging
+import re
+import sys
+import threading
+import time
+import unittest.mock
 
 import flask
 from inference_schema.parameter_types.standard_py_parameter_type import StandardPythonParameterType
 from inference_schema.schema_decorators import input_schema
 import pytest
 
+from azureml_inference_server_http.api.aml_request import cacheable
 from azureml_inference_server_http.api.aml_response import AMLResponse
 from azureml_inference_server_http.server.routes import HEADER_LIMIT
-from .common import TestingClient
+from azureml_inference_server_http.server.utils import LogThrottle
+from .common import TestingApp, TestingClient
 from .utils import assert_valid_guid
 
 
@@ -48,6 +57,14 @@ def test_routes_request_id(app: flask.Flask, client: TestingClient, to_error: bo
     assert response.headers["x-ms-request-id"] == request_id
 
 
+def test_routes_request_id_not_generated(client: TestingClient, monkeypatch):
+    """Ensure no request id is generated when the client provides one."""
+
+    monkeypatch.setattr("uuid.uuid4", lambda: pytest.fail("A request id was generated"))
+    response = client.get_score(headers={"x-request-id": "1234"})
+    assert response.headers["x-request-id"] == "1234"
+
+
 def test_routes_request_id_limit(app: flask.Flask, client: TestingClient):
     """Ensure we error when the request id is too long."""
 
@@ -65,9 +82,10 @@ def test_routes_request_id_limit(app: flask.Flask, client: TestingClient):
     assert response.json == {"message": f"x-request-id must not exceed {HEADER_LIMIT} characters"}
 
 
-def test_routes_x_ms_request_id(client: TestingClient, caplog):
+def test_routes_x_ms_request_id(app: TestingApp, client: TestingClient, caplog):
     """Ensure we log warning when the request has x-ms-request-id header"""
 
+    app.azml_blueprint.log_throttle = LogThrottle(60)
     with caplog.at_level(logging.WARNING, logger="azmlinfsrv"):
         response = client.get_score(headers={"x-ms-request-id": "1234"})
         assert response.status_code == 200
@@ -81,6 +99,66 @@ def test_routes_x_ms_request_id(client: TestingClient, caplog):
     )
     assert info_tuple in caplog.record_tuples
 
+    # The warning is not repeated for every request in the throttling window.
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="azmlinfsrv"):
+        client.get_score(headers={"x-ms-request-id": "1234"})
+    assert info_tuple not in caplog.record_tuples
+
+
+def _is_server_log(record: logging.LogRecord, level: int) -> bool:
+    # The exporters of other tests may still be logging from their threads, so only the logs of the server are counted.
+    return record.levelno == level and record.name.startswith("azmlinfsrv")
+
+
+def test_routes_exception_throttled(app: TestingApp, client: TestingClient, caplog, monkeypatch):
+    @app.set_user_run
+    def run(data):
+        raise ValueError(f"bad data {data}")
+
+    exported = []
+    monkeypatch.setattr(app.azml_blueprint, "send_exception_to_app_insights", lambda *args: exported.append(args))
+    suppressed_log = unittest.mock.Mock()
+    monkeypatch.setattr(app.azml_blueprint.appinsights_client, "send_suppressed_log", suppressed_log)
+    app.azml_blueprint.log_throttle = LogThrottle(0.5, app.azml_blueprint._report_suppressed)
+    with caplog.at_level(logging.ERROR, logger="azmlinfsrv"):
+        for i in range(3):
+            assert client.post_score(i, headers={"x-request-id": str(i)}).status_code == 500
+    errors = [record.getMessage() for record in caplog.records if _is_server_log(record, logging.ERROR)]
+    assert len(errors) == 1
+    assert "ValueError: bad data 0" in errors[0]
+    # Only the first exception is sent to App Insights, with the id of its request.
+    assert [request_id for request_id, _ in exported] == ["0"]
+
+    # The suppressed occurrences are reported when the window expires, in the logs and to App Insights.
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="azmlinfsrv"):
+        time.sleep(1)
+    warnings = [record.getMessage() for record in caplog.records if _is_server_log(record, logging.WARNING)]
+    assert len(warnings) == 1
+    assert warnings[0].startswith("The exception ValueError occurred 2 more times in the last")
+    suppressed_log.assert_called_once_with(warnings[0], 2)
+
+    caplog.clear()
+    with caplog.at_level(logging.ERROR, logger="azmlinfsrv"):
+        assert client.post_score(3).status_code == 500
+    errors = [record.getMessage() for record in caplog.records if _is_server_log(record, logging.ERROR)]
+    assert len(errors) == 1
+    assert "ValueError: bad data 3" in errors[0]
+    assert "more times" not in errors[0]
+
+
+def test_routes_exception_not_throttled(app: TestingApp, client: TestingClient, caplog):
+    @app.set_user_run
+    def run(data):
+        raise ValueError(f"bad data {data}")
+
+    # Every exception is logged by default.
+    with caplog.at_level(logging.ERROR, logger="azmlinfsrv"):
+        for i in range(3):
+            assert client.post_score(i).status_code == 500
+    assert len([record for record in caplog.records if _is_server_log(record, logging.ERROR)]) == 3
+
 
 @pytest.mark.parametrize(("to_error"), [True, False])
 def test_routes_client_request_id(app: flask.Flask, client: TestingClient, to_error: bool):
@@ -274,6 +352,118 @@ def test_routes_scoring_cors_enabled_2(app_cors: flask.Flask):
     assert "Access-Control-Allow-Origin" not in response.headers
 
 
+def test_routes_scoring_cors_reloaded(app_cors: flask.Flask, config):
+    """Verifies that reloaded CORS origins are applied without recreating the app"""
+
+    config.cors_origins = "www.azure.com"
+    app_cors.azml_blueprint._on_config_reload({"cors_origins": config.cors_origins})
+
+    response = app_cors.test_client().options_score(headers={"Origin": "www.azure.com"})
+    assert response.headers["Access-Control-Allow-Origin"] == "www.azure.com"
+
+    response = app_cors.test_client().options_score(headers={"Origin": "www.microsoft.com"})
+    assert "Access-Control-Allow-Origin" not in response.headers
+
+
+@pytest.mark.parametrize("lean_mode", [True, False])
+def test_routes_scoring_lean_mode(app: TestingApp, client: TestingClient, config, caplog, lean_mode: bool):
+    @app.set_user_run
+    def run(data):
+        return AMLResponse("ok", 200)
+
+    config.lean_mode = lean_mode
+    with caplog.at_level(logging.INFO, logger="azmlinfsrv"):
+        response = client.post_score({"a": 1})
+    assert response.status_code == 200
+    assert response.data == b"ok"
+    assert ("run() output is HTTP Response" in caplog.messages) is not lean_mode
+
+
+def test_routes_server_version(app: TestingApp, client: TestingClient, monkeypatch):
+    monkeypatch.setattr(app.azml_blueprint, "server_version", "azmlinfsrv/1.0")
+    assert client.get_score().headers["x-ms-server-version"] == "azmlinfsrv/1.0"
+
+    monkeypatch.setattr(app.azml_blueprint, "server_version", "")
+    assert "x-ms-server-version" not in client.get_score().headers
+
+
+def test_routes_scoring_cacheable(app: TestingApp, client: TestingClient, config):
+    """Verifies that GET responses of a @cacheable run() carry an ETag and are answered with 304 when unchanged"""
+
+    @app.set_user_run
+    @cacheable
+    @input_schema("id", StandardPythonParameterType(1))
+    def run(id):
+        return {"id": id}
+
+    config.cache_control = "public, max-age=300"
+    response = client.get_score({"id": 1})
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "public, max-age=300"
+    assert response.headers["Vary"] == "Accept"
+    etag = response.headers["ETag"]
+    assert not etag.startswith("W/")
+
+    response = client.get_score({"id": 1}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+    response = client.get_score({"id": 2}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json == {"id": 2}
+
+    # Only the responses to GET requests are cacheable.
+    response = client.post_score({"id": 1}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    assert "Cache-Control" not in response.headers
+
+
+def test_routes_scoring_cacheable_cache_control(app: TestingApp, client: TestingClient):
+    """Verifies that the Cache-Control given to @cacheable is used, and that errors and cookies are not cacheable"""
+
+    @app.set_user_run
+    @cacheable(cache_control="private, max-age=10")
+    def run(data):
+        if "missing" in data:
+            return AMLResponse("not found", 404)
+        if "session" in data:
+            response = AMLResponse("found", 200)
+            response.set_cookie("session", "secret")
+            return response
+        return data
+
+    response = client.get_score({"id": 1})
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, max-age=10"
+
+    response = client.get_score({"id": "missing"})
+    assert response.status_code == 404
+    assert "ETag" not in response.headers
+    assert "Cache-Control" not in response.headers
+
+    # Responses that set cookies are not cacheable either.
+    response = client.get_score({"id": "session"})
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    assert "Cache-Control" not in response.headers
+
+
+def test_routes_scoring_not_cacheable(app: TestingApp, client: TestingClient):
+    """Verifies that GET responses are not cacheable unless run() is decorated with @cacheable"""
+
+    @app.set_user_run
+    def run(data):
+        return data
+
+    response = client.get_score({"id": 1})
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    assert "Cache-Control" not in response.headers
+
+
 # Errors
 
 
@@ -292,3 +482,130 @@ def test_routes_405(client: TestingClient):
     response = client.delete("/")
     assert response.status_code == 405
     assert response.json == {"message": "The method is not allowed for the requested URL."}
+
+
+def test_routes_scoring_coalesced(app: flask.Flask, config):
+    """Ensure concurrent identical requests share one run() call and the shared responses are marked."""
+
+    config.single_flight_enabled = True
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    @app.set_user_run
+    def run(data):
+        calls.append(data)
+        started.set()
+        release.wait()
+        return data
+
+    def score():
+        return app.test_client().post_score({"num": 2})
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(score)
+        started.wait()
+        second = executor.submit(score)
+        time.sleep(0.1)
+        release.set()
+
+    responses = [first.result(), second.result()]
+    assert [response.json for response in responses] == ['{"num": 2}', '{"num": 2}']
+    assert len(calls) == 1
+    assert "x-ms-run-coalesced" not in responses[0].headers
+    assert responses[1].headers["x-ms-run-coalesced"] == "true"
+
+
+def test_routes_scoring_coalesced_error(app: flask.Flask, config, monkeypatch):
+    """Ensure each coalesced request fails with an exception of its own when the shared run() call fails."""
+
+    config.single_flight_enabled = True
+    started, release = threading.Event(), threading.Event()
+    errors = []
+    monkeypatch.setattr(app.azml_blueprint, "log_exception", lambda *args: errors.append(sys.exc_info()[1]))
+
+    @app.set_user_run
+    def run(data):
+        started.set()
+        release.wait()
+        raise ValueError("boom")
+
+    def score():
+        return app.test_client().post_score({"num": 2})
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(score)
+        started.wait()
+        second = executor.submit(score)
+        time.sleep(0.1)
+        release.set()
+
+    assert [first.result().status_code, second.result().status_code] == [500, 500]
+    # The request that waited for the call raises a new exception, caused by the exception of the call.
+    leader_error, follower_error = sorted(errors, key=lambda error: error.__cause__ in errors)
+    assert follower_error.__cause__ is leader_error
+    assert isinstance(leader_error.user_ex, ValueError)
+    assert follower_error.user_ex is leader_error.user_ex
+
+
+def test_routes_single_flight_warning(app: TestingApp, config, caplog):
+    config.single_flight_enabled = True
+    app.azml_blueprint._init_single_flight()
+    assert "Coalesced requests run in threads of the worker" in caplog.text
+
+    caplog.clear()
+    config.isolated_scoring_enabled = True
+    app.azml_blueprint._init_single_flight()
+    assert "Coalesced requests" not in caplog.text
+
+
+def test_routes_access_log(app: TestingApp, client: TestingClient, caplog):
+    with caplog.at_level(logging.INFO, logger="azmlinfsrv.access"):
+        client.get_score()
+        # Health probes are not logged.
+        client.get("/")
+        client.get("/v2/health/live")
+        # Requests that match no route, or not with their method, are logged.
+        client.get("/missing")
+        client.delete("/score")
+
+    access_records = [record for record in caplog.records if record.name == "azmlinfsrv.access"]
+    assert len(access_records) == 3
+    assert re.fullmatch(r"GET /score 200 \d+\.\d{3}ms \d+", access_records[0].getMessage())
+    assert access_records[1].getMessage().startswith("GET /missing 404 ")
+    assert access_records[2].getMessage().startswith("DELETE /score 405 ")
+
+
+def test_routes_access_log_json(app: TestingApp, client: TestingClient, config, caplog):
+    config.access_log_format = "json"
+    with caplog.at_level(logging.INFO, logger="azmlinfsrv.access"):
+        client.get_score({"a": "1"}, headers={"x-ms-client-request-id": "B"})
+
+    (record,) = [record for record in caplog.records if record.name == "azmlinfsrv.access"]
+    entry = json.loads(record.getMessage())
+    assert entry["method"] == "GET"
+    assert entry["path"] == "/score?a=1"
+    assert entry["api"] == "/score"
+    assert entry["status"] == 200
+    assert entry["duration_ms"] >= 0
+    assert entry["client_request_id"] == "B"
+    assert entry["request_id"]
+
+
+def test_routes_access_log_sampling(app: TestingApp, client: TestingClient, config, caplog):
+    @app.set_user_run
+    def run(data):
+        if data == '"error"':
+            raise ValueError("bad data")
+        if data == '"slow"':
+            time.sleep(0.3)
+        return data
+
+    config.access_log_sample_rate = 0
+    config.access_log_slow_request_ms = 200
+    with caplog.at_level(logging.INFO, logger="azmlinfsrv.access"):
+        for data in ("fast", "error", "slow"):
+            client.post_score(data)
+
+    # Only the failed and the slow requests are logged.
+    statuses = [record.getMessage().split()[2] for record in caplog.records if record.name == "azmlinfsrv.access"]
+    assert statuses == ["500", "200"]
@@ -1,6 +1,7 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import io
 import json
 import logging
 import os
@@ -11,8 +12,12 @@ import time
 import unittest.mock
 
 import flask
+from inference_schema.parameter_types.numpy_parameter_type import NumpyParameterType
+from inference_schema.parameter_types.pandas_parameter_type import PandasParameterType
 from inference_schema.parameter_types.standard_py_parameter_type import StandardPythonParameterType
 from inference_schema.schema_decorators import input_schema
+import numpy as np
+import pandas as pd
 import pytest
 
 from azureml_inference_server_http.api.aml_request import rawhttp
@@ -136,6 +141,17 @@ def test_user_script_user_import(app: flask.Flask, client: TestingClient, config
 # init()
 
 
+def test_user_script_init_model_dir(app: flask.Flask, client: TestingClient, tmp_path: pathlib.Path, config):
+    """Ensure an init() taking a model_dir argument is passed the model directory."""
+
+    (tmp_path / "version.txt").write_text("1")
+    config.azureml_model_dir = str(tmp_path)
+    app.azml_blueprint.user_script = app.user_script = TestingUserScript("model_version_dir.py")
+    app.azml_blueprint.setup()
+
+    assert client.post_score().json == "1"
+
+
 @pytest.mark.xfail(reason="It throws SystemExit today. We should propagate the actual exception.")
 def test_user_script_init_exception(app: flask.Flask):
     @app.set_user_init
@@ -519,6 +535,107 @@ def test_user_script_input_schema_default_parameter(app: flask.Flask, client: Te
     assert response.json == [1, 10, "blue"]
 
 
+@pytest.mark.parametrize("orient", ["split", "columns"])
+def test_user_script_input_schema_pandas(app: flask.Flask, client: TestingClient, orient: str):
+    """DataFrames built from columnar JSON match the ones inference-schema builds."""
+
+    sample = pd.DataFrame({"x": [1.5], "n": np.array([1], dtype=np.int32), "s": ["a"]})
+    parameter_type = PandasParameterType(sample, orient=orient)
+
+    @app.set_user_run
+    @input_schema("df", parameter_type)
+    def run(df):
+        return df.to_dict(orient="list")
+
+    df = pd.DataFrame({"x": [0.5, 2.0, 3.25], "n": [1, 2, 3], "s": ["a", "b", "c"]}, index=[3, 4, 5])
+    input_data = {"df": json.loads(df.to_json(orient=orient))}
+    response = client.post_score(input_data)
+    assert response.status_code == 200
+    assert response.json == {"x": [0.5, 2.0, 3.25], "n": [1, 2, 3], "s": ["a", "b", "c"]}
+
+    expected = parameter_type.deserialize_input(input_data["df"])
+    pd.testing.assert_frame_equal(app.last_run.input["df"], expected, check_like=True)
+
+
+@pytest.mark.parametrize("orient", ["split", "columns"])
+@pytest.mark.filterwarnings("ignore:apply_column_names is a deprecated parameter:DeprecationWarning")
+def test_user_script_input_schema_pandas_column_names(app: flask.Flask, client: TestingClient, orient: str):
+    """The column names and types of the sample are applied to the input, like inference-schema does."""
+
+    sample = pd.DataFrame({"x": [1.5], "n": np.array([1], dtype=np.int32)})
+    parameter_type = PandasParameterType(sample, apply_column_names=True, orient=orient)
+
+    @app.set_user_run
+    @input_schema("df", parameter_type)
+    def run(df):
+        return df.to_dict(orient="list")
+
+    df = pd.DataFrame({"a": [0.5, 2.0], "b": [1, 2]})
+    input_data = {"df": json.loads(df.to_json(orient=orient))}
+    response = client.post_score(input_data)
+    assert response.status_code == 200
+    assert response.json == {"x": [0.5, 2.0], "n": [1, 2]}
+
+    expected = parameter_type.deserialize_input(input_data["df"])
+    pd.testing.assert_frame_equal(app.last_run.input["df"], expected)
+
+
+def test_user_script_input_schema_pandas_shape(app: flask.Flask, client: TestingClient):
+    @app.set_user_run
+    @input_schema("df", PandasParameterType(pd.DataFrame({"x": [1.5], "y": [1.5]}), orient="split"))
+    def run(df):
+        pass
+
+    response = client.post_score({"df": {"columns": ["x"], "data": [[1.0]]}})
+    assert response.status_code == 400
+    assert response.json == {
+        "message": (
+            "Invalid value for the 'df' parameter: "
+            "Invalid input data frame: data frame has size 1 on dimension #1, while expected value is 2"
+        )
+    }
+
+
+def test_user_script_input_schema_numpy(app: flask.Flask, client: TestingClient):
+    @app.set_user_run
+    @input_schema("data", NumpyParameterType(np.zeros((1, 2), dtype=np.float32)))
+    def run(data):
+        return data.tolist()
+
+    response = client.post_score({"data": [[1, 2], [3, 4]]})
+    assert response.status_code == 200
+    assert response.json == [[1.0, 2.0], [3.0, 4.0]]
+    assert app.last_run.input["data"].dtype == np.float32
+
+    response = client.post_score({"data": [[1, 2, 3]]})
+    assert response.status_code == 400
+    assert response.json == {
+        "message": (
+            "Invalid value for the 'data' parameter: "
+            "Invalid input array: array has size 3 on dimension #1, while expected value is 2"
+        )
+    }
+
+
+def test_user_script_input_schema_npy(app: flask.Flask, client: TestingClient):
+    """A .npy body is passed to the first parameter."""
+
+    @app.set_user_run
+    @input_schema("data", NumpyParameterType(np.zeros((1, 2), dtype=np.float32)))
+    def run(data, scale=2):
+        return (data * scale).tolist()
+
+    buffer = io.BytesIO()
+    np.save(buffer, np.array([[1, 2], [3, 4]], dtype=np.float32))
+    response = client.post_score(data=buffer.getvalue(), headers={"content-type": "application/x-npy"})
+    assert response.status_code == 200
+    assert response.json == [[2.0, 4.0], [6.0, 8.0]]
+
+    response = client.post_score(data=b"not an array", headers={"content-type": "application/x-npy"})
+    assert response.status_code == 400
+    assert response.json["message"].startswith("POST body could not be decoded as a .npy array")
+
+
 # run() Exceptions
 
 
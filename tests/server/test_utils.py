@@ -1,12 +1,25 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+from concurrent.futures import ThreadPoolExecutor
 import os
 import pathlib
+import signal
+import threading
+import time
 
 import pytest
 
-from azureml_inference_server_http.server.utils import walk_path
+from azureml_inference_server_http.server import utils
+from azureml_inference_server_http.server.utils import (
+    CoalescedError,
+    exception_key,
+    get_rss,
+    LogThrottle,
+    SharedLock,
+    SingleFlight,
+    walk_path,
+)
 
 
 def test_utils_walk_path(tmp_path: pathlib.Path):
@@ -42,3 +55,164 @@ def test_utils_walk_path(tmp_path: pathlib.Path):
 
     with pytest.raises(StopIteration):
         next(generator)
+
+
+def test_utils_single_flight():
+    single_flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        leader = executor.submit(single_flight.do, "key", fn)
+        started.wait()
+        followers = [executor.submit(single_flight.do, "key", fn) for _ in range(2)]
+        # Give the followers a chance to join the running call
+        time.sleep(0.1)
+        release.set()
+
+    assert leader.result() == ("result", False)
+    assert [follower.result() for follower in followers] == [("result", True), ("result", True)]
+    assert len(calls) == 1
+
+    # The key is released once the call is done
+    assert single_flight.do("key", lambda: "again") == ("again", False)
+
+
+def test_utils_single_flight_error():
+    single_flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def fn():
+        started.set()
+        release.wait()
+        raise ValueError("boom")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(single_flight.do, "key", fn)
+        started.wait()
+        follower = executor.submit(single_flight.do, "key", fn, 5)
+        time.sleep(0.1)
+        release.set()
+
+    with pytest.raises(ValueError) as leader_error:
+        leader.result()
+    # The follower gets an exception of its own, caused by the exception of the leader.
+    with pytest.raises(CoalescedError) as follower_error:
+        follower.result()
+    assert follower_error.value.__cause__ is leader_error.value
+
+
+def test_utils_shared_lock():
+    lock = SharedLock()
+    events = []
+
+    def hold(mode: str):
+        with lock.exclusive() if mode == "exclusive" else lock.shared():
+            events.append(mode)
+
+    # Shared holders don't wait for each other, but the exclusive holder waits for them.
+    with lock.shared(), lock.shared():
+        thread = threading.Thread(target=hold, args=("exclusive",))
+        thread.start()
+        time.sleep(0.1)
+        events.append("shared")
+    thread.join()
+    assert events == ["shared", "exclusive"]
+
+    # Shared holders wait for the exclusive holder.
+    events.clear()
+    with lock.exclusive():
+        thread = threading.Thread(target=hold, args=("shared",))
+        thread.start()
+        time.sleep(0.1)
+        events.append("exclusive")
+    thread.join()
+    assert events == ["exclusive", "shared"]
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="/proc is not available")
+def test_utils_get_rss():
+    assert get_rss() > 0
+
+
+def test_utils_log_throttle(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    throttle = LogThrottle(10)
+
+    assert throttle.admit("a") == 0
+    assert throttle.admit("a") is None
+    assert throttle.admit("a") is None
+    # Events are throttled independently.
+    assert throttle.admit("b") == 0
+
+    # After the window, the next occurrence is logged with the number that were suppressed.
+    now = 111.0
+    assert throttle.admit("a") == 2
+    assert throttle.admit("a") is None
+
+    assert all(LogThrottle(0).admit("a") == 0 for _ in range(3))
+    assert all(LogThrottle(None).admit("a") == 0 for _ in range(3))
+
+
+def test_utils_log_throttle_report():
+    reported = []
+    throttle = LogThrottle(0.1, lambda description, count: reported.append((description, count)))
+
+    assert throttle.admit("a", "Event A") == 0
+    assert throttle.admit("a", "Event A") is None
+    assert throttle.admit("a", "Event A") is None
+    # Events without suppressed occurrences are not reported.
+    assert throttle.admit("b", "Event B") == 0
+
+    time.sleep(0.5)
+    assert reported == [("Event A", 2)]
+    # The reported occurrences are not counted again.
+    assert throttle.admit("a", "Event A") == 0
+
+
+def _raise(message):
+    raise ValueError(message)
+
+
+def test_utils_exception_key():
+    keys = []
+    for message in ("first", "second", "first"):
+        try:
+            _raise(message)
+        except ValueError as ex:
+            keys.append(exception_key(ex))
+
+    # Exceptions raised from the same place are identical, whatever their message.
+    assert keys[0] == keys[1] == keys[2]
+
+    try:
+        raise ValueError("elsewhere")
+    except ValueError as ex:
+        assert exception_key(ex) != keys[0]
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Timeouts rely on SIGALRM, which Windows does not have")
+def test_utils_timeout_alarm_handler():
+    previous = signal.getsignal(signal.SIGALRM)
+    try:
+        with pytest.raises(TimeoutError):
+            with utils.timeout(10):
+                time.sleep(1)
+        # The previous handler is restored...
+        assert signal.getsignal(signal.SIGALRM) is previous
+
+        # ...unless the handler is kept installed.
+        utils.install_alarm_handler()
+        with pytest.raises(TimeoutError):
+            with utils.timeout(10):
+                time.sleep(1)
+        assert signal.getsignal(signal.SIGALRM) is utils._alarm_handler
+    finally:
+        signal.signal(signal.SIGALRM, previous)
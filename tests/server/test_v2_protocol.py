@@ -0,0 +1,162 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+
+from inference_schema.parameter_types.numpy_parameter_type import NumpyParameterType
+from inference_schema.parameter_types.standard_py_parameter_type import StandardPythonParameterType
+from inference_schema.schema_decorators import input_schema, output_schema
+import pytest
+
+from azureml_inference_server_http.server import v2_protocol
+from azureml_inference_server_http.server.input_parsers import BadInput
+from .common import TestingApp, TestingClient
+
+np = pytest.importorskip("numpy")
+
+MODEL_NAME = "my-model"
+
+
+@pytest.fixture(autouse=True)
+def model_name(config):
+    config.service_name = MODEL_NAME
+    config.service_version = "3"
+
+
+def test_v2_health(client: TestingClient):
+    assert client.get("/v2/health/live").status_code == 200
+    assert client.get("/v2/health/ready").status_code == 200
+    assert client.get(f"/v2/models/{MODEL_NAME}/ready").status_code == 200
+    assert client.get(f"/v2/models/{MODEL_NAME}/versions/3/ready").status_code == 200
+
+    response = client.get(f"/v2/models/{MODEL_NAME}/versions/2/ready")
+    assert response.status_code == 404
+    assert response.json == {"error": f"Model {MODEL_NAME} (version 2) is not served by this server."}
+
+
+def test_v2_server_metadata(client: TestingClient):
+    response = client.get("/v2")
+    assert response.status_code == 200
+    assert response.json["name"] == "azureml-inference-server-http"
+    assert response.json["extensions"] == ["binary_tensor_data"]
+
+
+def test_v2_model_metadata(client: TestingClient):
+    response = client.get(f"/v2/models/{MODEL_NAME}")
+    assert response.status_code == 200
+    assert response.json == {"name": MODEL_NAME, "versions": ["3"], "platform": "azureml", "inputs": [], "outputs": []}
+
+    assert client.get(f"/v2/models/{MODEL_NAME}/versions/3").status_code == 200
+    assert client.get("/v2/models/other").status_code == 404
+
+
+def test_v2_get_model_metadata_from_schema():
+    @input_schema("data", NumpyParameterType(np.zeros((1, 3), dtype=np.float32)))
+    @input_schema("scale", StandardPythonParameterType(1))
+    @output_schema(NumpyParameterType(np.zeros((1,), dtype=np.int64)))
+    def run(data, scale):
+        pass
+
+    metadata = v2_protocol.get_model_metadata(MODEL_NAME, "3", run)
+    assert metadata["inputs"] == [
+        {"name": "data", "datatype": "FP32", "shape": [-1, 3]},
+        {"name": "scale", "datatype": "INT64", "shape": []},
+    ]
+    assert metadata["outputs"] == [{"name": "output0", "datatype": "INT64", "shape": [-1]}]
+
+
+def test_v2_infer_json(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    @input_schema("data", NumpyParameterType(np.zeros((1, 3), dtype=np.float32)))
+    def run(data):
+        assert isinstance(data, np.ndarray)
+        return data.sum(axis=1)
+
+    infer_request = {
+        "id": "42",
+        "inputs": [{"name": "data", "datatype": "FP32", "shape": [2, 3], "data": [1, 2, 3, 4, 5, 6]}],
+        "outputs": [{"name": "sums"}],
+    }
+    response = client.post(f"/v2/models/{MODEL_NAME}/infer", json=infer_request)
+
+    assert response.status_code == 200
+    assert response.json == {
+        "id": "42",
+        "model_name": MODEL_NAME,
+        "model_version": "3",
+        "outputs": [{"name": "sums", "datatype": "FP32", "shape": [2], "data": [6.0, 15.0]}],
+    }
+    assert "x-ms-run-fn-exec-ms" in response.headers
+
+
+def test_v2_infer_binary(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    @input_schema("data", NumpyParameterType(np.zeros((1, 2), dtype=np.int32)))
+    @input_schema("labels", NumpyParameterType(np.array(["a"])))
+    def run(data, labels):
+        return {"doubled": data * 2, "labels": labels}
+
+    data = np.array([[1, 2], [3, 4]], dtype=np.int32)
+    labels = b"".join(len(label).to_bytes(4, "little") + label for label in (b"cat", b"dog"))
+    header = json.dumps(
+        {
+            "inputs": [
+                {"name": "data", "datatype": "INT32", "shape": [2, 2], "parameters": {"binary_data_size": 16}},
+                {"name": "labels", "datatype": "BYTES", "shape": [2], "parameters": {"binary_data_size": len(labels)}},
+            ],
+            "outputs": [{"name": "doubled", "parameters": {"binary_data": True}}, {"name": "labels"}],
+        }
+    ).encode("utf-8")
+
+    response = client.post(
+        f"/v2/models/{MODEL_NAME}/infer",
+        data=header + data.tobytes() + labels,
+        headers={"Inference-Header-Content-Length": str(len(header))},
+        content_type="application/octet-stream",
+    )
+
+    assert response.status_code == 200
+    header_length = int(response.headers["Inference-Header-Content-Length"])
+    infer_response = json.loads(response.data[:header_length])
+    doubled, labels_output = infer_response["outputs"]
+    assert doubled == {"name": "doubled", "datatype": "INT32", "shape": [2, 2], "parameters": {"binary_data_size": 16}}
+    assert labels_output == {"name": "labels", "datatype": "BYTES", "shape": [2], "data": ["cat", "dog"]}
+
+    result = np.frombuffer(response.data[header_length:], dtype="<i4").reshape(2, 2)
+    np.testing.assert_array_equal(result, data * 2)
+
+
+def test_v2_infer_errors(app: TestingApp, client: TestingClient):
+    @app.set_user_run
+    def run(data):
+        return data
+
+    infer_request = {"inputs": [{"name": "data", "datatype": "FP32", "shape": [1], "data": [1]}]}
+    response = client.post(f"/v2/models/{MODEL_NAME}/infer", json=infer_request)
+    assert response.status_code == 415
+    assert "error" in response.json
+
+    infer_request = {"inputs": [{"name": "data", "datatype": "FP32", "shape": [2], "data": [1]}]}
+    response = client.post(f"/v2/models/{MODEL_NAME}/infer", json=infer_request)
+    assert response.status_code == 400
+    assert response.json["error"].startswith("Invalid data for input data:")
+
+    response = client.post("/v2/models/other/infer", json=infer_request)
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize(
+    ("body", "header_length"),
+    [
+        (b"not json", None),
+        (b'{"inputs": []}', None),
+        (b'{"inputs": [{"name": "x"}]}', None),
+        (b'{"inputs": [{"name": "x", "datatype": "COMPLEX", "shape": [1]}]}', None),
+        (b'{"inputs": []}', 99),
+        # The binary data is missing.
+        (b'{"inputs": [{"name": "x", "datatype": "FP32", "shape": [1], "parameters": {"binary_data_size": 4}}]}', 100),
+    ],
+)
+def test_v2_parse_infer_request_invalid(body: bytes, header_length):
+    with pytest.raises(BadInput):
+        v2_protocol.parse_infer_request(body, header_length)
@@ -0,0 +1,62 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import json
+import logging
+import pathlib
+
+import flask
+
+from azureml_inference_server_http.server.warmup import get_warmup_payloads
+from .common import TestingUserScript
+
+
+def test_warmup_file(app: flask.Flask, tmp_path: pathlib.Path, config, caplog):
+    """Ensure the warm-up payload is sent to run() when the worker is set up."""
+
+    warmup_file = tmp_path / "warmup.json"
+    warmup_file.write_text(json.dumps({"num": 5}))
+    config.model_warmup_file = str(warmup_file)
+
+    app.azml_blueprint.user_script = app.user_script = TestingUserScript("simple_schema.py")
+    with caplog.at_level(logging.INFO, logger="azmlinfsrv"):
+        app.azml_blueprint.setup()
+
+    assert app.last_run.input == {"num": 5}
+    assert app.last_run.output == 15
+    assert any(message.startswith("Warm-up request 1/1 completed in") for _, _, message in caplog.record_tuples)
+
+
+def test_warmup_file_in_app_root(app: flask.Flask, tmp_path: pathlib.Path, config):
+    """Ensure warmup.json is picked up from the app root."""
+
+    (tmp_path / "warmup.json").write_text(json.dumps({"a": 1}))
+    config.app_root = str(tmp_path)
+
+    assert get_warmup_payloads(app.user_script) == [b'{"a": 1}']
+
+
+def test_warmup_schema_example(app: flask.Flask, config):
+    """Ensure the inference-schema example is used only when enabled."""
+
+    app.azml_blueprint.user_script = app.user_script = TestingUserScript("simple_schema.py")
+    app.azml_blueprint.setup()
+    assert app.last_run is None
+
+    config.warmup_from_schema = True
+    app.azml_blueprint.setup()
+    assert app.last_run.input == {"num": 1}
+
+
+def test_warmup_failure(app: flask.Flask, tmp_path: pathlib.Path, config, caplog):
+    """Ensure a failing warm-up request is logged without stopping the worker."""
+
+    warmup_file = tmp_path / "warmup.json"
+    warmup_file.write_text(json.dumps({"num": "not a number"}))
+    config.model_warmup_file = str(warmup_file)
+
+    app.azml_blueprint.user_script = app.user_script = TestingUserScript("simple_schema.py")
+    with caplog.at_level(logging.ERROR, logger="azmlinfsrv"):
+        app.azml_blueprint.setup()
+
+    assert any(message.startswith("Warm-up request failed") for _, _, message in caplog.record_tuples)
@@ -0,0 +1,103 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import os
+import signal
+import subprocess
+import sys
+
+import pytest
+
+from azureml_inference_server_http.server import worker_recycler
+from azureml_inference_server_http.server.worker_recycler import WorkerRecycler
+from .common import TestingApp, TestingClient
+
+
+@pytest.fixture()
+def kills(monkeypatch):
+    """Record the signals the recycler sends to this process instead of sending them."""
+    sent = []
+    real_kill = os.kill
+
+    def kill(pid, sig):
+        if pid == os.getpid() and sig == signal.SIGTERM:
+            sent.append(pid)
+        else:
+            real_kill(pid, sig)
+
+    monkeypatch.setattr(os, "kill", kill)
+    return sent
+
+
+def test_worker_recycler_max_requests(tmp_path, kills):
+    recycler = WorkerRecycler(3, 0, 0, lock_dir=str(tmp_path))
+    recycler.on_ready()
+
+    assert recycler.after_request() is None
+    assert recycler.after_request() is None
+    assert recycler.after_request() == "served 3 requests"
+    assert kills == [os.getpid()]
+
+    # The worker is draining, it is not recycled twice.
+    assert recycler.after_request() is None
+    assert kills == [os.getpid()]
+
+
+def test_worker_recycler_jitter(tmp_path):
+    limits = {WorkerRecycler(10, 5, 0, lock_dir=str(tmp_path)).request_limit for _ in range(50)}
+    assert limits <= set(range(10, 16))
+    assert len(limits) > 1
+
+
+def test_worker_recycler_max_memory(tmp_path, kills, monkeypatch):
+    recycler = WorkerRecycler(0, 0, 100, lock_dir=str(tmp_path))
+    recycler.on_ready()
+
+    monkeypatch.setattr(worker_recycler, "get_rss", lambda: 50 * 1024 * 1024)
+    assert recycler.after_request() is None
+
+    monkeypatch.setattr(worker_recycler, "get_rss", lambda: 150 * 1024 * 1024)
+    assert recycler.after_request() == "resident memory of 150 MB exceeds 100 MB"
+    assert kills == [os.getpid()]
+
+
+def test_worker_recycler_one_at_a_time(tmp_path, kills):
+    first = WorkerRecycler(1, 0, 0, lock_dir=str(tmp_path))
+    second = WorkerRecycler(1, 0, 0, lock_dir=str(tmp_path))
+
+    assert first.after_request() is not None
+    # The first recycled worker is still draining.
+    assert second.after_request() is None
+
+    # Pretend the first worker has exited: its replacement is not ready yet.
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    with open(first.lock_path, "w") as fp:
+        fp.write(str(process.pid))
+    assert second.after_request() is None
+
+    # Once the replacement is ready, the next worker can be recycled.
+    WorkerRecycler(1, 0, 0, lock_dir=str(tmp_path)).on_ready()
+    assert second.after_request() is not None
+    assert len(kills) == 2
+
+
+def test_worker_recycler_replacement_ready_before_exit(tmp_path, kills):
+    first = WorkerRecycler(1, 0, 0, lock_dir=str(tmp_path))
+    second = WorkerRecycler(1, 0, 0, lock_dir=str(tmp_path))
+    assert first.after_request() is not None
+
+    # The replacement became ready while the recycled worker (this process) is still draining.
+    WorkerRecycler(1, 0, 0, lock_dir=str(tmp_path)).on_ready()
+    assert second.after_request() is None
+
+
+def test_worker_recycler_after_request(app: TestingApp, client: TestingClient, tmp_path, kills, monkeypatch):
+    monkeypatch.setattr(app.azml_blueprint, "worker_recycler", WorkerRecycler(1, 0, 0, lock_dir=str(tmp_path)))
+
+    # Only workers managed by gunicorn are recycled.
+    assert client.get_score().status_code == 200
+    assert kills == []
+
+    assert client.get_score(environ_base={"SERVER_SOFTWARE": "gunicorn/23.0.0"}).status_code == 200
+    assert kills == [os.getpid()]